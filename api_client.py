@@ -45,8 +45,13 @@ class APIClient:
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Закрывает HTTP-клиент (для экземпляров, живущих дольше одного async with)"""
         if self.client:
             await self.client.aclose()
+            self.client = None
     
     async def get_application_data(self, crm_id: str) -> Optional[ApplicationData]:
         """Получает данные заявки по CRM ID"""
@@ -75,6 +80,8 @@ class APIClient:
             Словарь {crm_id: {address, complex, price, area}} с данными из API
         """
         result = {}
+        # Повторные CRM ID дали бы лишние запросы к API с тем же ответом
+        crm_ids = list(dict.fromkeys(crm_ids))
         
         # Разбиваем на батчи
         total_batches = (len(crm_ids) + batch_size - 1) // batch_size
@@ -0,0 +1,13 @@
+"""
+Общие регулярные выражения и таблица замен для нормализации названий ЖК.
+Компилируются один раз при импорте; таблицы синонимов у модулей свои
+"""
+
+import re
+
+# Служебные слова в названии ЖК (удаляются как подстроки) и артефакты "блок X" / "очередь" (целыми словами)
+COMPLEX_WORDS_RE = re.compile(r"жилой комплекс|residential|residence|complex|жк")
+COMPLEX_NOISE_RE = re.compile(r"\bблок\s+[a-zа-я0-9]+\b|\bочередь\b")
+# Разделители в названии ЖК -> пробел, одним проходом str.translate
+COMPLEX_TRANSLATE = str.maketrans({ch: ' ' for ch in '"\'«».,;:()[]{}/\\-–_'})
+DASH_TAIL_RE = re.compile(r"\b(\d+)\s*\-\s*\d+\b")  # Числовой хвост "2-1" -> "2"
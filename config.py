@@ -113,9 +113,20 @@ RECALL_MAX_AGE_HOURS = int(os.getenv('RECALL_MAX_AGE_HOURS', '24'))  # Макс
 
 # Настройки батчинга для БД
 DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '150'))
+# DB_POOL_SIZE + DB_MAX_OVERFLOW должно оставаться меньше max_connections PostgreSQL с запасом
+# под служебные подключения (миграции, psql, другие инстансы бота)
 DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
 DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
 DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '1024'))  # Подготовленных выражений на соединение
+DB_QUERY_CACHE_SIZE = int(os.getenv('DB_QUERY_CACHE_SIZE', '1200'))  # Скомпилированных выражений SQLAlchemy на движок
+DB_AGENT_PAGE_BATCH_DELAY_MS = int(os.getenv('DB_AGENT_PAGE_BATCH_DELAY_MS', '5'))  # Окно склейки запросов страниц агентов
+DB_AGENT_PAGE_BATCH_MAX = int(os.getenv('DB_AGENT_PAGE_BATCH_MAX', '16'))  # Максимум запросов в одной склейке
+DB_STREAM_YIELD_PER = int(os.getenv('DB_STREAM_YIELD_PER', '1000'))  # Строк за одну выборку серверного курсора
+DB_STATS_CACHE_TTL = int(os.getenv('DB_STATS_CACHE_TTL', '60'))  # Секунд жизни кеша сводной статистики ADMIN_VIEW
+DB_CATEGORY_BATCH_SIZE = int(os.getenv('DB_CATEGORY_BATCH_SIZE', '1000'))  # Строк в одном UPDATE ... FROM VALUES категорий (5 параметров на строку)
+DB_BACKFILL_CHUNK_SIZE = int(os.getenv('DB_BACKFILL_CHUNK_SIZE', '10000'))  # Строк в одной транзакции массового заполнения категории 'С'
+DB_AGENT_COUNTS_TTL = int(os.getenv('DB_AGENT_COUNTS_TTL', '300'))  # Секунд между обновлениями сводки mv_agent_counts для поиска РОП/МОП
 
 # Настройки таймаутов HTTP
 HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30.0'))
@@ -37,6 +37,17 @@ CREATE INDEX IF NOT EXISTS idx_parsed_properties_latest
 ON parsed_properties(krisha_id, stats_agent_given, krisha_date DESC) 
 WHERE krisha_id IS NOT NULL AND krisha_id != '';
 
+-- Частичные индексы по свободным объектам (ещё не выданы агенту): лента get_latest_parsed_properties
+-- и выдача по категориям в assign_latest_parsed_properties (SELECT vitrina_id — index-only scan).
+-- Предикат должен совпадать с запросами дословно
+CREATE INDEX IF NOT EXISTS idx_parsed_properties_free 
+ON parsed_properties(krisha_date DESC NULLS LAST, vitrina_id DESC) 
+WHERE krisha_id IS NOT NULL AND krisha_id != '' AND stats_agent_given IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_parsed_properties_free_category 
+ON parsed_properties(stats_object_category, krisha_date DESC NULLS LAST, vitrina_id DESC) 
+WHERE krisha_id IS NOT NULL AND krisha_id != '' AND stats_agent_given IS NULL;
+
 -- Индекс для сортировки по stats_time_given (используется в ORDER BY)
 CREATE INDEX IF NOT EXISTS idx_parsed_properties_time_given 
 ON parsed_properties(stats_time_given DESC NULLS LAST);
@@ -56,32 +67,62 @@ WHERE krisha_id IS NOT NULL AND krisha_id != ''
 -- ============================================
 -- Индексы для таблицы properties
 -- ============================================
+-- Текстовые предикаты запросов и индексы, которые их обслуживают (генерируемые lower/norm-колонки не нужны):
+--   ФИО агента: col ILIKE :surname_like AND col ILIKE :name_like   -> idx_properties_{mop,rop,dd}_trgm
+--   любая роль: OR трёх таких пар (_WHERE_AGENT)                  -> BitmapOr по трём триграммным индексам
+--   категория:  UPPER(category) IN (:cat, :cat_cyr)                -> idx_properties_category_upper
+--   активные:   status IS NULL OR LOWER(status) != 'реализовано'   -> idx_properties_active_modified
+-- Менять текст предиката в database_postgres.py можно только вместе с соответствующим индексом
 
 -- Индекс для поиска по category (используется в WHERE и GROUP BY)
 CREATE INDEX IF NOT EXISTS idx_properties_category 
 ON properties(category) 
 WHERE category IS NOT NULL;
 
--- Индексы для поиска по агентам с использованием LOWER() для case-insensitive поиска
--- Для mop
-CREATE INDEX IF NOT EXISTS idx_properties_mop_lower 
-ON properties(LOWER(mop)) 
-WHERE mop IS NOT NULL;
+-- Индекс по выражению для фильтров категорий в списках объектов: UPPER(category) IN (:cat, :cat_cyr)
+CREATE INDEX IF NOT EXISTS idx_properties_category_upper 
+ON properties(UPPER(category)) 
+WHERE category IS NOT NULL;
+
+-- Частичный индекс для записей без категории (automate_categories_missing_only, set_category_c_for_missing).
+-- Предикат запросов должен совпадать с индексным дословно: category IS NULL OR category = ''
+-- Пробельные значения один раз приводятся к NULL в ensure_schema_with_backup до создания индекса
+CREATE INDEX IF NOT EXISTS idx_properties_missing_category 
+ON properties(crm_id) 
+WHERE category IS NULL OR category = '';
+
+-- Btree-индексы по LOWER(mop/rop/dd/client_name) не подходят для LIKE '%...%' и запросами больше не используются:
+-- поиск по ФИО и клиенту идёт через ILIKE по самой колонке (триграммные индексы ниже)
+DROP INDEX IF EXISTS idx_properties_mop_lower;
+DROP INDEX IF EXISTS idx_properties_rop_lower;
+DROP INDEX IF EXISTS idx_properties_dd_lower;
+DROP INDEX IF EXISTS idx_properties_client_name;
+
+-- Триграммные индексы для поиска подстрок (ILIKE '%...%') по агентам и имени клиента
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_properties_mop_trgm 
+ON properties USING gin (mop gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_properties_rop_trgm 
+ON properties USING gin (rop gin_trgm_ops);
 
--- Для rop
-CREATE INDEX IF NOT EXISTS idx_properties_rop_lower 
-ON properties(LOWER(rop)) 
-WHERE rop IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_properties_dd_trgm 
+ON properties USING gin (dd gin_trgm_ops);
 
--- Для dd
-CREATE INDEX IF NOT EXISTS idx_properties_dd_lower 
-ON properties(LOWER(dd)) 
-WHERE dd IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_properties_client_name_trgm 
+ON properties USING gin (client_name gin_trgm_ops);
 
--- Индекс для поиска по client_name (используется в поиске с LIKE)
-CREATE INDEX IF NOT EXISTS idx_properties_client_name 
-ON properties(LOWER(client_name)) 
-WHERE client_name IS NOT NULL;
+-- Индексы по последним 10 цифрам телефона в полях агентов (поиск агента по номеру при входе)
+-- Оптимизирует: WHERE right(regexp_replace(mop, '\D', '', 'g'), 10) = :last10
+CREATE INDEX IF NOT EXISTS idx_properties_mop_phone10 
+ON properties(right(regexp_replace(mop, '\D', '', 'g'), 10));
+
+CREATE INDEX IF NOT EXISTS idx_properties_rop_phone10 
+ON properties(right(regexp_replace(rop, '\D', '', 'g'), 10));
+
+CREATE INDEX IF NOT EXISTS idx_properties_dd_phone10 
+ON properties(right(regexp_replace(dd, '\D', '', 'g'), 10));
 
 -- Составной индекс для поиска по агенту и категории
 CREATE INDEX IF NOT EXISTS idx_properties_agent_category 
@@ -92,6 +133,32 @@ WHERE category IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_properties_modified_at 
 ON properties(last_modified_at DESC);
 
+-- Частичный индекс по активным объектам (списки с фильтром ACTIVE_STATUS_FILTER / _ACTIVE_STATUS_SQL, ORDER BY last_modified_at DESC).
+-- Предикат должен совпадать с запросами дословно, иначе планировщик индекс не выберет
+CREATE INDEX IF NOT EXISTS idx_properties_active_modified 
+ON properties(last_modified_at DESC) 
+WHERE status IS NULL OR LOWER(status) != 'реализовано';
+
+-- Составной индекс для keyset-пагинации контрактов
+-- Оптимизирует: WHERE (last_modified_at, crm_id) < (:ts, :crm_id) ORDER BY last_modified_at DESC, crm_id DESC
+CREATE INDEX IF NOT EXISTS idx_properties_modified_crm 
+ON properties(last_modified_at DESC, crm_id DESC);
+
+-- ============================================
+-- Сводка по агентам для поиска РОП/МОП (search_rops_by_name, search_mops_by_name, get_mops_by_rop)
+-- ============================================
+-- Несколько сотен строк (mop, rop, dd, cnt) вместо агрегации всей properties на каждый запрос.
+-- Обновляется фоновыми задачами приложения (REFRESH ... CONCURRENTLY): раз в DB_AGENT_COUNTS_TTL секунд
+-- и после смены mop/rop/dd через бота. Запросы пользователей сводку только читают
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_agent_counts AS
+SELECT mop, rop, dd, COUNT(*) AS cnt
+FROM properties
+GROUP BY mop, rop, dd;
+
+-- Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_agent_counts 
+ON mv_agent_counts(mop, rop, dd);
+
 -- ============================================
 -- Статистика для оптимизатора запросов
 -- ============================================
@@ -1,7 +1,9 @@
-import logging, gspread, os, re, asyncio
-from typing import Dict, List, Optional, Tuple, Any
+import logging, gspread, os, re, asyncio, time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Any, Iterable, Callable
 from datetime import datetime
-from sqlalchemy import text, func, and_, or_, select, update, Table, Column, String, Integer, BigInteger, Boolean, Date, DateTime, MetaData, Float, Text
+from sqlalchemy import text, func, and_, or_, select, update, values, column, case, cast, literal, literal_column, union_all, tuple_, bindparam, Table, Column, String, Integer, BigInteger, Boolean, Date, DateTime, MetaData, Float, Text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -13,12 +15,21 @@ from config import (
     DB_POOL_SIZE,
     DB_MAX_OVERFLOW,
     DB_POOL_RECYCLE,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_QUERY_CACHE_SIZE,
+    DB_AGENT_PAGE_BATCH_DELAY_MS,
+    DB_AGENT_PAGE_BATCH_MAX,
+    DB_STREAM_YIELD_PER,
+    DB_STATS_CACHE_TTL,
+    DB_CATEGORY_BATCH_SIZE,
+    DB_BACKFILL_CHUNK_SIZE,
     AGENTS_PHONES_SHEET_GID,
     AGENTS_COOL_CALLS_GID,
     KRISHA_URL_TEMPLATE,
     RECALL_MAX_AGE_HOURS,
 )
 from api_client import APIClient
+from complex_names import COMPLEX_WORDS_RE, COMPLEX_NOISE_RE, COMPLEX_TRANSLATE, DASH_TAIL_RE
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +37,53 @@ def chunk_list(items: List[Any], size: int) -> List[List[Any]]:
     for idx in range(0, len(items), size):
         yield items[idx:idx + size]
 
+# Регулярные выражения компилируются один раз при импорте модуля (общие шаблоны названий ЖК — в complex_names)
+# Разделители для упрощённой нормализации ЖК (без «–» и «_») -> пробел, одним проходом str.translate
+_COMPLEX_TRANSLATE_BASIC = str.maketrans({ch: ' ' for ch in '"\'«».,;:()[]{}/\\-'})
+_PHONE_DIGITS_RE = re.compile(r'\d{9,}')
+_NON_DIGIT_RE = re.compile(r"\D")
+
+# Транслитерации и синонимы токенов в названиях ЖК
+_COMPLEX_SYNONYMS = {
+    'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
+    'qalashyq': 'калашык', 'qalashy': 'калашык', 'qurylys': 'курылыс', 'exclusive': 'эксклюзив',
+    'jyray': 'жырау', 'dauletti': 'даулетти', 'qalashyk': 'калашык',
+    'city': 'city', 'sat': 'sat'
+}
+
+
+@lru_cache(maxsize=8192)
+def _norm_complex(x: str) -> str:
+    """Нормализует название ЖК для сопоставления листа с БД и API (названия сильно повторяются — кешируем)"""
+    s = COMPLEX_WORDS_RE.sub(' ', (x or '').lower()).translate(COMPLEX_TRANSLATE)
+    # Удаляем конструкции вида "блок X" и слова-артефакты
+    s = COMPLEX_NOISE_RE.sub(" ", s)
+    # Схлопываем числовые хвосты вида "2-1" -> "2"
+    s = DASH_TAIL_RE.sub(r"\1", s)
+    # Токен-уровневая нормализация (транслитерации и синонимы); split() заодно схлопывает пробелы
+    return ' '.join(_COMPLEX_SYNONYMS.get(t, t) for t in s.split())
+
+
+@lru_cache(maxsize=8192)
+def _norm_complex_basic(x: str) -> str:
+    """Упрощённая нормализация названия ЖК (automate_categories_missing_only): без синонимов и хвостов"""
+    s = COMPLEX_WORDS_RE.sub(' ', (x or '').lower()).translate(_COMPLEX_TRANSLATE_BASIC)
+    return ' '.join(s.split())
+
+
+@lru_cache(maxsize=8192)
+def _to_float_safe(v) -> Optional[float]:
+    """Число из ячейки листа ("1 234,5" -> 1234.5); пустое или нечисловое значение -> None"""
+    try:
+        s = str(v).replace(' ', '').replace('\u00A0', '')
+        s = s.replace(',', '.')
+        if s.strip() == '':
+            return None
+        return float(s)
+    except Exception:
+        return None
+
+
 # SQLAlchemy Core table definition (safe subset covering used columns)
 metadata = MetaData()
 properties = Table(
@@ -102,11 +160,823 @@ parsed_properties_table = Table(
     Column("updated_at", DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now()),
 )
 
+# Соответствие колонок properties ключам старого API: (колонка БД, ключ API, значение по умолчанию).
+# Порядок совпадает с колонками таблицы properties
+_LEGACY_FIELD_MAP: Tuple[Tuple[str, str, Any], ...] = (
+    ('crm_id', 'CRM ID', ''),
+    ('date_signed', 'Дата подписания', ''),
+    ('contract_number', 'Номер договора', ''),
+    ('mop', 'МОП', ''),
+    ('rop', 'РОП', ''),
+    ('dd', 'ДД', ''),
+    ('client_name', 'Имя клиента и номер', ''),
+    ('address', 'Адрес', ''),
+    ('complex', 'ЖК', ''),
+    ('contract_price', 'Цена указанная в договоре', ''),
+    ('expires', 'Истекает', ''),
+    ('category', 'category', ''),
+    ('area', 'area', None),
+    ('rooms_count', 'rooms_count', None),
+    ('krisha_price', 'krisha_price', None),
+    ('vitrina_price', 'vitrina_price', None),
+    ('score', 'score', None),
+    ('collage', 'collage', False),
+    ('prof_collage', 'prof_collage', False),
+    ('krisha', 'krisha', ''),
+    ('instagram', 'instagram', ''),
+    ('tiktok', 'tiktok', ''),
+    ('mailing', 'mailing', ''),
+    ('stream', 'stream', ''),
+    ('shows', 'shows', 0),
+    ('analytics', 'analytics', False),
+    ('price_update', 'price_update', ''),
+    ('provide_analytics', 'provide_analytics', False),
+    ('push_for_price', 'push_for_price', False),
+    ('status', 'status', 'Размещено'),
+    ('last_modified_by', 'last_modified_by', 'SHEET'),
+    ('last_modified_at', 'last_modified_at', ''),
+    ('created_at', 'created_at', ''),
+)
+
+# Строка select(properties) раскладывается в legacy-словарь через zip, без промежуточного dict(row._mapping)
+_LEGACY_KEYS: Tuple[str, ...] = tuple(dst for _, dst, _ in _LEGACY_FIELD_MAP)
+
+
+# Для text()-запросов: колонки в порядке _LEGACY_FIELD_MAP, чтобы строку можно было отдать в _legacy_from_row.
+# SELECT * не годится — физический порядок колонок в БД может отличаться после миграций
+_LEGACY_SELECT_SQL = "SELECT " + ", ".join(src for src, _, _ in _LEGACY_FIELD_MAP) + " FROM properties"
+
+
+def _legacy_from_row(row) -> Dict[str, Any]:
+    """Преобразует строку select(properties) в формат, совместимый со старым API"""
+    return dict(zip(_LEGACY_KEYS, row))
+
+
+async def _collect_legacy(result) -> List[Dict[str, Any]]:
+    """Собирает потоковый результат (yield_per) в legacy-словари порциями: одно ожидание на порцию, а не на строку"""
+    contracts: List[Dict[str, Any]] = []
+    async for partition in result.partitions():
+        contracts.extend(map(_legacy_from_row, partition))
+    return contracts
+
+
+# Колонки списков parsed_properties (лента новых объектов, объекты агента): строка → dict через zip по кортежу
+_PARSED_LIST_COLUMNS: Tuple[str, ...] = (
+    "vitrina_id", "rbd_id", "krisha_id", "krisha_date", "object_type", "address",
+    "complex", "builder", "flat_type", "property_class", "condition", "sell_price",
+    "sell_price_per_m2", "house_num", "floor_num", "floor_count", "room_count",
+    "phones", "description", "ceiling_height", "area", "year_built", "wall_type",
+    "stats_agent_given", "stats_time_given", "stats_object_status", "stats_recall_time", "stats_description",
+)
+_PARSED_LIST_SQL = "SELECT " + ", ".join(_PARSED_LIST_COLUMNS) + " FROM parsed_properties"
+# Карточка объекта — колонки списка плюс категория
+_PARSED_DETAIL_COLUMNS: Tuple[str, ...] = _PARSED_LIST_COLUMNS + ("stats_object_category",)
+_SELECT_PARSED_BY_VITRINA_ID = text(
+    "SELECT " + ", ".join(_PARSED_DETAIL_COLUMNS) + " FROM parsed_properties WHERE vitrina_id = :vitrina_id"
+)
+
+
+def _free_parsed_pick_sql(category: str, use_filter: bool) -> str:
+    """Ветка выбора свободных объектов категории для assign_latest_parsed_properties.
+
+    Предикат «свободный объект» совпадает с idx_parsed_properties_free_category. С фильтром по классам
+    подходящие объекты идут первыми, затем остальные по дате — то же, что «сначала с фильтром, затем добор без него».
+    """
+    category_where = (
+        "(stats_object_category = 'C' OR stats_object_category IS NULL)" if category == 'C'
+        else f"stats_object_category = '{category}'"
+    )
+    filter_order = "COALESCE(property_class = ANY(:classes), false) DESC, " if use_filter else ""
+    return (
+        f"pick_{category.lower()} AS ("
+        f"SELECT '{category}' AS category, vitrina_id FROM parsed_properties "
+        f"WHERE krisha_id IS NOT NULL AND krisha_id != '' AND stats_agent_given IS NULL AND {category_where} "
+        f"ORDER BY {filter_order}krisha_date DESC NULLS LAST, vitrina_id DESC "
+        f"LIMIT :limit_{category.lower()} FOR UPDATE SKIP LOCKED)"
+    )
+
+
+# Кандидаты A/B/C одним запросом; ключ — задан ли фильтр по классам (параметры :limit_a/:limit_b/:limit_c[, :classes]).
+# FOR UPDATE запрещён в ветках UNION, поэтому каждая блокирующая выборка вынесена в свой CTE
+_SELECT_FREE_PARSED_BY_CATEGORY: Dict[bool, Any] = {
+    use_filter: text(
+        "WITH " + ", ".join(_free_parsed_pick_sql(c, use_filter) for c in ('A', 'B', 'C'))
+        + " SELECT * FROM pick_a UNION ALL SELECT * FROM pick_b UNION ALL SELECT * FROM pick_c"
+    )
+    for use_filter in (False, True)
+}
+
+
+def _convert_legacy(record) -> Dict[str, Any]:
+    """Преобразует запись из БД (dict или RowMapping) в формат, совместимый со старым API"""
+    return {dst: record.get(src, default) for src, dst, default in _LEGACY_FIELD_MAP}
+
+
+# Сколько секунд automate_categories* могут переиспользовать уже загруженный третий лист
+_AUTOMATE_SHEET_MAX_AGE = 300
+
+
+def _assign_category(contract_price, window_price, roof_price, score) -> str:
+    """Категория A/B/C (латиницей) по цене договора, ценам витрины/крыши и общему баллу; SQL-версия — _category_case.
+
+    Числом считаются только int/float: значения других типов ведут себя как отсутствующие.
+    """
+    prices_known = (isinstance(contract_price, (int, float)) and isinstance(window_price, (int, float))
+                    and isinstance(roof_price, (int, float)))
+    if isinstance(score, (int, float)):
+        if prices_known:
+            if window_price <= contract_price <= roof_price and score > 8:
+                return 'A'
+            if contract_price < window_price or contract_price > roof_price or 5 <= score <= 8:
+                return 'B'
+    elif prices_known and window_price <= contract_price <= roof_price:
+        return 'B'
+    return 'C'
+
+
+def _category_case(contract_price, window_price, roof_price, score):
+    """SQL-аналог _assign_category: CASE по цене договора, ценам витрины/крыши и общему баллу (категории кириллицей)"""
+    prices_known = and_(contract_price.isnot(None), window_price.isnot(None), roof_price.isnot(None))
+    in_window = contract_price.between(window_price, roof_price)
+    return case(
+        (and_(score.isnot(None), prices_known), case(
+            (and_(in_window, score > 8), 'А'),
+            (or_(contract_price < window_price, contract_price > roof_price, score.between(5, 8)), 'В'),
+            else_='С',
+        )),
+        (and_(score.is_(None), prices_known, in_window), 'В'),
+        else_='С',
+    )
+
+
+# Ключи старого API (заголовки таблицы и имена полей бота) -> колонки properties для update_contract.
+# Обратная сторона _LEGACY_FIELD_MAP, строится один раз при импорте
+_DB_KEY_MAP: Dict[str, str] = {dst: src for src, dst, _ in _LEGACY_FIELD_MAP}
+
+
+# Пустая категория: совпадает с предикатом частичного индекса idx_properties_missing_category.
+# Пробельные значения в колонку не пишутся (update_contract делает strip), поэтому TRIM не нужен
+_MISSING_CATEGORY_WHERE = "category IS NULL OR category = ''"
+
+# Одна порция заполнения категории 'С': crm_id берутся из частичного индекса idx_properties_missing_category
+_UPDATE_MISSING_CATEGORY_CHUNK = text(f"""
+    UPDATE properties
+    SET category = 'С',
+        last_modified_by = 'BOT',
+        last_modified_at = NOW()
+    WHERE crm_id IN (
+        SELECT crm_id FROM properties
+        WHERE {_MISSING_CATEGORY_WHERE}
+        LIMIT :chunk
+        FOR UPDATE SKIP LOCKED
+    )
+""")
+
+
+# Активные (не реализованные) объекты: предикат совпадает с частичным индексом idx_properties_active_modified.
+# Литерал встраивается в SQL, а не передаётся параметром — иначе generic-план не сможет доказать
+# совпадение с предикатом индекса
+_ACTIVE_STATUS_SQL = "(status IS NULL OR LOWER(status) != 'реализовано')"
 ACTIVE_STATUS_FILTER = or_(
     properties.c.status.is_(None),
-    func.lower(properties.c.status) != 'реализовано'
+    func.lower(properties.c.status) != literal_column("'реализовано'")
 )
 
+
+# Латинские категории и их кириллические двойники (в базе встречаются оба написания)
+_CATEGORY_CYR: Dict[str, str] = {'A': 'А', 'B': 'В', 'C': 'С'}
+
+
+def _category_totals(cat_rows) -> Dict[str, int]:
+    """Сводка total/cat_A/cat_B/cat_C из строк (category, cnt) запроса с GROUP BY category.
+
+    GROUP BY включает и группу NULL, поэтому total — сумма всех групп, отдельный COUNT(*) не нужен.
+    """
+    cats: Dict[str, int] = {}
+    for category, cnt in cat_rows:
+        key = (category or '').strip().upper()
+        # Латиница и кириллица — одна категория (как в _WHERE_CATEGORY)
+        key = _CATEGORY_CYR.get(key, key)
+        cats[key] = cats.get(key, 0) + cnt
+    return {
+        'total': sum(cats.values()),
+        'cat_A': cats.get('А', 0),
+        'cat_B': cats.get('В', 0),
+        'cat_C': cats.get('С', 0),
+    }
+
+
+# Таблица str.translate, удаляющая все ASCII-символы кроме цифр за один проход на C
+_ASCII_NON_DIGITS = str.maketrans('', '', ''.join(chr(i) for i in range(128) if not chr(i).isdigit()))
+# Префикс страны по длине номера без него: 10 цифр -> 7XXXXXXXXXX, 9 цифр -> 77XXXXXXXXX (Казахстан)
+_PHONE_PREFIX_BY_LEN = {10: '7', 9: '77'}
+
+
+def _digits_only(phone: str) -> str:
+    """Оставляет в строке только цифры"""
+    digits = phone.translate(_ASCII_NON_DIGITS)
+    if not digits.isascii():
+        # Редкий случай не-ASCII символов — посимвольная проверка
+        digits = ''.join(c for c in digits if c.isdigit())
+    return digits
+
+
+@lru_cache(maxsize=4096)
+def normalize_phone(phone: str) -> str:
+    """Нормализует номер телефона"""
+    if not phone:
+        return ""
+    
+    digits_only = _digits_only(phone)
+    
+    # 11 цифр: ведущая 8 заменяется на 7, иначе номер оставляем как есть
+    if len(digits_only) == 11:
+        return '7' + digits_only[1:] if digits_only[0] == '8' else digits_only
+    
+    return _PHONE_PREFIX_BY_LEN.get(len(digits_only), '') + digits_only
+
+
+@lru_cache(maxsize=4096)
+def _parse_fio(agent_name: str) -> Tuple[str, str, str, str]:
+    """Разбирает ФИО агента (Фамилия Имя [Отчество]) в (фамилия, имя, LIKE-шаблон фамилии, LIKE-шаблон имени).
+
+    Фамилия и имя возвращаются в нижнем регистре; результат кешируется — ФИО агентов повторяются на каждой странице.
+    """
+    fio_parts = str(agent_name).split()
+    surname = fio_parts[0].lower() if fio_parts else ''
+    name = fio_parts[1].lower() if len(fio_parts) > 1 else ''
+    return surname, name, f"%{surname}%", f"%{name}%"
+
+
+@lru_cache(maxsize=4096)
+def _fio_param_items(agent_name: str, prefix: str) -> Tuple[Tuple[str, str], Tuple[str, str]]:
+    """Готовые пары (имя параметра, LIKE-шаблон) для _fio_params: ключи с префиксом тоже не собираются заново"""
+    _, _, surname_like, name_like = _parse_fio(agent_name)
+    return (f"{prefix}surname_like", surname_like), (f"{prefix}name_like", name_like)
+
+
+def _fio_params(agent_name: str, prefix: str = '') -> Dict[str, str]:
+    """Параметры {prefix}surname_like / {prefix}name_like для text()-фильтров по ФИО (новый dict на каждый вызов)"""
+    return dict(_fio_param_items(agent_name, prefix))
+
+
+def _fio_is_empty(agent_name: Optional[str]) -> bool:
+    """Пустое ФИО даёт шаблон '%%' и совпадает со всеми строками — такие запросы в БД не отправляем"""
+    return not agent_name or not _parse_fio(agent_name)[0]
+
+
+# Текстовые WHERE-фрагменты принадлежности агенту для text()-запросов (параметры :surname_like / :name_like);
+# ILIKE по самой колонке обслуживается триграммными индексами idx_properties_*_trgm, LOWER(col) LIKE — нет
+def _fio_where(col: str, prefix: str = '') -> str:
+    """Фрагмент WHERE «колонка col содержит фамилию и имя» под параметры _fio_params(..., prefix)"""
+    return f"({col} ILIKE :{prefix}surname_like AND {col} ILIKE :{prefix}name_like)"
+
+
+_WHERE_AGENT_BY_ROLE: Dict[str, str] = {
+    'МОП': _fio_where('mop'),
+    'РОП': _fio_where('rop'),
+    'ДД': _fio_where('dd'),
+}
+# Агент в любой роли. OR по разным колонкам здесь не мешает индексам: каждая ветвь — пара ILIKE по одной колонке,
+# и планировщик собирает BitmapOr из idx_properties_{mop,rop,dd}_trgm. UNION ALL по ролям дал бы те же три
+# индексных скана, но потребовал бы убирать дубли (агент бывает одновременно МОП и РОП одного объекта)
+_WHERE_AGENT = "(" + " OR ".join(_WHERE_AGENT_BY_ROLE.values()) + ")"
+_ROLE_COLUMN: Dict[str, str] = {'МОП': 'mop', 'РОП': 'rop', 'ДД': 'dd'}
+
+# Сводка числа объектов по связке (mop, rop, dd) из database_optimization.sql: сотни строк вместо всей properties.
+# Обновляется в фоне (refresh_agent_counts), запросы её только читают.
+# Поиск РОП/МОП идёт по ней с теми же ILIKE-предикатами; пустые имена и NULL отсекает `col <> ''` в SQL.
+# Пара (источник, выражение счётчика) — на случай, если сводки нет и приходится агрегировать саму таблицу
+_AGENT_COUNTS_VIEW = ("mv_agent_counts", "SUM(cnt)::bigint")
+_AGENT_COUNTS_TABLE = ("properties", "COUNT(*)")
+
+# UPPER(category) IN (...) обслуживается индексом idx_properties_category_upper по тому же выражению
+_WHERE_CATEGORY = " AND UPPER(category) IN (:cat, :cat_cyr)"
+
+
+# Готовые параметры для A/B/C и их кириллических написаний — без сборки dict на каждый запрос.
+# Латинская и кириллическая буква дают одну и ту же пару, так что фильтр находит оба написания в БД
+_CATEGORY_PARAMS: Dict[str, Dict[str, str]] = {
+    key: {'cat': lat, 'cat_cyr': cyr}
+    for lat, cyr in _CATEGORY_CYR.items()
+    for key in (lat, cyr, lat.lower(), cyr.lower())
+}
+
+
+def _category_params(category: str) -> Dict[str, str]:
+    """Параметры :cat / :cat_cyr для _WHERE_CATEGORY (только для params.update — общий dict не менять)"""
+    params = _CATEGORY_PARAMS.get(category)
+    if params is not None:
+        return params
+    cat_upper = category.upper()
+    return {'cat': cat_upper, 'cat_cyr': cat_upper}
+
+
+# Невыполненные задачи по каждому объекту — точно как build_pending_tasks:
+# каждая отдельная задача считается отдельно, "Добавить ссылки" — одна задача, даже если не хватает нескольких ссылок.
+# {owner_col} — колонка агента, {where} — фильтр строк; запрос продолжается SELECT ... FROM contract_tasks
+_PENDING_TASKS_CTE = """
+    WITH owner_contracts AS (
+        SELECT 
+            {owner_col} AS owner,
+            COALESCE(collage, false) as has_collage,
+            COALESCE(prof_collage, false) as has_prof_collage,
+            COALESCE(NULLIF(krisha, ''), '') as krisha,
+            COALESCE(NULLIF(instagram, ''), '') as instagram,
+            COALESCE(NULLIF(tiktok, ''), '') as tiktok,
+            COALESCE(NULLIF(mailing, ''), '') as mailing,
+            COALESCE(NULLIF(stream, ''), '') as stream,
+            COALESCE(status, 'Размещено') as status,
+            COALESCE(analytics, false) as has_analytics,
+            COALESCE(provide_analytics, false) as has_provide_analytics,
+            COALESCE(push_for_price, false) as has_push_for_price,
+            COALESCE(NULLIF(NULLIF(price_update, ''), 'None'), '') as price_update
+        FROM properties
+        WHERE {where}
+    ), contract_tasks AS (
+        SELECT 
+            owner,
+            -- Базовые задачи (только для статуса != 'Реализовано')
+            (CASE WHEN status != 'Реализовано' AND NOT has_collage THEN 1 ELSE 0 END) +
+            (CASE WHEN status != 'Реализовано' AND has_collage AND NOT has_prof_collage THEN 1 ELSE 0 END) +
+            -- "Добавить ссылки" - одна задача если хотя бы одна ссылка отсутствует
+            (CASE WHEN status != 'Реализовано' AND (krisha = '' OR instagram = '' OR tiktok = '' OR mailing = '' OR stream = '') THEN 1 ELSE 0 END) +
+            -- Задачи для статуса "Аналитика"
+            (CASE WHEN status = 'Аналитика' AND NOT has_analytics THEN 1 ELSE 0 END) +
+            (CASE WHEN status = 'Аналитика' AND has_analytics AND NOT has_provide_analytics THEN 1 ELSE 0 END) +
+            (CASE WHEN status = 'Аналитика' AND has_provide_analytics AND NOT has_push_for_price THEN 1 ELSE 0 END) +
+            -- Задачи для статуса "Корректировка цены"
+            (CASE WHEN status = 'Корректировка цены' AND NOT has_push_for_price THEN 1 ELSE 0 END) +
+            (CASE WHEN status = 'Корректировка цены' AND price_update = '' THEN 1 ELSE 0 END) +
+            -- "Добавить обновленные ссылки" - одна задача если хотя бы одна ссылка отсутствует
+            (CASE WHEN status = 'Корректировка цены' AND (krisha = '' OR instagram = '' OR tiktok = '' OR mailing = '' OR stream = '') THEN 1 ELSE 0 END) +
+            -- Задача на смену статуса (если все базовые задачи выполнены, но статус не финальный)
+            (CASE WHEN status NOT IN ('Реализовано', 'Аналитика', 'Корректировка цены', 'Задаток/сделка')
+                  AND has_collage AND has_prof_collage
+                  AND krisha != '' AND instagram != '' AND tiktok != '' AND mailing != '' AND stream != '' THEN 1 ELSE 0 END) AS pending
+        FROM owner_contracts
+    )
+"""
+
+
+# Условия принадлежности контракта агенту, собранные один раз: значения передаются при выполнении
+# параметрами surname_like / name_like, поэтому дерево выражения одинаково для всех вызовов
+_SURNAME = bindparam('surname_like')
+_NAME = bindparam('name_like')
+_ROLE_WHERE = {
+    'МОП': and_(properties.c.mop.ilike(_SURNAME), properties.c.mop.ilike(_NAME)),
+    'РОП': and_(properties.c.rop.ilike(_SURNAME), properties.c.rop.ilike(_NAME)),
+    'ДД': and_(properties.c.dd.ilike(_SURNAME), properties.c.dd.ilike(_NAME)),
+}
+_ANY_ROLE = or_(*_ROLE_WHERE.values())
+
+# Выборка контракта по первичному ключу; crm_id передаётся параметром при выполнении
+_SELECT_BY_CRM_ID = select(properties).where(properties.c.crm_id == bindparam('crm_id'))
+
+# Неизменяемые text()-запросы горячих путей собираются один раз: разбор текста и поиск :параметров
+# не повторяются на каждом вызове, а кеш компиляции движка (query_cache_size) получает тот же объект
+_SELECT_AGENT_BY_LAST10 = text(
+    r"SELECT mop AS agent FROM properties WHERE right(regexp_replace(mop, '\D', '', 'g'), 10) = :last10 "
+    r"UNION ALL SELECT rop FROM properties WHERE right(regexp_replace(rop, '\D', '', 'g'), 10) = :last10 "
+    r"UNION ALL SELECT dd FROM properties WHERE right(regexp_replace(dd, '\D', '', 'g'), 10) = :last10 "
+    "LIMIT 1"
+)
+_SELECT_PHONE_BY_AGENT = text(
+    r"SELECT substring(mop FROM '\y[78][0-9]{10}\y') AS phone FROM properties "
+    r"WHERE mop ILIKE :agent_name AND mop ~ '\y[78][0-9]{10}\y' "
+    r"UNION ALL SELECT substring(rop FROM '\y[78][0-9]{10}\y') FROM properties "
+    r"WHERE rop ILIKE :agent_name AND rop ~ '\y[78][0-9]{10}\y' "
+    r"UNION ALL SELECT substring(dd FROM '\y[78][0-9]{10}\y') FROM properties "
+    r"WHERE dd ILIKE :agent_name AND dd ~ '\y[78][0-9]{10}\y' "
+    "LIMIT 1"
+)
+_SELECT_OWNERS_WITH_COUNTS: Dict[str, Any] = {
+    role: text(
+        f"SELECT {col} AS name, COUNT(*) AS cnt "
+        "FROM properties "
+        f"WHERE {col} IS NOT NULL AND {col} <> '' "
+        f"GROUP BY {col} "
+        "ORDER BY cnt DESC NULLS LAST"
+    )
+    for role, col in (('ДД', 'dd'), ('МОП', 'mop'))
+}
+_SELECT_ROP_CATEGORY_COUNTS = text(
+    "SELECT category, COUNT(*) cnt FROM properties "
+    f"WHERE {_WHERE_AGENT_BY_ROLE['РОП']} "
+    "GROUP BY category"
+)
+
+
+def _mop_where(by_rop: bool, by_dd: bool) -> str:
+    """WHERE МОП-а с необязательными фильтрами по РОП-у (:rop_*_like) и ДД (:dd_*_like)"""
+    where = _WHERE_AGENT_BY_ROLE['МОП']
+    if by_rop:
+        where += " AND " + _fio_where('rop', 'rop_')
+    if by_dd:
+        where += " AND " + _fio_where('dd', 'dd_')
+    return where
+
+
+# Все варианты запросов по МОП-у собраны заранее: ключ — (есть фильтр РОП, есть фильтр ДД[, есть категория])
+_FILTER_FLAGS = ((False, False), (False, True), (True, False), (True, True))
+_SELECT_MOP_CATEGORY_COUNTS: Dict[Tuple[bool, bool], Any] = {
+    (by_rop, by_dd): text(
+        f"SELECT category, COUNT(*) cnt FROM properties WHERE {_mop_where(by_rop, by_dd)} GROUP BY category"
+    )
+    for by_rop, by_dd in _FILTER_FLAGS
+}
+_SELECT_MOP_CONTRACTS: Dict[Tuple[bool, bool, bool], Any] = {
+    (by_rop, by_dd, by_cat): text(
+        f"{_LEGACY_SELECT_SQL} WHERE {_mop_where(by_rop, by_dd)}{_WHERE_CATEGORY if by_cat else ''} "
+        f"AND {_ACTIVE_STATUS_SQL} ORDER BY last_modified_at DESC"
+    ).execution_options(yield_per=DB_STREAM_YIELD_PER)
+    for by_rop, by_dd in _FILTER_FLAGS
+    for by_cat in (False, True)
+}
+# Остальные списки объектов по категориям: ключ — (владелец, есть категория, только активные).
+# Владелец: роль из _WHERE_AGENT_BY_ROLE, None — любая из ролей, '*' — вся база
+_CONTRACTS_OWNER_WHERE: Dict[Optional[str], str] = {**_WHERE_AGENT_BY_ROLE, None: _WHERE_AGENT, '*': "1=1"}
+_SELECT_CONTRACTS: Dict[Tuple[Optional[str], bool, bool], Any] = {
+    (owner, by_cat, active): text(
+        f"{_LEGACY_SELECT_SQL} WHERE {where}{_WHERE_CATEGORY if by_cat else ''}"
+        f"{' AND ' + _ACTIVE_STATUS_SQL if active else ''} ORDER BY last_modified_at DESC"
+    ).execution_options(yield_per=DB_STREAM_YIELD_PER)
+    for owner, where in _CONTRACTS_OWNER_WHERE.items()
+    for by_cat in (False, True)
+    for active in (False, True)
+}
+# Сумма невыполненных задач агента (параметры :surname_like / :name_like) и суммы по каждому значению колонки роли
+_SELECT_PENDING_TASKS: Dict[str, Any] = {
+    role: text(
+        _PENDING_TASKS_CTE.format(owner_col=col, where=_WHERE_AGENT_BY_ROLE[role])
+        + "SELECT SUM(pending) FROM contract_tasks"
+    )
+    for role, col in _ROLE_COLUMN.items()
+}
+_SELECT_PENDING_TASKS_BY_OWNER: Dict[str, Any] = {
+    role: text(
+        _PENDING_TASKS_CTE.format(owner_col=col, where=f"{col} IS NOT NULL")
+        + "SELECT owner, SUM(pending) AS pending FROM contract_tasks GROUP BY owner"
+    )
+    for role, col in _ROLE_COLUMN.items()
+}
+
+
+def _agent_role_condition(role: Optional[str], surname_like: str, name_like: str):
+    """Условие принадлежности контракта агенту по роли (МОП/РОП/ДД или любая из них) со значениями внутри.
+
+    Нужен там, где в одном запросе несколько агентов (UNION ALL в пакетной загрузке) и общие
+    параметры _ROLE_WHERE конфликтовали бы; в остальных местах используется _ROLE_WHERE.
+    """
+    if role == 'МОП':
+        return and_(properties.c.mop.ilike(surname_like), properties.c.mop.ilike(name_like))
+    if role == 'РОП':
+        return and_(properties.c.rop.ilike(surname_like), properties.c.rop.ilike(name_like))
+    if role == 'ДД':
+        return and_(properties.c.dd.ilike(surname_like), properties.c.dd.ilike(name_like))
+    return or_(
+        and_(properties.c.mop.ilike(surname_like), properties.c.mop.ilike(name_like)),
+        and_(properties.c.rop.ilike(surname_like), properties.c.rop.ilike(name_like)),
+        and_(properties.c.dd.ilike(surname_like), properties.c.dd.ilike(name_like)),
+    )
+
+
+# Поля владельца по ролям; без роли контракт подходит по любому из полей
+_ROLE_AGENT_FIELDS: Dict[Optional[str], Tuple[str, ...]] = {
+    'МОП': ('mop',),
+    'РОП': ('rop',),
+    'ДД': ('dd',),
+}
+
+
+def _fio_matcher(surname: str, name: str) -> Callable[[str], bool]:
+    """Python-аналог _fio_where для уже загруженных значений в нижнем регистре: обе части ФИО — подстроки.
+
+    Поиск подстроки через `in` выполняется в C; пустая часть (ФИО из одного слова) в проверку не попадает
+    """
+    if not name or name in surname:
+        return lambda value: surname in value
+    if not surname or surname in name:
+        return lambda value: name in value
+    return lambda value: surname in value and name in value
+
+
+def _agent_row_matches(row, role: Optional[str], surname: str, name: str) -> bool:
+    """Python-аналог _agent_role_condition для уже загруженной строки (surname/name в нижнем регистре)"""
+    matches = _fio_matcher(surname, name)
+    mapping = row._mapping
+    for field in _ROLE_AGENT_FIELDS.get(role, ('mop', 'rop', 'dd')):
+        value = mapping[field]
+        if value is not None and matches(value.lower()):
+            return True
+    return False
+
+
+def _after_contract_cursor(last_modified_at: Optional[datetime], crm_id: str):
+    """Условие «после курсора» для порядка last_modified_at DESC NULLS FIRST, crm_id DESC.
+
+    last_modified_at допускает NULL: такие записи идут первыми, а сравнение кортежей с NULL не даёт TRUE,
+    поэтому NULL-ветки расписаны явно.
+    """
+    if last_modified_at is None:
+        return or_(
+            and_(properties.c.last_modified_at.is_(None), properties.c.crm_id < crm_id),
+            properties.c.last_modified_at.isnot(None),
+        )
+    return tuple_(properties.c.last_modified_at, properties.c.crm_id) < tuple_(last_modified_at, crm_id)
+
+
+class _AgentPageBatcher:
+    """Склеивает одновременные запросы страниц контрактов агентов в один запрос к БД.
+
+    Пока ни один запрос не выполняется, страница читается сразу (быстрый путь).
+    Если БД уже занята, новые запросы копятся DB_AGENT_PAGE_BATCH_DELAY_MS миллисекунд
+    (или до DB_AGENT_PAGE_BATCH_MAX штук) и уходят одним UNION ALL запросом;
+    результат раскладывается по ожидающим Future.
+    """
+
+    def __init__(self, manager: 'PostgreSQLManager', delay_ms: int, max_batch: int):
+        self._manager = manager
+        self._delay = max(delay_ms, 0) / 1000
+        self._max_batch = max(max_batch, 1)
+        self._pending: Dict[Tuple[str, int, int, Optional[str]], asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self._inflight = 0
+
+    async def submit(self, agent_name: str, page: int, page_size: int, role: Optional[str]) -> Tuple[List[Dict], int]:
+        key = (str(agent_name), page, page_size, role)
+
+        # Быстрый путь: БД свободна и склеивать не с чем
+        if self._inflight == 0 and not self._pending:
+            self._inflight += 1
+            try:
+                return await self._manager._fetch_agent_contracts_page(*key)
+            finally:
+                self._inflight -= 1
+
+        fut = self._pending.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[key] = fut
+            if len(self._pending) >= self._max_batch:
+                self._flush_now()
+            elif self._flush_task is None:
+                self._flush_task = self._spawn(self._flush_later())
+        # shield: отмена одного ожидающего не должна отменять общий результат
+        return await asyncio.shield(fut)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._delay)
+        self._flush_task = None
+        await self._run(self._take())
+
+    def _flush_now(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._spawn(self._run(self._take()))
+
+    def _take(self) -> Dict[Tuple[str, int, int, Optional[str]], asyncio.Future]:
+        batch, self._pending = self._pending, {}
+        return batch
+
+    async def _run(self, batch: Dict[Tuple[str, int, int, Optional[str]], asyncio.Future]) -> None:
+        if not batch:
+            return
+        self._inflight += 1
+        try:
+            if len(batch) == 1:
+                key = next(iter(batch))
+                results = {key: await self._manager._fetch_agent_contracts_page(*key)}
+            else:
+                results = await self._manager._fetch_agent_contracts_pages(list(batch))
+        except Exception as e:
+            logger.error(f"Ошибка пакетной загрузки страниц контрактов: {e}", exc_info=True)
+            results = {}
+        finally:
+            self._inflight -= 1
+        for key, fut in batch.items():
+            if not fut.done():
+                fut.set_result(results.get(key, ([], 0)))
+
+class _ComplexParams:
+    """Параметры ЖК третьего листа в колоночном виде.
+
+    Ключ (нормализованное название) -> номер строки; roof/score/window — параллельные списки по номеру.
+    Вместо словаря на каждый ЖК храним три списка чисел, а сопоставление возвращает номер строки.
+    """
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.roof: List[Optional[float]] = []
+        self.score: List[Optional[float]] = []
+        self.window: List[Optional[float]] = []
+
+    def add(self, key: str, roof: Optional[float], score: Optional[float], window: Optional[float]) -> None:
+        # Повтор ключа получает новую строку: синонимы, добавленные через alias, остаются на старой
+        self.index[key] = len(self.roof)
+        self.roof.append(roof)
+        self.score.append(score)
+        self.window.append(window)
+
+    def alias(self, key: str, target: str) -> None:
+        if key not in self.index:
+            self.index[key] = self.index[target]
+
+    def get(self, key: str) -> Optional[int]:
+        return self.index.get(key)
+
+    def keys(self):
+        return self.index.keys()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+
+class _TokenIndex:
+    """Обратный индекс токен -> ключи листа для нечёткого сопоставления названий ЖК.
+
+    Жаккар считается только для ключей, у которых есть хотя бы один общий токен с искомым названием;
+    остальные ключи дают нулевую оценку и выиграть не могут. Кандидаты перебираются в исходном порядке
+    ключей, поэтому при равных оценках результат тот же, что у полного перебора.
+    Множества токенов хранятся битовыми масками (int) над словарём токенов листа: пересечение и
+    объединение — это & / | и int.bit_count(), без построения промежуточных set.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys: List[str] = list(keys)
+        self.vocab: Dict[str, int] = {}
+        self.key_masks: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+        for pos, key in enumerate(self.keys):
+            mask = 0
+            for token in set(key.split()):
+                bit = self.vocab.setdefault(token, len(self.vocab))
+                mask |= 1 << bit
+                self.postings.setdefault(token, []).append(pos)
+            self.key_masks.append(mask)
+
+    def best_match(self, norm_name: str, threshold: float = 0.45, subset_rule: bool = True) -> Optional[str]:
+        """Ключ с наибольшим Жаккаром по токенам (не ниже threshold).
+
+        subset_rule: если меньшее множество токенов целиком входит в большее — считаем полноценным совпадением.
+        """
+        name_tokens = set(norm_name.split())
+        if not name_tokens:
+            return None
+        query_mask = 0
+        unknown = 0  # Токены запроса, которых нет ни в одном ключе: входят только в объединение
+        candidates = set()
+        for token in name_tokens:
+            bit = self.vocab.get(token)
+            if bit is None:
+                unknown += 1
+                continue
+            query_mask |= 1 << bit
+            candidates.update(self.postings[token])
+        name_size = len(name_tokens)
+        best_key, best_score = None, 0.0
+        for pos in sorted(candidates):
+            key_mask = self.key_masks[pos]
+            common = query_mask & key_mask
+            score = common.bit_count() / ((query_mask | key_mask).bit_count() + unknown)
+            if subset_rule:
+                # Меньшее множество (при равенстве — запрос) целиком внутри большего
+                if name_size <= key_mask.bit_count():
+                    is_subset = not unknown and common == query_mask
+                else:
+                    is_subset = common == key_mask
+                if is_subset:
+                    score = max(score, 0.999)
+            if score > best_score:
+                best_score, best_key = score, self.keys[pos]
+        return best_key if best_score >= threshold else None
+
+
+def _parse_complex_params(rows: List[List[str]], normalize, dash_aliases: bool = False) -> _ComplexParams:
+    """Строит таблицу параметров ЖК из строк третьего листа (ЖК=A, Крыша=B, Общий балл=C, Витрина=D).
+
+    dash_aliases: дополнительно регистрировать ключ без хвостов вида 2-1.
+    """
+    complex_to_params = _ComplexParams()
+    # Поиск строки заголовков: ищем строку, где есть «ЖК» и/или нужные названия
+    header_row_idx = 0
+    for i, r in enumerate(rows):
+        line = ' '.join(r).lower()
+        if ('жк' in line) or ('крыша' in line) or ('витрина' in line) or ('общий балл' in line):
+            header_row_idx = i
+            break
+
+    def idx_by_name(header: List[str], names: List[str], default: Optional[int] = None) -> Optional[int]:
+        header_low = [h.strip().lower() for h in header]
+        for name in names:
+            if name.lower() in header_low:
+                return header_low.index(name.lower())
+        return default
+
+    header = rows[header_row_idx] if rows else []
+    # Жёсткие индексы по условию: A=ЖК, B=Крыша, C=Общий балл, D=Витрина — с fallback по названиям
+    complex_col = 0 if len(header) >= 1 else idx_by_name(header, ['жк', 'комплекс'])
+    roof_col = 1 if len(header) >= 2 else idx_by_name(header, ['крыша', 'roof'])
+    score_col = 2 if len(header) >= 3 else idx_by_name(header, ['общий балл', 'балл', 'score'])
+    window_col = 3 if len(header) >= 4 else idx_by_name(header, ['витрина', 'window'])
+
+    # Если индексы не определены — считаем A/B/C/D по фиксированным позициям
+    if complex_col is None:
+        complex_col = 0
+    if roof_col is None:
+        roof_col = 1
+    if score_col is None:
+        score_col = 2
+    if window_col is None:
+        window_col = 3
+
+    for i, r in enumerate(rows):
+        if i <= header_row_idx:
+            continue
+        complex_name = (r[complex_col] if complex_col < len(r) else '').strip()
+        if not complex_name:
+            continue
+        roof_raw = r[roof_col] if roof_col < len(r) else ''
+        score_raw = r[score_col] if score_col < len(r) else ''
+        window_raw = r[window_col] if window_col < len(r) else ''
+        key_main = normalize(complex_name)
+        complex_to_params.add(
+            key_main, _to_float_safe(roof_raw), _to_float_safe(score_raw), _to_float_safe(window_raw),
+        )
+        if dash_aliases:
+            # Добавляем облегчённый ключ без хвостов вида 2-1
+            key_variant = DASH_TAIL_RE.sub(r"\1", key_main)
+            if key_variant != key_main:
+                complex_to_params.alias(key_variant, key_main)
+    return complex_to_params
+
+
+class _SubstringIndex:
+    """Индекс n-грамм ключей листа для поиска «все части названия входят в ключ как подстроки».
+
+    Каждый ключ раскладывается на все подстроки длиной 1..3; кандидаты для части — пересечение списков её
+    триграмм (или самой части, если она короче). Кандидаты проверяются в исходном порядке ключей,
+    поэтому результат совпадает с полным перебором.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys: List[str] = list(keys)
+        self.postings: Dict[str, set] = {}
+        for pos, key in enumerate(self.keys):
+            for n in (1, 2, 3):
+                for i in range(len(key) - n + 1):
+                    self.postings.setdefault(key[i:i + n], set()).add(pos)
+
+    def first_containing(self, parts: List[str]) -> Optional[str]:
+        candidates: Optional[set] = None
+        for part in parts:
+            grams = [part] if len(part) <= 3 else [part[i:i + 3] for i in range(len(part) - 2)]
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if not posting:
+                    return None
+                candidates = set(posting) if candidates is None else candidates & posting
+                if not candidates:
+                    return None
+        for pos in sorted(candidates or ()):
+            key = self.keys[pos]
+            if all(p in key for p in parts):
+                return key
+        return None
+
+
+def _find_by_variants(norm_name: str, complex_to_params: _ComplexParams,
+                      substring_index: _SubstringIndex) -> Optional[str]:
+    """Ищет ключ листа, постепенно укорачивая хвост нормализованного названия и убирая числовые токены."""
+    parts = norm_name.split()
+    if not parts:
+        return None
+    for cut in range(0, len(parts)):
+        variant_parts = [p for p in parts[:len(parts) - cut] if not p.isdigit()]
+        if not variant_parts:
+            continue
+        variant_str = ' '.join(variant_parts)
+        # 1) Прямое попадание ключа
+        if variant_str in complex_to_params:
+            return variant_str
+        # 2) Поиск по включению всех частей как подстрок ключа
+        key = substring_index.first_containing(variant_parts)
+        if key:
+            return key
+    return None
+
+
 class PostgreSQLManager:
     """Менеджер для работы с PostgreSQL базой данных"""
     
@@ -116,10 +986,52 @@ class PostgreSQLManager:
         self._third_map_cache: Optional[Dict[str, Dict[str, Optional[float]]]] = None
         self._third_map_cache_time: Optional[datetime] = None
         self._third_map_cache_ttl = 3600  # Кеш на 1 час
+        # Сборка third_map под блокировкой: одновременные upsert-ы не разбирают лист параллельно
+        self._third_map_lock = asyncio.Lock()
+        # Результаты нечёткого поиска ЖК в текущем third_map (сбрасываются при его перезагрузке)
+        self._third_map_matches: Dict[str, Optional[Dict[str, Optional[float]]]] = {}
+        # Обратный индекс токенов по ключам текущего third_map: (third_map, индекс), строится лениво
+        self._third_map_token_index: Optional[Tuple[Dict[str, Dict[str, Optional[float]]], _TokenIndex]] = None
+        # Сырые строки третьего листа: общий источник для third_map и automate_categories*
+        self._third_rows_cache: Optional[List[List[str]]] = None
+        self._third_rows_time: Optional[float] = None
+        self._third_rows_lock = asyncio.Lock()
+        # Индекс телефон -> агент (строится по полям mop/rop/dd)
+        self._phone_to_agent: Optional[Dict[str, str]] = None
+        self._last10_to_agent: Dict[str, str] = {}
+        self._phone_index_time: Optional[datetime] = None
+        self._phone_index_ttl = 600  # Полная перестройка раз в 10 минут
+        # Кеш результатов get_agent_by_phone, включая отрицательные (номер не найден)
+        self._phone_cache: Dict[str, Tuple[float, Optional[str]]] = {}
+        self._phone_cache_ttl = 300
+        # LRU-кеш результатов get_phone_by_agent по имени в нижнем регистре (ILIKE регистр не различает):
+        # не больше _agent_phone_cache_max записей, каждая живёт _phone_cache_ttl секунд
+        self._agent_phone_cache: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._agent_phone_cache_max = 1024
+        # Кеш сводной статистики (счётчики по ДД/МОП/категориям): ключ — (метод, аргументы)
+        self._stats_cache: Dict[Tuple, Tuple[float, Any]] = {}
+        # Общий APIClient для фоновых прогонов категорий (создаётся лениво, закрывается в close())
+        self._api_client: Optional[APIClient] = None
+        # Сводка mv_agent_counts обновляется только в фоне (run_agent_counts_refresher в main.py и задача
+        # после смены mop/rop/dd); запросы лишь выбирают источник по результату последнего обновления.
+        # До первого успешного обновления читаем properties: сводки может ещё не быть
+        self._agent_counts_ok = False
+        self._agent_counts_dirty = False
+        self._agent_counts_lock = asyncio.Lock()
+        self._agent_counts_task: Optional[asyncio.Task] = None
+        self._schema_ready = False
+        self._parsed_schema_ready = False
+        self._agent_page_batcher = _AgentPageBatcher(self, DB_AGENT_PAGE_BATCH_DELAY_MS, DB_AGENT_PAGE_BATCH_MAX)
     
     def _init_database(self):
         """Инициализация подключения к PostgreSQL"""
         try:
+            # Всегда работаем через asyncpg, даже если URL задан без драйвера
+            for prefix in ('postgresql://', 'postgres://'):
+                if self.database_url.startswith(prefix):
+                    self.database_url = 'postgresql+asyncpg://' + self.database_url[len(prefix):]
+                    break
+
             # Создаем асинхронный движок
             self.engine = create_async_engine(
                 self.database_url,
@@ -127,7 +1039,15 @@ class PostgreSQLManager:
                 pool_pre_ping=True,
                 pool_recycle=DB_POOL_RECYCLE,
                 pool_size=DB_POOL_SIZE,
-                max_overflow=DB_MAX_OVERFLOW
+                max_overflow=DB_MAX_OVERFLOW,
+                # Горячие соединения переиспользуются первыми — их кеш подготовленных выражений уже прогрет
+                pool_use_lifo=True,
+                # Кеш скомпилированных выражений SQLAlchemy с запасом, чтобы горячие запросы не вытеснялись
+                query_cache_size=DB_QUERY_CACHE_SIZE,
+                connect_args={
+                    'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+                    'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+                },
             )
             
             # Создаем фабрику сессий
@@ -143,70 +1063,77 @@ class PostgreSQLManager:
             logger.error(f"Ошибка инициализации PostgreSQL: {e}")
             raise
 
+    async def _run_ddl(self, statement: str, semaphore: asyncio.Semaphore) -> Optional[Tuple[str, str]]:
+        """Выполняет одну DDL-команду на отдельном autocommit-соединении.
+
+        Возвращает (команда, ошибка) для неожиданных ошибок и None при успехе или ожидаемой ошибке.
+        """
+        async with semaphore:
+            try:
+                async with self.engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+                    await conn.execute(text(statement))
+                return None
+            except Exception as e:
+                error_str = str(e).lower()
+                # Игнорируем ожидаемые ошибки
+                ignorable_errors = [
+                    'already exists',
+                    'does not exist',
+                    'undefinedtableerror',
+                    'relation',
+                ]
+                if any(err in error_str for err in ignorable_errors):
+                    return None
+                return statement[:80], str(e)
+
     async def apply_database_optimizations(self) -> None:
-        """Применяет оптимизации индексов для улучшения производительности БД"""
+        """Применяет оптимизации индексов для улучшения производительности БД.
+
+        Подготовительные команды (расширения) выполняются первыми, затем индексы строятся параллельно
+        на нескольких соединениях, в конце — ANALYZE и прочие завершающие команды.
+        """
         try:
-            async with self.async_session() as session:
-                # Читаем SQL файл с оптимизациями
-                optimization_file = os.path.join(os.path.dirname(__file__), 'database_optimization.sql')
-                
-                if not os.path.exists(optimization_file):
-                    return
-                
-                with open(optimization_file, 'r', encoding='utf-8') as f:
-                    sql_content = f.read()
-                
-                # Выполняем SQL команды (разделяем по ;)
-                # Пропускаем COMMENT ON INDEX - они вызывают ошибки если индекс не существует
-                statements = []
-                for s in sql_content.split(';'):
-                    stmt = s.strip()
-                    if stmt and not stmt.startswith('--'):
-                        # Пропускаем COMMENT ON INDEX команды
-                        if stmt.upper().startswith('COMMENT ON INDEX'):
-                            continue
-                        statements.append(stmt)
-                
-                errors = []
-                for statement in statements:
-                    if not statement:
+            # Читаем SQL файл с оптимизациями
+            optimization_file = os.path.join(os.path.dirname(__file__), 'database_optimization.sql')
+            
+            if not os.path.exists(optimization_file):
+                return
+            
+            with open(optimization_file, 'r', encoding='utf-8') as f:
+                sql_content = f.read()
+            
+            # Выполняем SQL команды (разделяем по ;)
+            # Пропускаем COMMENT ON INDEX - они вызывают ошибки если индекс не существует
+            statements = []
+            for s in sql_content.split(';'):
+                # Убираем строки-комментарии: почти каждая команда в файле начинается с пояснения
+                stmt = '\n'.join(line for line in s.splitlines() if not line.strip().startswith('--')).strip()
+                if stmt:
+                    # Пропускаем COMMENT ON INDEX команды
+                    if stmt.upper().startswith('COMMENT ON INDEX'):
                         continue
-                    try:
-                        await session.execute(text(statement))
-                    except Exception as e:
-                        error_str = str(e).lower()
-                        # Игнорируем ожидаемые ошибки
-                        ignorable_errors = [
-                            'already exists',
-                            'does not exist',
-                            'undefinedtableerror',
-                            'relation',
-                            'infailedsqltransactionerror'
-                        ]
-                        if any(err in error_str for err in ignorable_errors):
-                            continue
-                        # Сохраняем только реальные ошибки
-                        errors.append((statement[:80], str(e)))
-                        # Если транзакция в состоянии ошибки, делаем rollback
-                        try:
-                            await session.rollback()
-                            await session.begin()
-                        except Exception:
-                            pass
-                
-                try:
-                    await session.commit()
-                except Exception as commit_error:
-                    errors.append(('commit', str(commit_error)))
-                    try:
-                        await session.rollback()
-                    except Exception:
-                        pass
-                
-                # Логируем только реальные ошибки
-                if errors:
-                    for stmt, err in errors:
-                        logger.warning(f"Ошибка при применении оптимизации ({stmt}...): {err}")
+                    statements.append(stmt)
+
+            # Материализованные представления создаются до индексов: часть индексов строится по ним
+            setup = [st for st in statements if st.upper().startswith(('CREATE EXTENSION', 'CREATE MATERIALIZED VIEW'))]
+            indexes = [st for st in statements if st.upper().startswith(('CREATE INDEX', 'CREATE UNIQUE INDEX'))]
+            tail = [st for st in statements if st not in setup and st not in indexes]
+
+            # Оставляем соединения пула под трафик приложения
+            semaphore = asyncio.Semaphore(max(1, min(DB_POOL_SIZE - 1, 4)))
+            errors = []
+            for statement in setup:
+                errors.append(await self._run_ddl(statement, semaphore))
+            errors.extend(await asyncio.gather(*(self._run_ddl(st, semaphore) for st in indexes)))
+            for statement in tail:
+                errors.append(await self._run_ddl(statement, semaphore))
+            
+            # Логируем только реальные ошибки
+            for error in errors:
+                if error:
+                    stmt, err = error
+                    logger.warning(f"Ошибка при применении оптимизации ({stmt}...): {err}")
         except Exception as e:
             logger.error(f"Ошибка применения оптимизаций БД: {e}", exc_info=True)
 
@@ -214,75 +1141,54 @@ class PostgreSQLManager:
         """Проверяет наличие новых колонок (area, krisha_price, vitrina_price, score, rooms_count).
         Если отсутствуют — создаёт резервную копию таблицы properties и добавляет недостающие колонки.
         Операция идемпотентная и безопасная: данные не удаляются, ALTER выполняются с IF NOT EXISTS.
+        Пока нет idx_properties_missing_category, пробельные категории один раз приводятся к NULL.
+        Вся проверка выполняется одним DO-блоком; после успеха повторные вызовы ничего не делают.
         """
+        if self._schema_ready:
+            return
         try:
             async with self.async_session() as session:
-                # Проверяем наличие нужных столбцов
-                col_check = await session.execute(text(
-                    """
-                    SELECT column_name FROM information_schema.columns
-                    WHERE table_name = 'properties'
-                      AND column_name IN ('area','krisha_price','vitrina_price','score','rooms_count')
-                    """
-                ))
-                existing = {row.column_name for row in col_check.fetchall()}
-                required = {'area','krisha_price','vitrina_price','score','rooms_count'}
-                missing = required - existing
-                if not missing:
-                    # Не логируем, если все колонки уже есть
-                    return
-
-                logger.warning(f"Обнаружены отсутствующие колонки в properties: {missing}. Создаю резервную копию и применяю ALTER...")
-
-                # Создаём резервную копию, если её нет
-                tbl_check = await session.execute(text(
-                    """
-                    SELECT COUNT(*) FROM information_schema.tables
-                    WHERE table_name = 'properties_backup'
-                    """
-                ))
-                has_backup = (tbl_check.scalar() or 0) > 0
-                if not has_backup:
-                    # Создаём snapshot с данными
-                    await session.execute(text("CREATE TABLE properties_backup AS TABLE properties WITH DATA"))
-                    logger.info("Таблица properties_backup создана и заполнена")
-                # Таблица properties_backup уже существует — пропускаем создание
-
-                # Добавляем недостающие колонки
-                alter_stmts = []
-                if 'area' in missing:
-                    alter_stmts.append("ALTER TABLE properties ADD COLUMN IF NOT EXISTS area DOUBLE PRECISION")
-                if 'krisha_price' in missing:
-                    alter_stmts.append("ALTER TABLE properties ADD COLUMN IF NOT EXISTS krisha_price BIGINT")
-                if 'vitrina_price' in missing:
-                    alter_stmts.append("ALTER TABLE properties ADD COLUMN IF NOT EXISTS vitrina_price BIGINT")
-                if 'score' in missing:
-                    alter_stmts.append("ALTER TABLE properties ADD COLUMN IF NOT EXISTS score DOUBLE PRECISION")
-                if 'rooms_count' in missing:
-                    alter_stmts.append("ALTER TABLE properties ADD COLUMN IF NOT EXISTS rooms_count INTEGER")
-                for stmt in alter_stmts:
-                    await session.execute(text(stmt))
+                await session.execute(text("""
+                    DO $$
+                    BEGIN
+                        IF (SELECT COUNT(*) FROM information_schema.columns
+                            WHERE table_name = 'properties'
+                              AND column_name IN ('area','krisha_price','vitrina_price','score','rooms_count')) < 5 THEN
+                            RAISE WARNING 'properties: отсутствуют новые колонки, создаю резервную копию и применяю ALTER';
+                            -- Создаём snapshot с данными, если его ещё нет
+                            IF to_regclass('properties_backup') IS NULL THEN
+                                CREATE TABLE properties_backup AS TABLE properties WITH DATA;
+                            END IF;
+                            ALTER TABLE properties ADD COLUMN IF NOT EXISTS area DOUBLE PRECISION;
+                            ALTER TABLE properties ADD COLUMN IF NOT EXISTS krisha_price BIGINT;
+                            ALTER TABLE properties ADD COLUMN IF NOT EXISTS vitrina_price BIGINT;
+                            ALTER TABLE properties ADD COLUMN IF NOT EXISTS score DOUBLE PRECISION;
+                            ALTER TABLE properties ADD COLUMN IF NOT EXISTS rooms_count INTEGER;
+                        END IF;
+                        -- Разовая чистка перед первым созданием idx_properties_missing_category (database_optimization.sql):
+                        -- пробельные категории приводим к NULL, чтобы они попадали под предикат индекса
+                        IF to_regclass('idx_properties_missing_category') IS NULL THEN
+                            UPDATE properties SET category = NULL WHERE category <> '' AND TRIM(category) = '';
+                        END IF;
+                    END $$
+                """))
                 await session.commit()
-                logger.info("ALTER TABLE выполнены, схема обновлена")
+            self._schema_ready = True
         except Exception as e:
             logger.error(f"Ошибка ensure_schema_with_backup: {e}")
     
     async def ensure_parsed_properties_schema(self) -> None:
-        """Гарантирует наличие таблицы parsed_properties и колонки stats_object_category."""
+        """Гарантирует наличие таблиц parsed_properties / vitrina_agents, их колонок и индексов.
+
+        Все проверки и DDL выполняются одним DO-блоком; после успеха повторные вызовы ничего не делают.
+        """
+        if self._parsed_schema_ready:
+            return
         try:
             async with self.async_session() as session:
-                # Проверяем наличие таблицы parsed_properties
-                table_check = await session.execute(text("""
-                    SELECT EXISTS (
-                        SELECT 1 FROM information_schema.tables
-                        WHERE table_schema = 'public' AND table_name = 'parsed_properties'
-                    )
-                """))
-                table_exists = table_check.scalar()
-
-                if not table_exists:
-                    logger.info("Таблица parsed_properties не найдена — создаю...")
-                    await session.execute(text("""
+                await session.execute(text("""
+                    DO $$
+                    BEGIN
                         CREATE TABLE IF NOT EXISTS parsed_properties (
                             vitrina_id BIGSERIAL PRIMARY KEY,
                             rbd_id BIGINT UNIQUE NOT NULL,
@@ -317,72 +1223,12 @@ class PostgreSQLManager:
                             stats_object_category VARCHAR(10),
                             created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
                             updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """))
-
-                    # Создаем основные индексы
-                    index_statements = [
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_created ON parsed_properties(created_at)",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_krisha_id ON parsed_properties(krisha_id) WHERE krisha_id IS NOT NULL AND krisha_id != ''",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_agent_given ON parsed_properties(stats_agent_given) WHERE stats_agent_given IS NOT NULL",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_status ON parsed_properties(stats_object_status) WHERE stats_object_status IS NOT NULL",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_recall_time ON parsed_properties(stats_recall_time) WHERE stats_recall_time IS NOT NULL",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_recall_notification ON parsed_properties(stats_object_status, stats_recall_time, stats_agent_given, stats_recall_notified) WHERE stats_object_status = 'Перезвонить' AND stats_recall_time IS NOT NULL AND stats_agent_given IS NOT NULL AND (stats_recall_notified IS NULL OR stats_recall_notified = FALSE)",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_latest ON parsed_properties(krisha_id, stats_agent_given, krisha_date DESC) WHERE krisha_id IS NOT NULL AND krisha_id != ''",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_time_given ON parsed_properties(stats_time_given DESC NULLS LAST)",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_my_objects ON parsed_properties(stats_agent_given, stats_time_given DESC NULLS LAST, vitrina_id DESC) WHERE stats_agent_given IS NOT NULL",
-                        "CREATE INDEX IF NOT EXISTS idx_parsed_properties_archive ON parsed_properties(stats_object_status, krisha_id) WHERE krisha_id IS NOT NULL AND krisha_id != '' AND (stats_object_status IS NULL OR stats_object_status != 'Архив')"
-                    ]
-                    for stmt in index_statements:
-                        await session.execute(text(stmt))
+                        );
 
-                    await session.commit()
-                    logger.info("Таблица parsed_properties создана вместе с индексами")
+                        -- Колонки, появившиеся после первой версии таблицы
+                        ALTER TABLE parsed_properties ADD COLUMN IF NOT EXISTS stats_object_category VARCHAR(10);
+                        ALTER TABLE parsed_properties ADD COLUMN IF NOT EXISTS stats_recall_notified BOOLEAN DEFAULT FALSE;
 
-                # Проверяем наличие колонки stats_object_category
-                col_check = await session.execute(text("""
-                    SELECT column_name FROM information_schema.columns
-                    WHERE table_name = 'parsed_properties'
-                      AND column_name = 'stats_object_category'
-                """))
-                column_exists = col_check.fetchone() is not None
-
-                if not column_exists:
-                    await session.execute(text("""
-                        ALTER TABLE parsed_properties 
-                        ADD COLUMN IF NOT EXISTS stats_object_category VARCHAR(10)
-                    """))
-                    await session.commit()
-                    logger.info("Колонка stats_object_category добавлена в parsed_properties")
-
-                # Проверяем наличие колонки stats_recall_notified
-                col_check_recall = await session.execute(text("""
-                    SELECT column_name FROM information_schema.columns
-                    WHERE table_name = 'parsed_properties'
-                      AND column_name = 'stats_recall_notified'
-                """))
-                recall_column_exists = col_check_recall.fetchone() is not None
-
-                if not recall_column_exists:
-                    await session.execute(text("""
-                        ALTER TABLE parsed_properties 
-                        ADD COLUMN IF NOT EXISTS stats_recall_notified BOOLEAN DEFAULT FALSE
-                    """))
-                    await session.commit()
-                    logger.info("Колонка stats_recall_notified добавлена в parsed_properties")
-                
-                # Создаем таблицу vitrina_agents, если её нет
-                agents_table_check = await session.execute(text("""
-                    SELECT EXISTS (
-                        SELECT 1 FROM information_schema.tables
-                        WHERE table_schema = 'public' AND table_name = 'vitrina_agents'
-                    )
-                """))
-                agents_table_exists = agents_table_check.scalar()
-
-                if not agents_table_exists:
-                    logger.info("Таблица vitrina_agents не найдена — создаю...")
-                    await session.execute(text("""
                         CREATE TABLE IF NOT EXISTS vitrina_agents (
                             agent_phone VARCHAR(255) PRIMARY KEY,
                             full_name TEXT,
@@ -391,161 +1237,209 @@ class PostgreSQLManager:
                             property_classes TEXT[],
                             created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
                             updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """))
-                    await session.execute(text("""
-                        CREATE INDEX IF NOT EXISTS idx_vitrina_agents_chat_ids 
-                        ON vitrina_agents USING GIN (chat_ids)
-                    """))
-                    await session.commit()
-                    logger.info("Таблица vitrina_agents создана вместе с индексами")
-                else:
-                    # Безопасно добавляем недостающие колонки, если их нет
-                    columns_check = await session.execute(text("""
-                        SELECT column_name 
-                        FROM information_schema.columns
-                        WHERE table_name = 'vitrina_agents'
-                    """))
-                    existing_columns = {row.column_name for row in columns_check.fetchall()}
-                    
-                    # Добавляем chat_ids, если его нет (миграция со старой структуры)
-                    if 'chat_ids' not in existing_columns:
-                        await session.execute(text("""
-                            ALTER TABLE vitrina_agents 
-                            ADD COLUMN IF NOT EXISTS chat_ids TEXT[]
-                        """))
-                        await session.commit()
-                        logger.info("Колонка chat_ids добавлена в vitrina_agents")
-                    
-                    # Добавляем role, если его нет
-                    if 'role' not in existing_columns:
-                        await session.execute(text("""
-                            ALTER TABLE vitrina_agents 
-                            ADD COLUMN IF NOT EXISTS role VARCHAR(50)
-                        """))
-                        await session.commit()
-                        logger.info("Колонка role добавлена в vitrina_agents")
-                    
-                    # Создаем индекс, если его нет
-                    index_check = await session.execute(text("""
-                        SELECT EXISTS (
-                            SELECT 1 FROM pg_indexes 
-                            WHERE tablename = 'vitrina_agents' 
-                            AND indexname = 'idx_vitrina_agents_chat_ids'
-                        )
-                    """))
-                    if not index_check.scalar():
-                        await session.execute(text("""
-                            CREATE INDEX IF NOT EXISTS idx_vitrina_agents_chat_ids 
-                            ON vitrina_agents USING GIN (chat_ids)
-                        """))
-                        await session.commit()
-                        logger.info("Индекс idx_vitrina_agents_chat_ids создан")
+                        );
+
+                        -- Миграция со старой структуры vitrina_agents
+                        ALTER TABLE vitrina_agents ADD COLUMN IF NOT EXISTS chat_ids TEXT[];
+                        ALTER TABLE vitrina_agents ADD COLUMN IF NOT EXISTS role VARCHAR(50);
+                        ALTER TABLE vitrina_agents ADD COLUMN IF NOT EXISTS property_classes TEXT[];
+                    END $$
+                """))
+                await session.commit()
 
+            # Индексы строим CONCURRENTLY вне транзакции, чтобы не блокировать запись на живой БД
+            index_statements = [
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_created ON parsed_properties(created_at)",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_krisha_id ON parsed_properties(krisha_id) WHERE krisha_id IS NOT NULL AND krisha_id != ''",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_agent_given ON parsed_properties(stats_agent_given) WHERE stats_agent_given IS NOT NULL",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_status ON parsed_properties(stats_object_status) WHERE stats_object_status IS NOT NULL",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_recall_time ON parsed_properties(stats_recall_time) WHERE stats_recall_time IS NOT NULL",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_recall_notification ON parsed_properties(stats_object_status, stats_recall_time, stats_agent_given, stats_recall_notified) WHERE stats_object_status = 'Перезвонить' AND stats_recall_time IS NOT NULL AND stats_agent_given IS NOT NULL AND (stats_recall_notified IS NULL OR stats_recall_notified = FALSE)",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_latest ON parsed_properties(krisha_id, stats_agent_given, krisha_date DESC) WHERE krisha_id IS NOT NULL AND krisha_id != ''",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_time_given ON parsed_properties(stats_time_given DESC NULLS LAST)",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_my_objects ON parsed_properties(stats_agent_given, stats_time_given DESC NULLS LAST, vitrina_id DESC) WHERE stats_agent_given IS NOT NULL",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parsed_properties_archive ON parsed_properties(stats_object_status, krisha_id) WHERE krisha_id IS NOT NULL AND krisha_id != '' AND (stats_object_status IS NULL OR stats_object_status != 'Архив')",
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_vitrina_agents_chat_ids ON vitrina_agents USING GIN (chat_ids)",
+            ]
+            async with self.engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+                for stmt in index_statements:
+                    await conn.execute(text(stmt))
+            self._parsed_schema_ready = True
         except Exception as e:
             logger.error(f"Ошибка ensure_parsed_properties_schema: {e}", exc_info=True)
     
-    async def get_agent_contracts_page(self, agent_name: str, page: int = 1, page_size: int = 10, role: Optional[str] = None) -> Tuple[List[Dict], int]:
-        """Получает страницу контрактов агента с пагинацией"""
+    async def _fetch_page_with_total(
+        self,
+        where_clause,
+        page_size: int,
+        offset: int,
+        cursor: Optional[Tuple[datetime, str]] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[Dict], int]:
+        """Загружает страницу контрактов и общее число совпадений одним запросом (count(*) OVER ()).
+
+        Отдельный COUNT выполняется только если страница за пределами выборки и пришла пустой.
+        С cursor=(last_modified_at, crm_id) последней показанной записи используется keyset-пагинация:
+        offset игнорируется, а total — число записей, оставшихся после курсора. Курсор только для API:
+        обработчики листают по page через _AgentPageBatcher.
+        """
+        if cursor is not None:
+            where_clause = and_(where_clause, _after_contract_cursor(*cursor))
+            offset = 0
+        stmt_page = (
+            select(properties, func.count().over().label('_total'))
+            .where(where_clause)
+            .order_by(properties.c.last_modified_at.desc().nulls_first(), properties.c.crm_id.desc())
+            .limit(page_size)
+            .offset(offset)
+        )
+        async with self.async_session() as session:
+            rows = (await session.execute(stmt_page, params)).fetchall()
+            if rows:
+                # Последняя колонка — _total, остальные — колонки properties
+                return [_legacy_from_row(row[:-1]) for row in rows], rows[0][-1]
+            if offset == 0:
+                return [], 0
+            stmt_count = select(func.count()).select_from(properties).where(where_clause)
+            return [], (await session.execute(stmt_count, params)).scalar() or 0
+
+    async def get_agent_contracts_page(
+        self,
+        agent_name: str,
+        page: int = 1,
+        page_size: int = 10,
+        role: Optional[str] = None,
+        cursor: Optional[Tuple[datetime, str]] = None,
+    ) -> Tuple[List[Dict], int]:
+        """Получает страницу контрактов агента с пагинацией.
+
+        Одновременные запросы разных пользователей склеиваются в один запрос к БД (см. _AgentPageBatcher).
+        cursor=(last_modified_at, crm_id) последнего контракта предыдущей страницы включает keyset-пагинацию
+        вместо OFFSET (см. _fetch_page_with_total).
+        """
+        if cursor is not None:
+            return await self._fetch_agent_contracts_page(agent_name, page, page_size, role, cursor=cursor)
+        return await self._agent_page_batcher.submit(agent_name, page, page_size, role)
+
+    async def _fetch_agent_contracts_page(
+        self,
+        agent_name: str,
+        page: int = 1,
+        page_size: int = 10,
+        role: Optional[str] = None,
+        cursor: Optional[Tuple[datetime, str]] = None,
+    ) -> Tuple[List[Dict], int]:
+        """Загружает одну страницу контрактов агента отдельным запросом"""
         try:
             offset = (page - 1) * page_size
             
+            # Разбиваем ФИО (ожидаем Фамилия Имя, отчество опционально); требуем наличие и фамилии, и имени
+            surname, name, surname_like, name_like = _parse_fio(agent_name)
+            
+            logger.debug(f"Поиск контрактов для агента: '{agent_name}' -> фамилия: '{surname}', имя: '{name}'")
+
+            # WHERE через SQLAlchemy Core
+            where_clause = and_(_ROLE_WHERE.get(role, _ANY_ROLE), ACTIVE_STATUS_FILTER)
+            params = _fio_params(agent_name)
+
+            contracts, total_count = await self._fetch_page_with_total(where_clause, page_size, offset, cursor, params)
+            
+            logger.info(f"Загружено {len(contracts)} контрактов для агента {agent_name} (страница {page})")
+            return contracts, total_count
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения контрактов агента {agent_name}: {e}", exc_info=True)
+            return [], 0
+
+    async def _fetch_agent_contracts_pages(
+        self, keys: List[Tuple[str, int, int, Optional[str]]]
+    ) -> Dict[Tuple[str, int, int, Optional[str]], Tuple[List[Dict], int]]:
+        """Загружает несколько страниц контрактов агентов одним UNION ALL запросом.
+
+        Каждая ветка помечена номером запроса (_req) и несёт общее число совпадений
+        через count(*) OVER () — отдельный COUNT нужен только для пустых страниц.
+        """
+        try:
             async with self.async_session() as session:
-                # Разбиваем ФИО (ожидаем Фамилия Имя, отчество опционально); требуем наличие и фамилии, и имени
-                fio_parts = [p for p in str(agent_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                logger.debug(f"Поиск контрактов для агента: '{agent_name}' -> фамилия: '{surname}', имя: '{name}'")
-
-                # WHERE через SQLAlchemy Core
-                def _role_condition(role):
-                    if role == 'МОП':
-                        return and_(func.lower(properties.c.mop).like(surname_like), func.lower(properties.c.mop).like(name_like))
-                    if role == 'РОП':
-                        return and_(func.lower(properties.c.rop).like(surname_like), func.lower(properties.c.rop).like(name_like))
-                    if role == 'ДД':
-                        return and_(func.lower(properties.c.dd).like(surname_like), func.lower(properties.c.dd).like(name_like))
-                    return or_(
-                        and_(func.lower(properties.c.mop).like(surname_like), func.lower(properties.c.mop).like(name_like)),
-                        and_(func.lower(properties.c.rop).like(surname_like), func.lower(properties.c.rop).like(name_like)),
-                        and_(func.lower(properties.c.dd).like(surname_like), func.lower(properties.c.dd).like(name_like)),
+                branches = []
+                conditions = []
+                for idx, (agent_name, page, page_size, role) in enumerate(keys):
+                    _, _, surname_like, name_like = _parse_fio(agent_name)
+                    where_clause = and_(
+                        _agent_role_condition(role, surname_like, name_like),
+                        ACTIVE_STATUS_FILTER,
                     )
-                
-                def _where(role):
-                    return and_(_role_condition(role), ACTIVE_STATUS_FILTER)
-
-                # count
-                stmt_count = select(func.count()).select_from(properties).where(_where(role))
-                total_count = (await session.execute(stmt_count)).scalar() or 0
-
-                # page
-                stmt_page = (
-                    select(properties)
-                    .where(_where(role))
-                    .order_by(properties.c.last_modified_at.desc())
-                    .limit(page_size)
-                    .offset(offset)
-                )
-                result = await session.execute(stmt_page)
-                
-                contracts = []
+                    conditions.append(where_clause)
+                    branches.append(
+                        select(
+                            literal(idx).label('_req'),
+                            func.count().over().label('_total'),
+                            properties,
+                        )
+                        .where(where_clause)
+                        .order_by(properties.c.last_modified_at.desc().nulls_first(), properties.c.crm_id.desc())
+                        .limit(page_size)
+                        .offset((page - 1) * page_size)
+                    )
+
+                result = await session.execute(union_all(*branches))
+
+                contracts_by_req: Dict[int, List[Dict]] = {idx: [] for idx in range(len(keys))}
+                totals: Dict[int, int] = {}
                 for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    # Преобразуем в формат, совместимый со старым API
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
-                
-                logger.info(f"Загружено {len(contracts)} контрактов для агента {agent_name} (страница {page})")
-                return contracts, total_count
-                
+                    # Первые две колонки — служебные _req и _total, дальше колонки properties
+                    req = row[0]
+                    totals[req] = row[1]
+                    contracts_by_req[req].append(_legacy_from_row(row[2:]))
+
+                # Страница за пределами выборки не несёт total — досчитываем отдельно
+                for idx in range(len(keys)):
+                    if idx not in totals:
+                        stmt_count = select(func.count()).select_from(properties).where(conditions[idx])
+                        totals[idx] = (await session.execute(stmt_count)).scalar() or 0
+
+                logger.info(f"Загружено {len(keys)} страниц контрактов агентов одним запросом")
+                return {key: (contracts_by_req[idx], totals[idx]) for idx, key in enumerate(keys)}
+
         except Exception as e:
-            logger.error(f"Ошибка получения контрактов агента {agent_name}: {e}", exc_info=True)
-            return [], 0
+            logger.error(f"Ошибка пакетной загрузки контрактов агентов: {e}", exc_info=True)
+            return {key: ([], 0) for key in keys}
     
     async def search_contract_by_crm_id(self, crm_id: str, agent_name: str, role: Optional[str] = None) -> Optional[Dict]:
-        """Ищет контракт по CRM ID для конкретного агента"""
+        """Ищет контракт по CRM ID для конкретного агента.
+
+        Строка берётся по первичному ключу (ровно одна), принадлежность агенту проверяется в Python —
+        так планировщику не нужно перепроверять LIKE-условия по mop/rop/dd.
+        """
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(agent_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                # WHERE через Core
-                def _where(role):
-                    base = (properties.c.crm_id == crm_id)
-                    if role == 'МОП':
-                        return and_(base, func.lower(properties.c.mop).like(surname_like), func.lower(properties.c.mop).like(name_like))
-                    if role == 'РОП':
-                        return and_(base, func.lower(properties.c.rop).like(surname_like), func.lower(properties.c.rop).like(name_like))
-                    if role == 'ДД':
-                        return and_(base, func.lower(properties.c.dd).like(surname_like), func.lower(properties.c.dd).like(name_like))
-                    return and_(
-                        base,
-                        or_(
-                            and_(func.lower(properties.c.mop).like(surname_like), func.lower(properties.c.mop).like(name_like)),
-                            and_(func.lower(properties.c.rop).like(surname_like), func.lower(properties.c.rop).like(name_like)),
-                            and_(func.lower(properties.c.dd).like(surname_like), func.lower(properties.c.dd).like(name_like)),
-                        )
-                    )
-                stmt = select(properties).where(_where(role))
-                result = await session.execute(stmt)
-                
+                result = await session.execute(_SELECT_BY_CRM_ID, {"crm_id": crm_id})
                 row = result.fetchone()
-                if row:
-                    contract_dict = dict(row._mapping)
-                    return self._convert_to_legacy_format(contract_dict)
-                
+
+            if row is None:
                 return None
+
+            surname, name, _, _ = _parse_fio(agent_name)
+            if not _agent_row_matches(row, role, surname, name):
+                return None
+
+            return _legacy_from_row(row)
                 
         except Exception as e:
             logger.error(f"Ошибка поиска контракта {crm_id} для агента {agent_name}: {e}", exc_info=True)
             return None
     
-    async def search_contracts_by_client_name_lazy(self, client_name: str, agent_name: str, page: int = 1, page_size: int = 10, role: Optional[str] = None) -> Tuple[List[Dict], int]:
-        """Ищет контракты по имени клиента с пагинацией.
+    async def search_contracts_by_client_name_lazy(
+        self,
+        client_name: str,
+        agent_name: str,
+        page: int = 1,
+        page_size: int = 10,
+        role: Optional[str] = None,
+        cursor: Optional[Tuple[datetime, str]] = None,
+    ) -> Tuple[List[Dict], int]:
+        """Ищет контракты по имени клиента с пагинацией (OFFSET по page или keyset по cursor).
 
         Поведение:
         - Для ролей МОП/РОП/ДД — фильтрация по соответствующим полям (mop/rop/dd) и имени владельца.
@@ -555,96 +1449,72 @@ class PostgreSQLManager:
         try:
             offset = (page - 1) * page_size
             
-            async with self.async_session() as session:
-                client_like = f"%{client_name}%"
-                def _where(role_value: Optional[str]):
-                    base = and_(
-                        func.lower(properties.c.client_name).like(func.lower(client_like)),
-                        ACTIVE_STATUS_FILTER,
-                    )
+            where_clause = and_(properties.c.client_name.ilike(f"%{client_name}%"), ACTIVE_STATUS_FILTER)
 
-                    # ADMIN_VIEW — глобальный поиск без ограничения по владельцу
-                    if role_value == 'ADMIN_VIEW':
-                        return base
-
-                    # Для остальных ролей используем ФИО владельца, если оно есть
-                    fio_parts = [p for p in str(agent_name).strip().split() if p]
-                    surname = fio_parts[0] if fio_parts else ''
-                    name = fio_parts[1] if len(fio_parts) > 1 else ''
-                    surname_like = f"%{surname.lower()}%"
-                    name_like = f"%{name.lower()}%"
-
-                    if role_value == 'МОП':
-                        return and_(base, func.lower(properties.c.mop).like(surname_like), func.lower(properties.c.mop).like(name_like))
-                    if role_value == 'РОП':
-                        return and_(base, func.lower(properties.c.rop).like(surname_like), func.lower(properties.c.rop).like(name_like))
-                    if role_value == 'ДД':
-                        return and_(base, func.lower(properties.c.dd).like(surname_like), func.lower(properties.c.dd).like(name_like))
-                    return and_(
-                        base,
-                        or_(
-                            and_(func.lower(properties.c.mop).like(surname_like), func.lower(properties.c.mop).like(name_like)),
-                            and_(func.lower(properties.c.rop).like(surname_like), func.lower(properties.c.rop).like(name_like)),
-                            and_(func.lower(properties.c.dd).like(surname_like), func.lower(properties.c.dd).like(name_like)),
-                        )
-                    )
+            # ADMIN_VIEW — глобальный поиск без ограничения по владельцу;
+            # для остальных ролей используем ФИО владельца, если оно есть
+            params = None
+            if role != 'ADMIN_VIEW':
+                where_clause = and_(where_clause, _ROLE_WHERE.get(role, _ANY_ROLE))
+                params = _fio_params(agent_name)
 
-                stmt_count = select(func.count()).select_from(properties).where(_where(role))
-                total_count = (await session.execute(stmt_count)).scalar() or 0
-                stmt_page = (
-                    select(properties)
-                    .where(_where(role))
-                    .order_by(properties.c.last_modified_at.desc())
-                    .limit(page_size).offset(offset)
-                )
-                result = await session.execute(stmt_page)
-                
-                contracts = []
-                for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
-                
-                logger.info(f"Найдено {len(contracts)} контрактов для клиента '{client_name}' агента {agent_name}")
-                return contracts, total_count
-                
+            contracts, total_count = await self._fetch_page_with_total(where_clause, page_size, offset, cursor, params)
+            
+            logger.info(f"Найдено {len(contracts)} контрактов для клиента '{client_name}' агента {agent_name}")
+            return contracts, total_count
+            
         except Exception as e:
             logger.error(f"Ошибка поиска контрактов по клиенту {client_name}: {e}", exc_info=True)
             return [], 0
     
+    def _stats_get(self, key: Tuple) -> Optional[Any]:
+        """Значение из кеша сводной статистики, если оно моложе DB_STATS_CACHE_TTL"""
+        cached = self._stats_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < DB_STATS_CACHE_TTL:
+            return cached[1]
+        return None
+
+    def _stats_put(self, key: Tuple, value: Any) -> Any:
+        self._stats_cache[key] = (time.monotonic(), value)
+        return value
+
+    def _invalidate_caches(self, crm_id: str, fields) -> None:
+        """Сбрасывает кеши, которые могли устареть после изменения полей fields контракта crm_id.
+
+        third_map не трогаем: он строится из Google Sheets, а не из properties.
+        """
+        # Любое изменение контракта может сдвинуть счётчики по категориям/агентам
+        self._stats_cache.clear()
+        if {'mop', 'rop', 'dd'} & set(fields):
+            # Сменился владелец — индекс телефонов и кеш результатов по номеру больше не точны
+            self._phone_to_agent = None
+            self._phone_cache.clear()
+            self._agent_phone_cache.clear()
+            self._schedule_agent_counts_refresh()
+            logger.debug(f"Кеш телефонов агентов сброшен после изменения контракта {crm_id}")
+
     async def update_contract_category(self, crm_id: str, category: str) -> bool:
         """Обновляет категорию контракта"""
         try:
             async with self.async_session() as session:
-                # Проверяем существование контракта
-                check_query = text("SELECT crm_id FROM properties WHERE crm_id = :crm_id")
-                result = await session.execute(check_query, {"crm_id": crm_id})
-                
-                if not result.fetchone():
-                    logger.warning(f"Контракт {crm_id} не найден для обновления категории")
-                    return False
-                
                 # Обновляем категорию (поддерживаем как латиницу, так и кириллицу)
-                category_mapping = {'A': 'А', 'B': 'В', 'C': 'С'}
-                category_cyr = category_mapping.get(category.upper(), category.upper())
-                
-                update_query = text("""
-                    UPDATE properties 
-                    SET category = :category, 
-                        last_modified_by = 'BOT',
-                        last_modified_at = :now
-                    WHERE crm_id = :crm_id
-                """)
+                category_upper = category.upper()
+                category_cyr = _CATEGORY_CYR.get(category_upper, category_upper)
                 
-                await session.execute(
-                    update_query,
-                    {
-                        "category": category_cyr,
-                        "crm_id": crm_id,
-                        "now": datetime.now()
-                    }
+                # RETURNING вместо предварительной проверки существования — один запрос вместо двух
+                result = await session.execute(
+                    update(properties)
+                    .where(properties.c.crm_id == crm_id)
+                    .values(category=category_cyr, last_modified_by='BOT', last_modified_at=func.now())
+                    .returning(properties.c.crm_id)
                 )
                 
+                if result.fetchone() is None:
+                    logger.warning(f"Контракт {crm_id} не найден для обновления категории")
+                    return False
+                
                 await session.commit()
+                self._invalidate_caches(crm_id, ('category',))
                 logger.info(f"Категория контракта {crm_id} изменена на {category_cyr}")
                 return True
                 
@@ -652,37 +1522,92 @@ class PostgreSQLManager:
             logger.error(f"Ошибка обновления категории контракта {crm_id}: {e}")
             return False
 
+    async def bulk_assign_contract_categories(
+        self, rows: List[Tuple[str, Optional[float], Optional[float], Optional[float], Optional[float]]]
+    ) -> int:
+        """Массово вычисляет и проставляет категории на стороне БД.
+
+        rows — кортежи (crm_id, area, window, roof, score) с параметрами ЖК из листа и площадью из CRM.
+        Категория считается выражением _category_case от properties.contract_price в одном
+        UPDATE ... FROM (VALUES ...) на DB_CATEGORY_BATCH_SIZE строк. Пачки затрагивают разные crm_id и идут
+        параллельно на нескольких соединениях, каждая в своей транзакции: ошибка одной пачки не
+        откатывает остальные.
+        Возвращает число обновлённых контрактов (несуществующие crm_id и упавшие пачки не учитываются).
+        """
+        # Повтор crm_id обновил бы строку дважды в одном UPDATE — оставляем последнее значение
+        by_crm = {row[0]: row for row in rows}
+        if not by_crm:
+            return 0
+        # Оставляем соединения пула под трафик приложения
+        semaphore = asyncio.Semaphore(max(1, min(DB_POOL_SIZE - 1, 4)))
+
+        async def run_batch(batch: List[Tuple]) -> int:
+            async with semaphore:
+                try:
+                    async with self.async_session() as session:
+                        v = values(
+                            column('crm_id', String), column('area', Float), column('window', Float),
+                            column('roof', Float), column('score', Float),
+                            name='v',
+                        ).data(batch)
+                        # None в VALUES приходит литералом NULL: если вся колонка пачки пуста, PostgreSQL
+                        # выведет для неё text, поэтому тип задаём явно
+                        area, window, roof, score = (cast(v.c[name], Float) for name in ('area', 'window', 'roof', 'score'))
+                        category = _category_case(properties.c.contract_price, window * area, roof * area, score)
+                        result = await session.execute(
+                            update(properties)
+                            .where(properties.c.crm_id == v.c.crm_id)
+                            .values(category=category, last_modified_by='BOT', last_modified_at=func.now())
+                            .returning(properties.c.crm_id)
+                        )
+                        batch_updated = len(result.fetchall())
+                        await session.commit()
+                        return batch_updated
+                except Exception as e:
+                    logger.error(f"Ошибка массового обновления категорий (пачка из {len(batch)}): {e}")
+                    return 0
+
+        updated = sum(await asyncio.gather(
+            *(run_batch(batch) for batch in chunk_list(list(by_crm.values()), DB_CATEGORY_BATCH_SIZE))
+        ))
+        self._stats_cache.clear()
+        logger.info(f"Категории рассчитаны и обновлены массово: {updated} из {len(by_crm)}")
+        return updated
+
     async def update_contract(self, crm_id: str, updates: Dict[str, Any]) -> bool:
         """Обновляет контракт в базе данных"""
         try:
             async with self.async_session() as session:
-                # Проверяем, существует ли контракт
-                result = await session.execute(select(properties.c.crm_id).where(properties.c.crm_id == crm_id))
-                
-                if not result.fetchone():
-                    logger.warning(f"Контракт {crm_id} не найден для обновления")
-                    return False
-                
-                # Подготавливаем данные для обновления
-                update_data = {}
-                for key, value in updates.items():
-                    # Преобразуем ключи в формат базы данных
-                    db_key = self._convert_key_to_db_format(key)
-                    update_data[db_key] = value
+                # Преобразуем ключи в формат базы данных; неизвестные колонки пропускаем, чтобы не уронить UPDATE
+                update_data = {_DB_KEY_MAP.get(key, key): value for key, value in updates.items()}
+                unknown = [key for key in update_data if key not in properties.c]
+                if unknown:
+                    logger.warning(f"Контракт {crm_id}: пропущены неизвестные поля {unknown}")
+                    for key in unknown:
+                        del update_data[key]
+                # Категорию храним без пробелов: пустая строка должна попадать под _MISSING_CATEGORY_WHERE
+                if isinstance(update_data.get('category'), str):
+                    update_data['category'] = update_data['category'].strip()
                 
                 # Добавляем метаданные
                 update_data['last_modified_by'] = 'BOT'
-                update_data['last_modified_at'] = datetime.now()
+                update_data['last_modified_at'] = func.now()  # Время ставит сервер БД — одно для всех реплик бота
                 
-                # Выполняем обновление через Core
+                # Выполняем обновление через Core; RETURNING заменяет проверку существования
                 upd = (
                     update(properties)
                     .where(properties.c.crm_id == crm_id)
                     .values(**update_data)
+                    .returning(properties.c.crm_id)
                 )
-                await session.execute(upd)
+                result = await session.execute(upd)
+                
+                if result.fetchone() is None:
+                    logger.warning(f"Контракт {crm_id} не найден для обновления")
+                    return False
                 
                 await session.commit()
+                self._invalidate_caches(crm_id, update_data.keys())
                 logger.info(f"Контракт {crm_id} обновлен: {list(updates.keys())}")
                 return True
                 
@@ -690,32 +1615,72 @@ class PostgreSQLManager:
             logger.error(f"Ошибка обновления контракта {crm_id}: {e}")
             return False
     
+    async def _load_phone_index(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Строит (с кешированием) индексы телефон -> агент: по полному номеру и по последним 10 цифрам"""
+        if (self._phone_to_agent is not None and self._phone_index_time is not None and
+                (datetime.now() - self._phone_index_time).total_seconds() < self._phone_index_ttl):
+            return self._phone_to_agent, self._last10_to_agent
+
+        phone_to_agent: Dict[str, str] = {}
+        last10_to_agent: Dict[str, str] = {}
+        async with self.async_session() as session:
+            result = await session.stream(text(
+                "SELECT mop AS agent FROM properties WHERE mop IS NOT NULL "
+                "UNION SELECT rop FROM properties WHERE rop IS NOT NULL "
+                "UNION SELECT dd FROM properties WHERE dd IS NOT NULL"
+            ).execution_options(yield_per=DB_STREAM_YIELD_PER))
+            async for row in result:
+                for digits in _PHONE_DIGITS_RE.findall(row.agent):
+                    normalized = normalize_phone(digits)
+                    phone_to_agent.setdefault(normalized, row.agent)
+                    if len(normalized) >= 10:
+                        last10_to_agent.setdefault(normalized[-10:], row.agent)
+
+        self._phone_to_agent = phone_to_agent
+        self._last10_to_agent = last10_to_agent
+        self._phone_index_time = datetime.now()
+        logger.info(f"Индекс телефонов агентов построен: {len(phone_to_agent)} номеров")
+        return phone_to_agent, last10_to_agent
+
+    async def _find_agent_by_last10(self, last10: str) -> Optional[str]:
+        """Ищет агента по последним 10 цифрам номера в mop/rop/dd.
+
+        Выражение совпадает с индексами idx_properties_*_phone10, поэтому это индексный поиск, а не скан.
+        """
+        async with self.async_session() as session:
+            result = await session.execute(_SELECT_AGENT_BY_LAST10, {"last10": last10})
+            return result.scalar()
+
     async def get_agent_by_phone(self, phone: str) -> Optional[str]:
         """Получает имя агента по номеру телефона"""
         try:
             # Нормализуем номер телефона
             normalized_phone = self.normalize_phone(phone)
             logger.info(f"Поиск агента: введенный номер {phone}, нормализованный {normalized_phone}")
+
+            cached = self._phone_cache.get(normalized_phone)
+            if cached is not None and time.monotonic() - cached[0] < self._phone_cache_ttl:
+                return cached[1]
             
-            # Ищем агента в базе данных по номеру телефона
-            async with self.async_session() as session:
-                # Ищем в полях mop, rop, dd по номеру телефона
-                result = await session.execute(
-                    text("SELECT DISTINCT mop, rop, dd FROM properties WHERE "
-                         "LOWER(mop) LIKE LOWER(:phone) OR "
-                         "LOWER(rop) LIKE LOWER(:phone) OR "
-                         "LOWER(dd) LIKE LOWER(:phone)"),
-                    {"phone": f"%{normalized_phone}%"}
-                )
-                
-                for row in result.fetchall():
-                    # Проверяем каждое поле на совпадение номера
-                    for field in [row.mop, row.rop, row.dd]:
-                        if field and normalized_phone in field:
-                            logger.info(f"Найден агент: {field} с номером {normalized_phone}")
-                            return field
+            # Точное совпадение, затем по последним 10 цифрам
+            phone_to_agent, last10_to_agent = await self._load_phone_index()
+            agent = phone_to_agent.get(normalized_phone) or (
+                len(normalized_phone) >= 10 and last10_to_agent.get(normalized_phone[-10:])
+            )
+            if not agent and len(normalized_phone) >= 10:
+                # Новый агент мог появиться после построения индекса — точечный запрос по индексу цифр
+                agent = await self._find_agent_by_last10(normalized_phone[-10:])
+                if agent:
+                    phone_to_agent[normalized_phone] = agent
+                    last10_to_agent[normalized_phone[-10:]] = agent
+            if agent:
+                logger.info(f"Найден агент: {agent} с номером {normalized_phone}")
+                self._phone_cache[normalized_phone] = (time.monotonic(), agent)
+                return agent
             
             logger.warning(f"Агент с номером {normalized_phone} не найден")
+            # Отрицательный результат тоже кешируем: неизвестный номер не должен каждый раз ходить в БД
+            self._phone_cache[normalized_phone] = (time.monotonic(), None)
             return None
             
         except Exception as e:
@@ -723,449 +1688,58 @@ class PostgreSQLManager:
             return None
     
     async def get_phone_by_agent(self, agent_name: str) -> Optional[str]:
-        """Получает номер телефона агента по имени"""
+        """Получает номер телефона агента по имени.
+
+        Поиск и извлечение номера выполняются в БД: ILIKE по mop/rop/dd идёт через триграммные индексы,
+        substring() достаёт номер, и клиенту возвращается одна строка.
+        """
         try:
-            # Ищем агента в базе данных по имени
+            agent_name = agent_name.strip()
+            cache_key = agent_name.lower()
+            cached = self._agent_phone_cache.get(cache_key)
+            if cached is not None:
+                if time.monotonic() - cached[0] < self._phone_cache_ttl:
+                    self._agent_phone_cache.move_to_end(cache_key)
+                    return cached[1]
+                del self._agent_phone_cache[cache_key]
             async with self.async_session() as session:
-                # Ищем в полях mop, rop, dd по имени агента
-                result = await session.execute(
-                    text("SELECT DISTINCT mop, rop, dd FROM properties WHERE "
-                         "LOWER(mop) LIKE LOWER(:agent_name) OR "
-                         "LOWER(rop) LIKE LOWER(:agent_name) OR "
-                         "LOWER(dd) LIKE LOWER(:agent_name)"),
-                    {"agent_name": f"%{agent_name.strip()}%"}
-                )
-                
-                for row in result.fetchall():
-                    # Проверяем каждое поле на совпадение имени
-                    for field in [row.mop, row.rop, row.dd]:
-                        if field and agent_name.strip().lower() in field.lower():
-                            # Извлекаем номер телефона из поля (предполагаем, что номер в конце)
-                            import re
-                            phone_match = re.search(r'\b[78]\d{10}\b', field)
-                            if phone_match:
-                                return phone_match.group()
-            
-            return None
+                result = await session.execute(_SELECT_PHONE_BY_AGENT, {"agent_name": f"%{agent_name}%"})
+                phone = result.scalar()
+            self._agent_phone_cache[cache_key] = (time.monotonic(), phone)
+            if len(self._agent_phone_cache) > self._agent_phone_cache_max:
+                # Вытесняем давно не запрашивавшееся имя
+                self._agent_phone_cache.popitem(last=False)
+            return phone
             
         except Exception as e:
             logger.error(f"Ошибка поиска телефона агента {agent_name}: {e}", exc_info=True)
             return None
     
     def is_valid_phone(self, phone: str) -> bool:
-        """Проверяет валидность номера телефона"""
+        """Проверяет валидность номера телефона: 10-11 цифр, начинается с 7 или 8"""
         if not phone:
             return False
         
-        # Убираем все символы кроме цифр
-        digits_only = ''.join(c for c in phone if c.isdigit())
-        
-        # Проверяем длину (10-11 цифр)
-        if len(digits_only) < 10 or len(digits_only) > 11:
-            return False
-        
-        # Проверяем, что начинается с 7 или 8
-        if not (digits_only.startswith('7') or digits_only.startswith('8')):
-            return False
-        
-        return True
+        digits_only = _digits_only(phone)
+        return 10 <= len(digits_only) <= 11 and digits_only[0] in '78'
     
-    def normalize_phone(self, phone: str) -> str:
-        """Нормализует номер телефона"""
-        if not phone:
-            return ""
-        
-        # Убираем все символы кроме цифр
-        digits_only = ''.join(c for c in phone if c.isdigit())
-        
-        # Если номер начинается с 8, заменяем на 7
-        if digits_only.startswith('8') and len(digits_only) == 11:
-            digits_only = '7' + digits_only[1:]
-        
-        # Если номер начинается с 7 и имеет 11 цифр, оставляем как есть
-        if digits_only.startswith('7') and len(digits_only) == 11:
-            return digits_only
-        
-        # Если номер имеет 10 цифр, добавляем 7 в начало
-        if len(digits_only) == 10:
-            return '7' + digits_only
-        
-        # Если номер имеет 9 цифр, добавляем 77 в начало (для казахстанских номеров)
-        if len(digits_only) == 9:
-            return '77' + digits_only
-        
-        return digits_only
+    # Совместимость: раньше normalize_phone был методом менеджера
+    normalize_phone = staticmethod(normalize_phone)
     
     def _convert_to_legacy_format(self, db_record: Dict) -> Dict:
         """Преобразует запись из БД в формат, совместимый со старым API"""
-        return {
-            'CRM ID': db_record.get('crm_id', ''),
-            'Дата подписания': db_record.get('date_signed', ''),
-            'Номер договора': db_record.get('contract_number', ''),
-            'МОП': db_record.get('mop', ''),
-            'РОП': db_record.get('rop', ''),
-            'ДД': db_record.get('dd', ''),
-            'Имя клиента и номер': db_record.get('client_name', ''),
-            'Адрес': db_record.get('address', ''),
-            'ЖК': db_record.get('complex', ''),
-            'Цена указанная в договоре': db_record.get('contract_price', ''),
-            'Истекает': db_record.get('expires', ''),
-            'category': db_record.get('category', ''),
-            'area': db_record.get('area'),
-            'rooms_count': db_record.get('rooms_count'),
-            'krisha_price': db_record.get('krisha_price'),
-            'vitrina_price': db_record.get('vitrina_price'),
-            'score': db_record.get('score'),
-            'collage': db_record.get('collage', False),
-            'prof_collage': db_record.get('prof_collage', False),
-            'krisha': db_record.get('krisha', ''),
-            'instagram': db_record.get('instagram', ''),
-            'tiktok': db_record.get('tiktok', ''),
-            'mailing': db_record.get('mailing', ''),
-            'stream': db_record.get('stream', ''),
-            'shows': db_record.get('shows', 0),
-            'analytics': db_record.get('analytics', False),
-            'price_update': db_record.get('price_update', ''),
-            'provide_analytics': db_record.get('provide_analytics', False),
-            'push_for_price': db_record.get('push_for_price', False),
-            'status': db_record.get('status', 'Размещено'),
-            'last_modified_by': db_record.get('last_modified_by', 'SHEET'),
-            'last_modified_at': db_record.get('last_modified_at', ''),
-            'created_at': db_record.get('created_at', '')
-        }
+        return _convert_legacy(db_record)
     
     def _convert_key_to_db_format(self, key: str) -> str:
         """Преобразует ключ из старого формата в формат БД"""
-        key_mapping = {
-            'CRM ID': 'crm_id',
-            'Дата подписания': 'date_signed',
-            'Номер договора': 'contract_number',
-            'МОП': 'mop',
-            'РОП': 'rop',
-            'ДД': 'dd',
-            'Имя клиента и номер': 'client_name',
-            'Адрес': 'address',
-            'ЖК': 'complex',
-            'Цена указанная в договоре': 'contract_price',
-            'Истекает': 'expires',
-            'category': 'category',
-            'collage': 'collage',
-            'prof_collage': 'prof_collage',
-            'krisha': 'krisha',
-            'instagram': 'instagram',
-            'tiktok': 'tiktok',
-            'mailing': 'mailing',
-            'stream': 'stream',
-            'shows': 'shows',
-            'analytics': 'analytics',
-            'price_update': 'price_update',
-            'provide_analytics': 'provide_analytics',
-            'push_for_price': 'push_for_price',
-            'status': 'status'
-        }
-        return key_mapping.get(key, key)
+        return _DB_KEY_MAP.get(key, key)
 
     async def automate_categories(self) -> Dict[str, int]:
         """Массово пересчитывает категории на основе данных третьего листа ("Лист8") и API.
 
         Возвращает статистику: updated/skipped/errors.
         """
-        # 1) Инициализируем Google Sheets
-        credentials_file = 'credentials.json'
-        if not os.path.exists(credentials_file):
-            raise ValueError(f"Файл {credentials_file} не найден")
-        if not SHEET_ID or not THIRD_SHEET_GID:
-            raise ValueError("Переменные окружения SHEET_ID или THIRD_SHEET_GID не установлены")
-
-        credentials = Credentials.from_service_account_file(
-            credentials_file,
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
-        )
-        gc = gspread.authorize(credentials)
-        spreadsheet = gc.open_by_key(SHEET_ID)
-        third_ws = spreadsheet.get_worksheet_by_id(int(THIRD_SHEET_GID))
-
-        # 2) Читаем и находим индексы нужных колонок (ЖК=A, Крыша=B, Общий балл=C, Витрина=D)
-        rows = third_ws.get_all_values()
-        if not rows:
-            return {"updated": 0, "skipped": 0, "errors": 0}
-
-        # Поиск строки заголовков: ищем строку, где есть «ЖК» и/или нужные названия
-        header_row_idx = 0
-        for i, r in enumerate(rows):
-            line = ' '.join(r).lower()
-            if ('жк' in line) or ('крыша' in line) or ('витрина' in line) or ('общий балл' in line):
-                header_row_idx = i
-                break
-
-        def idx_by_name(header: List[str], names: List[str], default: Optional[int] = None) -> Optional[int]:
-            header_low = [h.strip().lower() for h in header]
-            for name in names:
-                if name.lower() in header_low:
-                    return header_low.index(name.lower())
-            return default
-
-        header = rows[header_row_idx] if rows else []
-        # Жёсткие индексы по условию: A=ЖК, B=Крыша, C=Общий балл, D=Витрина — с fallback по названиям
-        complex_col = 0 if len(header) >= 1 else idx_by_name(header, ['жк', 'комплекс'])
-        roof_col = 1 if len(header) >= 2 else idx_by_name(header, ['крыша', 'roof'])
-        score_col = 2 if len(header) >= 3 else idx_by_name(header, ['общий балл', 'балл', 'score'])
-        window_col = 3 if len(header) >= 4 else idx_by_name(header, ['витрина', 'window'])
-
-        # Если индексы не определены — считаем A/B/C/D по фиксированным позициям
-        if complex_col is None:
-            complex_col = 0
-        if roof_col is None:
-            roof_col = 1
-        if score_col is None:
-            score_col = 2
-        if window_col is None:
-            window_col = 3
-
-        def to_float_safe(v):
-            try:
-                s = str(v).replace(' ', '').replace('\u00A0', '')
-                s = s.replace(',', '.')
-                if s.strip() == '':
-                    return None
-                return float(s)
-            except Exception:
-                return None
-
-        # Строим словарь по названию ЖК (complex)
-        complex_to_params: Dict[str, Dict[str, Optional[float]]] = {}
-        def norm_complex(x: str) -> str:
-            import re
-            s = (x or '').lower()
-            # Базовые заменители и удаление служебных слов
-            for token in ['жк', 'жилой комплекс', 'residence', 'residential', 'complex']:
-                s = s.replace(token, ' ')
-            # Заменяем разделители на пробел
-            for ch in ['"', '\'', '«', '»', '.', ',', ';', ':', '(', ')', '[', ']', '{', '}', '/', '\\', '-', '–', '_']:
-                s = s.replace(ch, ' ')
-            # Удаляем конструкции вида "блок X" и слова-артефакты
-            s = re.sub(r"\bблок\s+[a-zа-я0-9]+\b", " ", s)
-            s = re.sub(r"\bочередь\b", " ", s)
-            # Схлопываем числовые хвосты вида "2-1" -> "2"
-            s = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", s)
-            # Нормализуем множественные пробелы
-            s = ' '.join(s.split())
-            # Токен-уровневая нормализация (транслитерации и синонимы)
-            synonyms = {
-                'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
-                'qalashyq': 'калашык', 'qalashy': 'калашык', 'qurylys': 'курылыс', 'exclusive': 'эксклюзив',
-                'bukhar': 'бухар', 'jyray': 'жырау', 'dauletti': 'даулетти', 'qalashyk': 'калашык',
-                'city': 'city', 'sat': 'sat'
-            }
-            tokens = s.split()
-            norm_tokens = []
-            for t in tokens:
-                t_clean = t
-                if t in synonyms:
-                    t_clean = synonyms[t]
-                norm_tokens.append(t_clean)
-            return ' '.join(norm_tokens)
-
-        def norm_tokens_set(s: str) -> set:
-            return set(norm_complex(s).split())
-        for i, r in enumerate(rows):
-            if i <= header_row_idx:
-                continue
-            complex_name = (r[complex_col] if complex_col < len(r) else '').strip()
-            if not complex_name:
-                continue
-            roof_raw = r[roof_col] if roof_col < len(r) else ''
-            score_raw = r[score_col] if score_col < len(r) else ''
-            window_raw = r[window_col] if window_col < len(r) else ''
-            complex_to_params[norm_complex(complex_name)] = {
-                'roof': to_float_safe(roof_raw),
-                'score': to_float_safe(score_raw),
-                'window': to_float_safe(window_raw),
-            }
-
-        # 3) Берём все crm_id, contract_price и complex из БД
-        async with self.async_session() as session:
-            res = await session.execute(text("SELECT crm_id, contract_price, complex FROM properties"))
-            db_rows = [dict(r._mapping) for r in res.fetchall()]
-
-        # 4) Подготавливаем функцию assign_category (максимально близко к предоставленной логике)
-        def is_num(x) -> bool:
-            return isinstance(x, (int, float)) and x is not None
-
-        def assign_category(contract_price: Optional[float], window_price: Optional[float], roof_price: Optional[float], score: Optional[float]) -> str:
-            score_is_num = is_num(score)
-            if score_is_num:
-                if all(is_num(x) for x in [contract_price, window_price, roof_price]):
-                    if (window_price <= contract_price <= roof_price) and (score > 8):
-                        return 'A'
-                    elif ((contract_price < window_price) or (contract_price > roof_price)) or (5 <= score <= 8):
-                        return 'B'
-                    elif (contract_price > roof_price) and (score < 5):
-                        return 'C'
-            else:
-                if all(is_num(x) for x in [contract_price, window_price, roof_price]):
-                    if (window_price <= contract_price <= roof_price):
-                        return 'B'
-                # Если L или M пустые
-                if (window_price is None) or (roof_price is None):
-                    if is_num(score) and (score > 8):
-                        return 'A'
-                    elif is_num(score) and (5 <= score <= 8):
-                        return 'B'
-            return 'C'
-
-        # 5) Подбор ближайшего совпадения по токенам (если прямого ключа нет)
-        updated, skipped, errors = 0, 0, 0
-        # Вспомогательная: подобрать ближайшее совпадение по токенам, если прямого ключа нет
-        def find_best_match(norm_name: str) -> Optional[str]:
-            name_set = set(norm_name.split())
-            if not name_set:
-                return None
-            best_key, best_score = None, 0.0
-            for k in complex_to_params.keys():
-                k_set = set(k.split())
-                if not k_set:
-                    continue
-                inter = len(name_set & k_set)
-                union = len(name_set | k_set)
-                score = inter / union if union else 0.0
-                # Правило подмножества: если меньшее множество полностью входит в большее — считаем полноценным совпадением
-                smaller, bigger = (name_set, k_set) if len(name_set) <= len(k_set) else (k_set, name_set)
-                if smaller and smaller.issubset(bigger):
-                    score = max(score, 0.999)
-                if score > best_score:
-                    best_score, best_key = score, k
-            return best_key if best_score >= 0.45 else None
-
-        def find_by_variants(raw_name: str) -> Optional[str]:
-            import re
-            base = norm_complex(raw_name)
-            parts = base.split()
-            if not parts:
-                return None
-            # Функция проверки: все части должны встречаться как подстроки в ключе
-            def all_parts_in_key(parts_list: List[str], key: str) -> bool:
-                for p in parts_list:
-                    if p and p not in key:
-                        return False
-                return True
-            # Генерируем варианты, постепенно укорачивая хвост и убирая числовые токены
-            for cut in range(0, len(parts)):
-                variant_parts = parts[:len(parts) - cut]
-                # Убираем чисто числовые части и формы вида 1-2 (остаётся первая часть — уже нормализовано)
-                variant_parts = [p for p in variant_parts if not p.isdigit()]
-                if not variant_parts:
-                    continue
-                variant_str = ' '.join(variant_parts)
-                # 1) Прямое попадание ключа
-                if variant_str in complex_to_params:
-                    return variant_str
-                # 2) Поиск по включению всех частей
-                for key in complex_to_params.keys():
-                    if all_parts_in_key(variant_parts, key):
-                        return key
-            return None
-
-        # 6) Готовим карту площадей через пакетные запросы к API
-        # Сначала отберём записи, у которых есть параметры из листа (после нормализации/подбора)
-        rows_prepared = []
-        not_found_logged = 0
-        unmatched_rows: List[Dict[str, Any]] = []
-        for row in db_rows:
-            complex_name_db = str(row.get('complex') or '')
-            complex_key = norm_complex(complex_name_db)
-            sheet_params = complex_to_params.get(complex_key)
-            if not sheet_params:
-                # сначала быстрый матч по вариантам укорачивания
-                best = find_by_variants(complex_name_db)
-                if not best:
-                    best = find_best_match(complex_key)
-                    if best:
-                            sheet_params = complex_to_params.get(best)
-            if not sheet_params:
-                if not_found_logged < 15:
-                    sample_keys = list(complex_to_params.keys())[:5]
-                    logger.info("Не найдено соответствие ЖК: '%s' (норм: '%s'). Примеры ключей листа: %s",
-                                complex_name_db, complex_key, sample_keys)
-                    not_found_logged += 1
-                unmatched_rows.append(row)
-                continue
-            rows_prepared.append((row, sheet_params))
-
-        area_by_crm: Dict[str, Optional[float]] = {}
-        try:
-            async with APIClient() as api_client:
-                crm_ids = [str(r[0].get('crm_id')) for r in rows_prepared if r[0].get('crm_id')]
-                if crm_ids:
-                    crm_data = await api_client.get_crm_data_batch(crm_ids, batch_size=DB_BATCH_SIZE)
-                    for cid, data in crm_data.items():
-                        area_val = data.get('area')
-                        try:
-                            area_by_crm[cid] = float(area_val) if area_val is not None else None
-                        except Exception:
-                            area_by_crm[cid] = None
-                # Второй проход: для несопоставленных возьмём complex из API и попробуем матчинг
-                unmatched_ids = [str(r.get('crm_id')) for r in unmatched_rows if r.get('crm_id')]
-                if unmatched_ids:
-                    api_batch = await api_client.get_crm_data_batch(unmatched_ids, batch_size=150)
-                    api_unmatched_names_logged = set()
-                    for cid, data in api_batch.items():
-                        api_complex = str((data or {}).get('complex') or '')
-                        api_key = norm_complex(api_complex)
-                        sp = complex_to_params.get(api_key)
-                        if not sp:
-                            best2 = find_best_match(api_key)
-                            if best2:
-                                sp = complex_to_params.get(best2)
-                                logger.info("ЖК (API) сопоставлен по похожести: '%s' -> '%s'", api_complex, best2)
-                        if sp:
-                            # добавляем в подготовленные
-                            for row in unmatched_rows:
-                                if str(row.get('crm_id')) == cid:
-                                    rows_prepared.append((row, sp))
-                                    break
-                        else:
-                            if len(api_unmatched_names_logged) < 15 and api_key not in api_unmatched_names_logged:
-                                logger.info("Не найдено соответствие ЖК (по API complex): '%s'", api_complex)
-                                api_unmatched_names_logged.add(api_key)
-        except Exception as e:
-            logger.error(f"Ошибка пакетного получения площадей: {e}")
-
-        # Подсчитываем пропуски после двух проходов
-        prepared_ids = {str(r[0].get('crm_id')) for r in rows_prepared if r[0].get('crm_id')}
-        all_ids = {str(r.get('crm_id')) for r in db_rows if r.get('crm_id')}
-        skipped = len(all_ids - prepared_ids)
-
-        # 7) Проходим по подготовленным строкам и обновляем
-        sample_logged = 0
-        for row, sheet_params in rows_prepared:
-            try:
-                crm_id = str(row.get('crm_id') or '').strip()
-                complex_name_db = str(row.get('complex') or '')
-                contract_price = row.get('contract_price')
-                roof = sheet_params.get('roof')
-                window = sheet_params.get('window')
-                score = sheet_params.get('score')
-
-                # Площадь из предварительно загруженной карты
-                area = area_by_crm.get(crm_id)
-
-                window_price = (window * area) if (window is not None and area is not None) else None
-                roof_price = (roof * area) if (roof is not None and area is not None) else None
-
-                category = assign_category(contract_price, window_price, roof_price, score)
-
-                    # Убрано подробное логирование параметров
-                ok = await self.update_contract_category(crm_id, category)
-                if ok:
-                    updated += 1
-                else:
-                    errors += 1
-            except Exception as e:
-                logger.error(f"Ошибка automate_categories для {row}: {e}")
-                errors += 1
-
-        return {"updated": updated, "skipped": skipped, "errors": errors}
+        return await self._automate_categories_core(missing_only=False)
 
     async def automate_categories_missing_only(self) -> Dict[str, int]:
         """Пересчитывает категории только для объектов с пустой category в SQL.
@@ -1173,292 +1747,250 @@ class PostgreSQLManager:
         Логика идентична automate_categories, но набор записей ограничен записями,
         у которых category IS NULL или пустая строка.
         """
-        # 1) Инициализация Google Sheets
+        return await self._automate_categories_core(missing_only=True)
+
+    async def _automate_categories_core(self, *, missing_only: bool) -> Dict[str, int]:
+        """Общая часть automate_categories и automate_categories_missing_only.
+
+        missing_only: только записи без категории, упрощённая нормализация названий ЖК,
+        без правила подмножества в нечётком сопоставлении и без второго прохода по complex из API.
+        """
+        # 1) Проверяем настройки Google Sheets
         credentials_file = 'credentials.json'
         if not os.path.exists(credentials_file):
             raise ValueError(f"Файл {credentials_file} не найден")
         if not SHEET_ID or not THIRD_SHEET_GID:
             raise ValueError("Переменные окружения SHEET_ID или THIRD_SHEET_GID не установлены")
 
-        credentials = Credentials.from_service_account_file(
-            credentials_file,
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
-        )
-        gc = gspread.authorize(credentials)
-        spreadsheet = gc.open_by_key(SHEET_ID)
-        third_ws = spreadsheet.get_worksheet_by_id(int(THIRD_SHEET_GID))
-
-        rows = third_ws.get_all_values()
-        if not rows:
-            return {"updated": 0, "skipped": 0, "errors": 0}
-
-        header_row_idx = 0
-        for i, r in enumerate(rows):
-            line = ' '.join(r).lower()
-            if ('жк' in line) or ('крыша' in line) or ('витрина' in line) or ('общий балл' in line):
-                header_row_idx = i
-                break
-
-        def idx_by_name(header: List[str], names: List[str], default: Optional[int] = None) -> Optional[int]:
-            header_low = [h.strip().lower() for h in header]
-            for name in names:
-                if name.lower() in header_low:
-                    return header_low.index(name.lower())
-            return default
-
-        header = rows[header_row_idx] if rows else []
-        complex_col = 0 if len(header) >= 1 else idx_by_name(header, ['жк', 'комплекс'])
-        roof_col = 1 if len(header) >= 2 else idx_by_name(header, ['крыша', 'roof'])
-        score_col = 2 if len(header) >= 3 else idx_by_name(header, ['общий балл', 'балл', 'score'])
-        window_col = 3 if len(header) >= 4 else idx_by_name(header, ['витрина', 'window'])
-
-        if complex_col is None:
-            complex_col = 0
-        if roof_col is None:
-            roof_col = 1
-        if score_col is None:
-            score_col = 2
-        if window_col is None:
-            window_col = 3
-
-        def to_float_safe(v):
-            try:
-                s = str(v).replace(' ', '').replace('\u00A0', '')
-                s = s.replace(',', '.')
-                if s.strip() == '':
-                    return None
-                return float(s)
-            except Exception:
-                return None
-
-        def norm_complex(x: str) -> str:
-            s = (x or '').lower()
-            for token in ['жк', 'жилой комплекс', 'residence', 'residential', 'complex']:
-                s = s.replace(token, ' ')
-            for ch in ['"', '\'', '«', '»', '.', ',', ';', ':', '(', ')', '[', ']', '{', '}', '/', '\\', '-']:
-                s = s.replace(ch, ' ')
-            s = ' '.join(s.split())
-            return s
-
-        complex_to_params: Dict[str, Dict[str, Optional[float]]] = {}
-        for i, r in enumerate(rows):
-            if i <= header_row_idx:
-                continue
-            complex_name = (r[complex_col] if complex_col < len(r) else '').strip()
-            if not complex_name:
-                continue
-            roof_raw = r[roof_col] if roof_col < len(r) else ''
-            score_raw = r[score_col] if score_col < len(r) else ''
-            window_raw = r[window_col] if window_col < len(r) else ''
-            key_main = norm_complex(complex_name)
-            complex_to_params[key_main] = {
-                'roof': to_float_safe(roof_raw),
-                'score': to_float_safe(score_raw),
-                'window': to_float_safe(window_raw),
-            }
-            # Добавляем облегчённый ключ без хвостов вида 2-1
-            import re
-            key_variant = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", key_main)
-            if key_variant != key_main and key_variant not in complex_to_params:
-                complex_to_params[key_variant] = complex_to_params[key_main]
+        # 2) Лист читается фоновой задачей (повторные запуски подряд берут строки из кеша),
+        # пока открывается сессия и БД выполняет запрос к properties
+        normalize = _norm_complex_basic if missing_only else _norm_complex
+
+        async def load_params() -> Optional[_ComplexParams]:
+            rows = await self._load_third_sheet_rows(max_age=_AUTOMATE_SHEET_MAX_AGE)
+            return _parse_complex_params(rows, normalize, dash_aliases=missing_only) if rows else None
+
+        params_task = asyncio.create_task(load_params())
+        # Названия ЖК в properties сильно повторяются: результат поиска по вариантам запоминаем на время прогона
+        variant_hits: Dict[str, Optional[str]] = {}
+        api_second_pass = not missing_only
+        row_filter = f" WHERE {_MISSING_CATEGORY_WHERE}" if missing_only else ""
+
+        # 3) Читаем properties порциями серверного курсора: первый проход сопоставления идёт по мере чтения,
+        # а данные CRM для каждой порции запрашиваются фоновой задачей, пока читается следующая;
+        # как только площади порции получены, её сопоставленные строки сразу уходят в UPDATE.
+        # Площадь нужна сопоставленным (и сопоставленным во втором проходе), complex из API — несопоставленным
+        # Строки храним кортежами (crm_id, contract_price, complex) в порядке колонок SELECT
+        rows_prepared: List[Tuple[Tuple[Any, Any, Any], int]] = []
+        unmatched_rows: List[Tuple[Any, Any, Any]] = []
+        not_found_logged = 0
+        matched_logged = 0
+        all_ids: set = set()
+        crm_data: Dict[str, Dict] = {}
+        # Общий долгоживущий клиент: соединения к CRM переиспользуются между прогонами
+        api_client = await self._ensure_api_client()
+        # Запросы к CRM идут по одному: порции не должны умножать параллелизм внутри get_crm_data_batch
+        api_slot = asyncio.Semaphore(1)
+
+        async def fetch_crm(ids: List[str]) -> Dict[str, Dict]:
+            async with api_slot:
+                return await api_client.get_crm_data_batch(ids, batch_size=DB_BATCH_SIZE)
 
-        # Грузим только записи без категории
-        async with self.async_session() as session:
-            res = await session.execute(text(
-                "SELECT crm_id, contract_price, complex FROM properties WHERE category IS NULL OR TRIM(category) = ''"
-            ))
-            db_rows = [dict(r._mapping) for r in res.fetchall()]
-
-        def is_num(x) -> bool:
-            return isinstance(x, (int, float)) and x is not None
-
-        def assign_category(contract_price: Optional[float], window_price: Optional[float], roof_price: Optional[float], score: Optional[float]) -> str:
-            score_is_num = is_num(score)
-            if score_is_num:
-                if all(is_num(x) for x in [contract_price, window_price, roof_price]):
-                    if (window_price <= contract_price <= roof_price) and (score > 8):
-                        return 'A'
-                    elif ((contract_price < window_price) or (contract_price > roof_price)) or (5 <= score <= 8):
-                        return 'B'
-                    elif (contract_price > roof_price) and (score < 5):
-                        return 'C'
-            else:
-                if all(is_num(x) for x in [contract_price, window_price, roof_price]):
-                    if (window_price <= contract_price <= roof_price):
-                        return 'B'
-                if (window_price is None) or (roof_price is None):
-                    if is_num(score) and (score > 8):
-                        return 'A'
-                    elif is_num(score) and (5 <= score <= 8):
-                        return 'B'
-            return 'C'
+        sample_logged = 0
 
-        def find_best_match(norm_name: str) -> Optional[str]:
-            name_set = set(norm_name.split())
-            if not name_set:
-                return None
-            best_key, best_score = None, 0.0
-            for k in complex_to_params.keys():
-                k_set = set(k.split())
-                if not k_set:
-                    continue
-                inter = len(name_set & k_set)
-                union = len(name_set | k_set)
-                score = inter / union if union else 0.0
-                if score > best_score:
-                    best_score, best_key = score, k
-            return best_key if best_score >= 0.45 else None
-
-        def find_by_variants(raw_name: str) -> Optional[str]:
-            import re
-            base = norm_complex(raw_name)
-            parts = base.split()
-            if not parts:
-                return None
-            def all_parts_in_key(parts_list: List[str], key: str) -> bool:
-                for p in parts_list:
-                    if p and p not in key:
-                        return False
-                return True
-            for cut in range(0, len(parts)):
-                variant_parts = parts[:len(parts) - cut]
-                variant_parts = [p for p in variant_parts if not p.isdigit()]
-                if not variant_parts:
-                    continue
-                variant_str = ' '.join(variant_parts)
-                if variant_str in complex_to_params:
-                    return variant_str
-                for key in complex_to_params.keys():
-                    if all_parts_in_key(variant_parts, key):
-                        return key
-            return None
+        def build_pending(prepared: List[Tuple[Tuple[Any, Any, Any], int]], data: Dict[str, Dict]):
+            """Параметры строк для bulk_assign_contract_categories; категорию считает БД (_category_case)"""
+            nonlocal sample_logged
+            pending: List[Tuple[str, Optional[float], Optional[float], Optional[float], Optional[float]]] = []
+            failed = 0
+            for row, sheet_idx in prepared:
+                try:
+                    crm_id_db, contract_price, complex_db = row
+                    crm_id = str(crm_id_db or '').strip()
+                    area_val = (data.get(crm_id) or {}).get('area')
+                    try:
+                        area = float(area_val) if area_val is not None else None
+                    except Exception:
+                        area = None
+                    roof = complex_to_params.roof[sheet_idx]
+                    window = complex_to_params.window[sheet_idx]
+                    score = complex_to_params.score[sheet_idx]
+                    if sample_logged < 15:
+                        logger.info(
+                            "automate_categories params | crm_id=%s | complex='%s' | contract_price=%s | area=%s | roof=%s | window=%s | score=%s",
+                            crm_id, complex_db, contract_price, area, roof, window, score
+                        )
+                        sample_logged += 1
+                    pending.append((crm_id, area, window, roof, score))
+                except Exception as e:
+                    logger.error(f"Ошибка automate_categories для {row}: {e}")
+                    failed += 1
+            return pending, failed
+
+        # Запись порций тоже идёт по одной (внутри bulk_assign_contract_categories свой параллелизм),
+        # но перекрывается с запросом к CRM следующей порции и чтением курсора
+        update_slot = asyncio.Semaphore(1)
+
+        async def process_partition(fetch_ids: List[str], prepared: List[Tuple[Tuple[Any, Any, Any], int]]) -> Tuple[int, int]:
+            data: Dict[str, Dict] = {}
+            if fetch_ids:
+                try:
+                    data = await fetch_crm(fetch_ids)
+                except Exception as e:
+                    logger.error(f"Ошибка пакетного получения площадей: {e}")
+                if api_second_pass:
+                    crm_data.update(data)
+            pending, failed = build_pending(prepared, data)
+            if not pending:
+                return 0, failed
+            async with update_slot:
+                part_updated = await self.bulk_assign_contract_categories(pending)
+            return part_updated, failed + len(pending) - part_updated
+
+        tasks: List[asyncio.Task] = []
+        try:
+            async with self.async_session() as session:
+                res = await session.stream(text(
+                    f"SELECT crm_id, contract_price, complex FROM properties{row_filter}"
+                ).execution_options(yield_per=DB_STREAM_YIELD_PER))
+                complex_to_params = await params_task
+                if complex_to_params is None:
+                    return {"updated": 0, "skipped": 0, "errors": 0}
+                token_index = _TokenIndex(complex_to_params)
+                substring_index = _SubstringIndex(complex_to_params)
+                async for partition in res.partitions():
+                    part_ids: List[str] = []
+                    fetch_ids: List[str] = []
+                    part_prepared: List[Tuple[Tuple[Any, Any, Any], int]] = []
+                    for row in partition:
+                        crm_id_db, _, complex_db = row
+                        crm_id = str(crm_id_db) if crm_id_db else None
+                        if crm_id:
+                            part_ids.append(crm_id)
+                        complex_name_db = str(complex_db or '')
+                        complex_key = normalize(complex_name_db)
+                        sheet_idx = complex_to_params.get(complex_key)
+                        if sheet_idx is None:
+                            # сначала быстрый матч по вариантам укорачивания, затем по похожести токенов
+                            if complex_key not in variant_hits:
+                                variant_hits[complex_key] = _find_by_variants(
+                                    complex_key, complex_to_params, substring_index
+                                )
+                            best = variant_hits[complex_key]
+                            if not best:
+                                best = token_index.best_match(complex_key, subset_rule=not missing_only)
+                            if best:
+                                sheet_idx = complex_to_params.get(best)
+                                if matched_logged < 15:
+                                    logger.info("ЖК сопоставлен по похожести: '%s' -> '%s'", complex_name_db, best)
+                                    matched_logged += 1
+                        if sheet_idx is None:
+                            if not_found_logged < 15:
+                                sample_keys = list(complex_to_params.keys())[:5]
+                                logger.info("Не найдено соответствие ЖК: '%s' (норм: '%s'). Примеры ключей листа: %s",
+                                            complex_name_db, complex_key, sample_keys)
+                                not_found_logged += 1
+                            unmatched_rows.append(row)
+                            if crm_id and api_second_pass:
+                                fetch_ids.append(crm_id)
+                            continue
+                        part_prepared.append((row, sheet_idx))
+                        if crm_id:
+                            fetch_ids.append(crm_id)
+                    all_ids.update(part_ids)
+                    rows_prepared.extend(part_prepared)
+                    if fetch_ids or part_prepared:
+                        tasks.append(asyncio.create_task(process_partition(fetch_ids, part_prepared)))
+        except BaseException:
+            params_task.cancel()
+            for task in tasks:
+                task.cancel()
+            raise
 
-        # Первый проход сопоставления
-        rows_prepared: List[Tuple[Dict[str, Any], Dict[str, Optional[float]]]] = []
-        unmatched_rows: List[Dict[str, Any]] = []
-        not_found_logged = 0
-        for row in db_rows:
-            complex_name_db = str(row.get('complex') or '')
-            complex_key = norm_complex(complex_name_db)
-            sheet_params = complex_to_params.get(complex_key)
-            if not sheet_params:
-                best = find_by_variants(complex_name_db)
-                if not best:
-                    best = find_best_match(complex_key)
-                if best:
-                    sheet_params = complex_to_params.get(best)
-                    logger.info("ЖК сопоставлен по похожести: '%s' -> '%s'", complex_name_db, best)
-            if not sheet_params:
-                if not_found_logged < 15:
-                    sample_keys = list(complex_to_params.keys())[:5]
-                    logger.info("Не найдено соответствие ЖК: '%s' (норм: '%s'). Примеры ключей листа: %s",
-                                complex_name_db, complex_key, sample_keys)
-                    not_found_logged += 1
-                unmatched_rows.append(row)
+        updated = 0
+        errors = 0
+        for part in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(part, Exception):
+                logger.error(f"Ошибка обработки порции automate_categories: {part}")
                 continue
-            rows_prepared.append((row, sheet_params))
+            updated += part[0]
+            errors += part[1]
 
-        area_by_crm: Dict[str, Optional[float]] = {}
+        # 4) Второй проход: для несопоставленных возьмём complex из API и попробуем матчинг
+        # (в режиме missing_only отключён: имя ЖК берём только из SQL)
+        second_prepared: List[Tuple[Tuple[Any, Any, Any], int]] = []
         try:
-            async with APIClient() as api_client:
-                # Площади для уже сопоставленных
-                crm_ids = [str(r[0].get('crm_id')) for r in rows_prepared if r[0].get('crm_id')]
-                if crm_ids:
-                    crm_data = await api_client.get_crm_data_batch(crm_ids, batch_size=DB_BATCH_SIZE)
-                    for cid, data in crm_data.items():
-                        area_val = (data or {}).get('area')
-                        try:
-                            area_by_crm[cid] = float(area_val) if area_val is not None else None
-                        except Exception:
-                            area_by_crm[cid] = None
-
-                # Второй проход по API отключен: берём имя ЖК только из SQL
+            unmatched_ids = [str(r[0]) for r in unmatched_rows if r[0]] if api_second_pass else []
+            if unmatched_ids:
+                api_unmatched_names_logged = set()
+                unmatched_by_id = {str(r[0]): r for r in unmatched_rows if r[0]}
+                for cid in unmatched_ids:
+                    data = crm_data.get(cid)
+                    if data is None:
+                        continue
+                    api_complex = str((data or {}).get('complex') or '')
+                    api_key = normalize(api_complex)
+                    sp = complex_to_params.get(api_key)
+                    if sp is None:
+                        best2 = token_index.best_match(api_key)
+                        if best2:
+                            sp = complex_to_params.get(best2)
+                            logger.info("ЖК (API) сопоставлен по похожести: '%s' -> '%s'", api_complex, best2)
+                    if sp is not None:
+                        second_prepared.append((unmatched_by_id[cid], sp))
+                    else:
+                        if len(api_unmatched_names_logged) < 15 and api_key not in api_unmatched_names_logged:
+                            logger.info("Не найдено соответствие ЖК (по API complex): '%s'", api_complex)
+                            api_unmatched_names_logged.add(api_key)
         except Exception as e:
-            logger.error(f"Ошибка пакетного получения площадей: {e}")
+            logger.error(f"Ошибка второго прохода сопоставления по complex из API: {e}")
+        rows_prepared.extend(second_prepared)
 
-        # Подсчитываем пропуски
-        prepared_ids = {str(r[0].get('crm_id')) for r in rows_prepared if r[0].get('crm_id')}
-        all_ids = {str(r.get('crm_id')) for r in db_rows if r.get('crm_id')}
+        # Подсчитываем пропуски после сопоставления
+        prepared_ids = {str(row[0]) for row, _ in rows_prepared if row[0]}
         skipped = len(all_ids - prepared_ids)
 
-        # Обновляем категории
-        updated, errors = 0, 0
-        sample_logged = 0
-        for row, sheet_params in rows_prepared:
-            try:
-                crm_id = str(row.get('crm_id') or '').strip()
-                complex_name_db = str(row.get('complex') or '')
-                contract_price = row.get('contract_price')
-                roof = sheet_params.get('roof')
-                window = sheet_params.get('window')
-                score = sheet_params.get('score')
-                area = area_by_crm.get(crm_id)
-                window_price = (window * area) if (window is not None and area is not None) else None
-                roof_price = (roof * area) if (roof is not None and area is not None) else None
-                category = assign_category(contract_price, window_price, roof_price, score)
-                if sample_logged < 15:
-                    logger.info(
-                        "assign_category_2 params | crm_id=%s | complex='%s' | contract_price=%s | area=%s | roof=%s | window=%s | score=%s | window_price=%s | roof_price=%s | result=%s",
-                        crm_id, complex_name_db, contract_price, area, roof, window, score, window_price, roof_price, category
-                    )
-                    sample_logged += 1
-                ok = await self.update_contract_category(crm_id, category)
-                if ok:
-                    updated += 1
-                else:
-                    errors += 1
-            except Exception as e:
-                logger.error(f"Ошибка automate_categories_missing_only для {row}: {e}")
-                errors += 1
+        # 5) Сопоставленные во втором проходе записываем одной пачкой после него
+        if second_prepared:
+            pending, failed = build_pending(second_prepared, crm_data)
+            second_updated = await self.bulk_assign_contract_categories(pending) if pending else 0
+            updated += second_updated
+            errors += failed + len(pending) - second_updated
 
         return {"updated": updated, "skipped": skipped, "errors": errors}
 
     async def get_role_totals(self, owner_name: str, owner_role: str) -> Dict[str, int]:
         """Сводные показатели по объектам для владельца роли (РОП/ДД)."""
+        if _fio_is_empty(owner_name):
+            return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
         role_col = 'rop' if owner_role == 'РОП' else 'dd'
-        fio_parts = [p for p in str(owner_name).strip().split() if p]
-        surname = fio_parts[0] if fio_parts else ''
-        name = fio_parts[1] if len(fio_parts) > 1 else ''
-        surname_like = f"%{surname.lower()}%"
-        name_like = f"%{name.lower()}%"
+        surname, name, surname_like, name_like = _parse_fio(owner_name)
         try:
             async with self.async_session() as session:
                 col = properties.c.rop if owner_role == 'РОП' else properties.c.dd
                 cond = and_(
-                    func.lower(col).like(surname_like),
-                    func.lower(col).like(name_like),
+                    col.ilike(surname_like),
+                    col.ilike(name_like),
                     ACTIVE_STATUS_FILTER
                 )
-                total = (await session.execute(select(func.count()).select_from(properties).where(cond))).scalar() or 0
                 cat_rows = (await session.execute(
                     select(properties.c.category, func.count().label('cnt')).where(cond).group_by(properties.c.category)
                 )).fetchall()
-                cats = { (row.category or '').strip().upper(): row.cnt for row in cat_rows }
-                return {
-                    'total': total,
-                    'cat_A': cats.get('А', 0) + cats.get('A', 0),
-                    'cat_B': cats.get('В', 0) + cats.get('B', 0),
-                    'cat_C': cats.get('С', 0) + cats.get('C', 0),
-                }
+                return _category_totals(cat_rows)
         except Exception as e:
             logger.error(f"Ошибка get_role_totals({owner_name}, {owner_role}): {e}")
             return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
 
     async def get_dds_with_counts(self) -> List[Dict[str, Any]]:
         """Возвращает всех ДД (ФИО + количество объектов). Используется в ADMIN_VIEW."""
+        cached = self._stats_get(('get_dds_with_counts',))
+        if cached is not None:
+            return cached
         try:
             async with self.async_session() as session:
-                res = await session.execute(text(
-                    "SELECT dd AS name, COUNT(*) AS cnt "
-                    "FROM properties "
-                    "WHERE dd IS NOT NULL AND dd <> '' "
-                    "GROUP BY dd "
-                    "ORDER BY cnt DESC NULLS LAST"
-                ))
-                items: List[Dict[str, Any]] = []
-                for row in res.fetchall():
-                    items.append({'name': row.name, 'count': row.cnt})
-                return items
+                res = await session.execute(_SELECT_OWNERS_WITH_COUNTS['ДД'])
+                items: List[Dict[str, Any]] = [{'name': name, 'count': cnt} for name, cnt in res]
+                return self._stats_put(('get_dds_with_counts',), items)
         except Exception as e:
             logger.error(f"Ошибка get_dds_with_counts(): {e}")
             return []
@@ -1467,75 +1999,83 @@ class PostgreSQLManager:
         """Получает все объекты конкретного ДД с фильтрацией по категории (для ADMIN_VIEW и меню ДД)."""
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(dd_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-
-                where_clause = "(LOWER(dd) LIKE :surname_like AND LOWER(dd) LIKE :name_like)"
-                params = {"surname_like": surname_like, "name_like": name_like}
-
+                params = _fio_params(dd_name)
                 if category:
-                    cat_upper = category.upper()
-                    cat_mapping = {'A': 'А', 'B': 'В', 'C': 'С'}
-                    cat_cyr = cat_mapping.get(cat_upper, cat_upper)
-                    where_clause += " AND (UPPER(category) = :cat OR UPPER(category) = :cat_cyr)"
-                    params['cat'] = cat_upper
-                    params['cat_cyr'] = cat_cyr
-
-                status_filter_sql = " AND (status IS NULL OR LOWER(status) != 'реализовано')"
-                result = await session.execute(
-                    text(f"SELECT * FROM properties WHERE {where_clause}{status_filter_sql} ORDER BY last_modified_at DESC"),
-                    params
-                )
+                    params.update(_category_params(category))
 
-                contracts: List[Dict] = []
-                for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
+                result = await session.stream(_SELECT_CONTRACTS[('ДД', bool(category), True)], params)
+
+                contracts: List[Dict] = await _collect_legacy(result)
                 return contracts
         except Exception as e:
             logger.error(f"Ошибка get_dd_contracts_by_category({dd_name}, {category}): {e}")
             return []
 
+    async def _stream_contracts_page(self, stmt, params: Dict[str, Any], page: int, page_size: int) -> Tuple[List[Dict], int]:
+        """Читает список объектов серверным курсором и возвращает (страница, всего).
+
+        Legacy-словари строятся только для строк запрошенной страницы, остальные строки лишь считаются —
+        память не растёт с размером выборки.
+        """
+        start = max(0, (page - 1) * page_size)
+        end = start + page_size
+        page_contracts: List[Dict] = []
+        total = 0
+        async with self.async_session() as session:
+            result = await session.stream(stmt, params)
+            async for partition in result.partitions():
+                if total < end and total + len(partition) > start:
+                    lo = max(start - total, 0)
+                    page_contracts.extend(map(_legacy_from_row, partition[lo:end - total]))
+                total += len(partition)
+        return page_contracts, total
+
+    async def get_dd_contracts_page(self, dd_name: str, category: Optional[str], page: int, page_size: int) -> Tuple[List[Dict], int]:
+        """Страница объектов ДД (как get_dd_contracts_by_category) и их общее число"""
+        try:
+            params = _fio_params(dd_name)
+            if category:
+                params.update(_category_params(category))
+            return await self._stream_contracts_page(_SELECT_CONTRACTS[('ДД', bool(category), True)], params, page, page_size)
+        except Exception as e:
+            logger.error(f"Ошибка get_dd_contracts_page({dd_name}, {category}, {page}): {e}")
+            return [], 0
+
+    async def get_global_contracts_page(self, category: Optional[str], page: int, page_size: int) -> Tuple[List[Dict], int]:
+        """Страница объектов по всей базе (как get_global_contracts_by_category) и их общее число"""
+        try:
+            params: Dict[str, Any] = _category_params(category) if category else {}
+            return await self._stream_contracts_page(_SELECT_CONTRACTS[('*', bool(category), True)], params, page, page_size)
+        except Exception as e:
+            logger.error(f"Ошибка get_global_contracts_page({category}, {page}): {e}")
+            return [], 0
+
     async def get_all_mops_with_counts(self) -> List[Dict[str, Any]]:
         """Возвращает всех МОП-ов (ФИО + количество объектов) по всей базе. Используется в ADMIN_VIEW."""
+        cached = self._stats_get(('get_all_mops_with_counts',))
+        if cached is not None:
+            return cached
         try:
             async with self.async_session() as session:
-                res = await session.execute(text(
-                    "SELECT mop AS name, COUNT(*) AS cnt "
-                    "FROM properties "
-                    "WHERE mop IS NOT NULL AND mop <> '' "
-                    "GROUP BY mop "
-                    "ORDER BY cnt DESC NULLS LAST"
-                ))
-                items: List[Dict[str, Any]] = []
-                for row in res.fetchall():
-                    items.append({'name': row.name, 'count': row.cnt})
-                return items
+                res = await session.execute(_SELECT_OWNERS_WITH_COUNTS['МОП'])
+                items: List[Dict[str, Any]] = [{'name': name, 'count': cnt} for name, cnt in res]
+                return self._stats_put(('get_all_mops_with_counts',), items)
         except Exception as e:
             logger.error(f"Ошибка get_all_mops_with_counts(): {e}")
             return []
 
     async def get_global_totals(self) -> Dict[str, int]:
         """Глобальная статистика по объектам (все ДД/РОП/МОП) для ADMIN_VIEW."""
+        cached = self._stats_get(('get_global_totals',))
+        if cached is not None:
+            return cached
         try:
             async with self.async_session() as session:
                 cond = ACTIVE_STATUS_FILTER
-                total = (await session.execute(
-                    select(func.count()).select_from(properties).where(cond)
-                )).scalar() or 0
                 cat_rows = (await session.execute(
                     select(properties.c.category, func.count().label('cnt')).where(cond).group_by(properties.c.category)
                 )).fetchall()
-                cats = { (row.category or '').strip().upper(): row.cnt for row in cat_rows }
-                return {
-                    'total': total,
-                    'cat_A': cats.get('А', 0) + cats.get('A', 0),
-                    'cat_B': cats.get('В', 0) + cats.get('B', 0),
-                    'cat_C': cats.get('С', 0) + cats.get('C', 0),
-                }
+                return self._stats_put(('get_global_totals',), _category_totals(cat_rows))
         except Exception as e:
             logger.error(f"Ошибка get_global_totals(): {e}")
             return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
@@ -1544,27 +2084,14 @@ class PostgreSQLManager:
         """Возвращает объекты по всей базе для ADMIN_VIEW, с опциональной фильтрацией по категории."""
         try:
             async with self.async_session() as session:
-                where_clause = "1=1"
                 params: Dict[str, Any] = {}
                 if category:
-                    cat_upper = category.upper()
-                    cat_mapping = {'A': 'А', 'B': 'В', 'C': 'С'}
-                    cat_cyr = cat_mapping.get(cat_upper, cat_upper)
-                    where_clause += " AND (UPPER(category) = :cat OR UPPER(category) = :cat_cyr)"
-                    params['cat'] = cat_upper
-                    params['cat_cyr'] = cat_cyr
-
-                # Применяем фильтр по активным статусам
-                status_filter_sql = " AND (status IS NULL OR LOWER(status) != 'реализовано')"
-                query = text(
-                    f"SELECT * FROM properties WHERE {where_clause}{status_filter_sql} ORDER BY last_modified_at DESC"
-                )
-                result = await session.execute(query, params)
+                    params.update(_category_params(category))
 
-                contracts: List[Dict] = []
-                for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
+                # Только активные статусы
+                result = await session.stream(_SELECT_CONTRACTS[('*', bool(category), True)], params)
+
+                contracts: List[Dict] = await _collect_legacy(result)
                 return contracts
         except Exception as e:
             logger.error(f"Ошибка get_global_contracts_by_category({category}): {e}")
@@ -1576,57 +2103,67 @@ class PostgreSQLManager:
         """
         owner_col = 'rop' if owner_role == 'РОП' else 'dd'
         sub_col = 'mop' if subordinate_role == 'МОП' else 'rop'
-        fio_parts = [p for p in str(owner_name).strip().split() if p]
-        surname = fio_parts[0] if fio_parts else ''
-        name = fio_parts[1] if len(fio_parts) > 1 else ''
-        surname_like = f"%{surname.lower()}%"
-        name_like = f"%{name.lower()}%"
+        if _fio_is_empty(owner_name):
+            return []
+        surname, name, surname_like, name_like = _parse_fio(owner_name)
         try:
             async with self.async_session() as session:
                 res = await session.execute(text(
                     f"SELECT {sub_col} AS name, COUNT(*) AS cnt FROM properties "
-                    f"WHERE LOWER({owner_col}) LIKE :surname_like AND LOWER({owner_col}) LIKE :name_like "
+                    f"WHERE {_fio_where(owner_col)} "
                     f"GROUP BY {sub_col} ORDER BY cnt DESC NULLS LAST"
                 ), {"surname_like": surname_like, "name_like": name_like})
-                items = []
-                for row in res.fetchall():
-                    items.append({'name': row.name, 'count': row.cnt})
+                items = [{'name': name, 'count': cnt} for name, cnt in res]
                 return items
         except Exception as e:
             logger.error(f"Ошибка get_subordinates({owner_name}, {owner_role}, {subordinate_role}): {e}")
             return []
 
     async def count_pending_tasks_for_owner(self, owner_name: str, owner_role: str) -> int:
-        """Подсчитывает невыполненные задачи по всем объектам владельца роли.
-        Для простоты грузим партии и считаем на Python, используя близкую логику UI.
-        """
+        """Подсчитывает невыполненные задачи по всем объектам владельца роли (РОП/ДД) одним SQL-запросом"""
         try:
-            # Грузим все записи постранично, чтобы не держать всё в памяти
-            page = 1
-            page_size = 200
-            total_pending = 0
-            while True:
-                if owner_role == 'РОП':
-                    where_role = 'РОП'
-                else:
-                    where_role = 'ДД'
-                contracts, total_count = await self.get_agent_contracts_page(owner_name, page, page_size, where_role)
-                if not contracts:
-                    break
-                from handlers import get_status_value, build_pending_tasks  # локальный импорт, чтобы избежать циклов при старте
-                for c in contracts:
-                    status_value = get_status_value(c)
-                    analytics_mode_active = (status_value == 'Аналитика')
-                    pending = build_pending_tasks(c, status_value, analytics_mode_active)
-                    total_pending += len(pending)
-                if page * page_size >= total_count:
-                    break
-                page += 1
-            return total_pending
+            return await self._count_pending_tasks('РОП' if owner_role == 'РОП' else 'ДД', owner_name)
         except Exception as e:
             logger.error(f"Ошибка count_pending_tasks_for_owner({owner_name}, {owner_role}): {e}")
             return 0
 
+    async def _count_pending_tasks(self, role: str, agent_name: str) -> int:
+        """Невыполненные задачи по объектам агента роли role ('МОП'|'РОП'|'ДД') одним SQL-запросом"""
+        if _fio_is_empty(agent_name):
+            return 0
+        surname, name, surname_like, name_like = _parse_fio(agent_name)
+        async with self.async_session() as session:
+            result = await session.execute(
+                _SELECT_PENDING_TASKS[role], {"surname_like": surname_like, "name_like": name_like}
+            )
+            return result.scalar() or 0
+
+    async def count_pending_tasks_bulk(self, role: str, agent_names: Iterable[str]) -> Dict[str, int]:
+        """Невыполненные задачи сразу для списка агентов роли role — один запрос вместо запроса на агента.
+
+        Суммы считаются по каждому значению колонки агента (GROUP BY), затем для каждого имени складываются
+        значения, содержащие его фамилию и имя, — так же, как фильтр ILIKE в count_pending_tasks_for_mop/rop.
+        """
+        names = list(dict.fromkeys(agent_names))
+        if not names:
+            return {}
+        try:
+            async with self.async_session() as session:
+                result = await session.execute(_SELECT_PENDING_TASKS_BY_OWNER[role])
+                by_owner = [(owner.lower(), pending or 0) for owner, pending in result.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка count_pending_tasks_bulk({role}, {len(names)} агентов): {e}")
+            return {name: 0 for name in names}
+        totals: Dict[str, int] = {}
+        for agent_name in names:
+            surname, name, _, _ = _parse_fio(agent_name)
+            if not surname:
+                totals[agent_name] = 0
+                continue
+            matches = _fio_matcher(surname, name)
+            totals[agent_name] = sum(pending for owner, pending in by_owner if matches(owner))
+        return totals
+
     async def count_pending_tasks_for_mop(self, mop_name: str) -> int:
         """Подсчитывает невыполненные задачи у конкретного МОП-а через SQL
         Считает количество задач точно как build_pending_tasks:
@@ -1634,59 +2171,7 @@ class PostgreSQLManager:
         - "Добавить ссылки" - это одна задача, даже если несколько ссылок отсутствует
         """
         try:
-            async with self.async_session() as session:
-                fio_parts = [p for p in str(mop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                # SQL запрос для подсчета количества задач по логике build_pending_tasks
-                query = text("""
-                    WITH mop_contracts AS (
-                        SELECT 
-                            crm_id,
-                            COALESCE(collage, false) as has_collage,
-                            COALESCE(prof_collage, false) as has_prof_collage,
-                            COALESCE(NULLIF(krisha, ''), '') as krisha,
-                            COALESCE(NULLIF(instagram, ''), '') as instagram,
-                            COALESCE(NULLIF(tiktok, ''), '') as tiktok,
-                            COALESCE(NULLIF(mailing, ''), '') as mailing,
-                            COALESCE(NULLIF(stream, ''), '') as stream,
-                            COALESCE(status, 'Размещено') as status,
-                            COALESCE(analytics, false) as has_analytics,
-                            COALESCE(provide_analytics, false) as has_provide_analytics,
-                            COALESCE(push_for_price, false) as has_push_for_price,
-                            COALESCE(NULLIF(NULLIF(price_update, ''), 'None'), '') as price_update
-                        FROM properties
-                        WHERE LOWER(mop) LIKE :surname_like AND LOWER(mop) LIKE :name_like
-                    )
-                    SELECT 
-                        -- Базовые задачи (только для статуса != 'Реализовано')
-                        SUM(CASE WHEN status != 'Реализовано' AND NOT has_collage THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status != 'Реализовано' AND has_collage AND NOT has_prof_collage THEN 1 ELSE 0 END) +
-                        -- "Добавить ссылки" - одна задача если хотя бы одна ссылка отсутствует
-                        SUM(CASE WHEN status != 'Реализовано' AND (krisha = '' OR instagram = '' OR tiktok = '' OR mailing = '' OR stream = '') THEN 1 ELSE 0 END) +
-                        -- Задачи для статуса "Аналитика"
-                        SUM(CASE WHEN status = 'Аналитика' AND NOT has_analytics THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status = 'Аналитика' AND has_analytics AND NOT has_provide_analytics THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status = 'Аналитика' AND has_provide_analytics AND NOT has_push_for_price THEN 1 ELSE 0 END) +
-                        -- Задачи для статуса "Корректировка цены"
-                        SUM(CASE WHEN status = 'Корректировка цены' AND NOT has_push_for_price THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status = 'Корректировка цены' AND price_update = '' THEN 1 ELSE 0 END) +
-                        -- "Добавить обновленные ссылки" - одна задача если хотя бы одна ссылка отсутствует
-                        SUM(CASE WHEN status = 'Корректировка цены' AND (krisha = '' OR instagram = '' OR tiktok = '' OR mailing = '' OR stream = '') THEN 1 ELSE 0 END) +
-                        -- Задача на смену статуса (если все базовые задачи выполнены, но статус не финальный)
-                        SUM(CASE WHEN status NOT IN ('Реализовано', 'Аналитика', 'Корректировка цены', 'Задаток/сделка')
-                                 AND has_collage AND has_prof_collage
-                                 AND krisha != '' AND instagram != '' AND tiktok != '' AND mailing != '' AND stream != '' THEN 1 ELSE 0 END) as total_tasks
-                    FROM mop_contracts
-                """)
-                
-                result = await session.execute(query, {"surname_like": surname_like, "name_like": name_like})
-                count = result.scalar() or 0
-                
-                return count
+            return await self._count_pending_tasks('МОП', mop_name)
         except Exception as e:
             logger.error(f"Ошибка count_pending_tasks_for_mop({mop_name}): {e}")
             return 0
@@ -1694,154 +2179,54 @@ class PostgreSQLManager:
     async def count_pending_tasks_for_rop(self, rop_name: str) -> int:
         """Подсчитывает невыполненные задачи у конкретного РОП-а через SQL"""
         try:
-            async with self.async_session() as session:
-                fio_parts = [p for p in str(rop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                # SQL запрос для подсчета количества задач по логике build_pending_tasks
-                query = text("""
-                    WITH rop_contracts AS (
-                        SELECT 
-                            crm_id,
-                            COALESCE(collage, false) as has_collage,
-                            COALESCE(prof_collage, false) as has_prof_collage,
-                            COALESCE(NULLIF(krisha, ''), '') as krisha,
-                            COALESCE(NULLIF(instagram, ''), '') as instagram,
-                            COALESCE(NULLIF(tiktok, ''), '') as tiktok,
-                            COALESCE(NULLIF(mailing, ''), '') as mailing,
-                            COALESCE(NULLIF(stream, ''), '') as stream,
-                            COALESCE(status, 'Размещено') as status,
-                            COALESCE(analytics, false) as has_analytics,
-                            COALESCE(provide_analytics, false) as has_provide_analytics,
-                            COALESCE(push_for_price, false) as has_push_for_price,
-                            COALESCE(NULLIF(NULLIF(price_update, ''), 'None'), '') as price_update
-                        FROM properties
-                        WHERE LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like
-                    )
-                    SELECT 
-                        -- Базовые задачи (только для статуса != 'Реализовано')
-                        SUM(CASE WHEN status != 'Реализовано' AND NOT has_collage THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status != 'Реализовано' AND has_collage AND NOT has_prof_collage THEN 1 ELSE 0 END) +
-                        -- "Добавить ссылки" - одна задача если хотя бы одна ссылка отсутствует
-                        SUM(CASE WHEN status != 'Реализовано' AND (krisha = '' OR instagram = '' OR tiktok = '' OR mailing = '' OR stream = '') THEN 1 ELSE 0 END) +
-                        -- Задачи для статуса "Аналитика"
-                        SUM(CASE WHEN status = 'Аналитика' AND NOT has_analytics THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status = 'Аналитика' AND has_analytics AND NOT has_provide_analytics THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status = 'Аналитика' AND has_provide_analytics AND NOT has_push_for_price THEN 1 ELSE 0 END) +
-                        -- Задачи для статуса "Корректировка цены"
-                        SUM(CASE WHEN status = 'Корректировка цены' AND NOT has_push_for_price THEN 1 ELSE 0 END) +
-                        SUM(CASE WHEN status = 'Корректировка цены' AND price_update = '' THEN 1 ELSE 0 END) +
-                        -- "Добавить обновленные ссылки" - одна задача если хотя бы одна ссылка отсутствует
-                        SUM(CASE WHEN status = 'Корректировка цены' AND (krisha = '' OR instagram = '' OR tiktok = '' OR mailing = '' OR stream = '') THEN 1 ELSE 0 END) +
-                        -- Задача на смену статуса (если все базовые задачи выполнены, но статус не финальный)
-                        SUM(CASE WHEN status NOT IN ('Реализовано', 'Аналитика', 'Корректировка цены', 'Задаток/сделка')
-                                 AND has_collage AND has_prof_collage
-                                 AND krisha != '' AND instagram != '' AND tiktok != '' AND mailing != '' AND stream != '' THEN 1 ELSE 0 END) as total_tasks
-                    FROM rop_contracts
-                """)
-                
-                result = await session.execute(query, {"surname_like": surname_like, "name_like": name_like})
-                count = result.scalar() or 0
-                
-                return count
+            return await self._count_pending_tasks('РОП', rop_name)
         except Exception as e:
             logger.error(f"Ошибка count_pending_tasks_for_rop({rop_name}): {e}")
             return 0
 
     async def get_rop_category_stats(self, rop_name: str) -> Dict[str, int]:
         """Получает статистику по категориям для конкретного РОП-а без загрузки всех объектов"""
+        if _fio_is_empty(rop_name):
+            return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
+        cache_key = ('get_rop_category_stats', rop_name)
+        cached = self._stats_get(cache_key)
+        if cached is not None:
+            return cached
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(rop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                # Используем отдельные запросы для каждой категории (как в get_role_totals)
-                # total
-                total_res = await session.execute(text(
-                    "SELECT COUNT(*) FROM properties WHERE LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like"
-                ), {"surname_like": surname_like, "name_like": name_like})
-                total = total_res.scalar() or 0
-                
-                # categories - используем GROUP BY как в get_role_totals
-                cat_res = await session.execute(text(
-                    "SELECT category, COUNT(*) cnt FROM properties "
-                    "WHERE LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like "
-                    "GROUP BY category"
-                ), {"surname_like": surname_like, "name_like": name_like})
-                cats = { (row.category or '').strip().upper(): row.cnt for row in cat_res.fetchall() }
+                surname, name, surname_like, name_like = _parse_fio(rop_name)
                 
-                return {
-                    'total': total,
-                    'cat_A': cats.get('А', 0) + cats.get('A', 0),
-                    'cat_B': cats.get('В', 0) + cats.get('B', 0),
-                    'cat_C': cats.get('С', 0) + cats.get('C', 0),
-                }
+                # Один GROUP BY: total — сумма по категориям (как в get_role_totals)
+                cat_res = await session.execute(
+                    _SELECT_ROP_CATEGORY_COUNTS, {"surname_like": surname_like, "name_like": name_like}
+                )
+                return self._stats_put(cache_key, _category_totals(cat_res.fetchall()))
         except Exception as e:
             logger.error(f"Ошибка get_rop_category_stats({rop_name}): {e}")
             return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
 
     async def get_mop_category_stats(self, mop_name: str, rop_name: Optional[str] = None, dd_name: Optional[str] = None) -> Dict[str, int]:
         """Получает статистику по категориям для конкретного МОП-а без загрузки всех объектов, опционально фильтрует по РОП-у и ДД"""
+        if _fio_is_empty(mop_name):
+            return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
+        cache_key = ('get_mop_category_stats', mop_name, rop_name, dd_name)
+        cached = self._stats_get(cache_key)
+        if cached is not None:
+            return cached
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(mop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                where_clause = "(LOWER(mop) LIKE :surname_like AND LOWER(mop) LIKE :name_like)"
-                params = {"surname_like": surname_like, "name_like": name_like}
-                
-                # Добавляем фильтр по РОП-у, если указан
+                params = _fio_params(mop_name)
+                # Добавляем фильтры по РОП-у и ДД, если указаны
                 if rop_name:
-                    rop_fio_parts = [p for p in str(rop_name).strip().split() if p]
-                    rop_surname = rop_fio_parts[0] if rop_fio_parts else ''
-                    rop_name_part = rop_fio_parts[1] if len(rop_fio_parts) > 1 else ''
-                    rop_surname_like = f"%{rop_surname.lower()}%"
-                    rop_name_like = f"%{rop_name_part.lower()}%"
-                    where_clause += " AND (LOWER(rop) LIKE :rop_surname_like AND LOWER(rop) LIKE :rop_name_like)"
-                    params['rop_surname_like'] = rop_surname_like
-                    params['rop_name_like'] = rop_name_like
-                
-                # Добавляем фильтр по ДД, если указан
+                    params.update(_fio_params(rop_name, 'rop_'))
                 if dd_name:
-                    dd_fio_parts = [p for p in str(dd_name).strip().split() if p]
-                    dd_surname = dd_fio_parts[0] if dd_fio_parts else ''
-                    dd_name_part = dd_fio_parts[1] if len(dd_fio_parts) > 1 else ''
-                    dd_surname_like = f"%{dd_surname.lower()}%"
-                    dd_name_like = f"%{dd_name_part.lower()}%"
-                    where_clause += " AND (LOWER(dd) LIKE :dd_surname_like AND LOWER(dd) LIKE :dd_name_like)"
-                    params['dd_surname_like'] = dd_surname_like
-                    params['dd_name_like'] = dd_name_like
-                
-                # Используем отдельные запросы для каждой категории (как в get_role_totals)
-                # total
-                total_res = await session.execute(text(
-                    f"SELECT COUNT(*) FROM properties WHERE {where_clause}"
-                ), params)
-                total = total_res.scalar() or 0
-                
-                # categories - используем GROUP BY как в get_role_totals
-                cat_res = await session.execute(text(
-                    f"SELECT category, COUNT(*) cnt FROM properties "
-                    f"WHERE {where_clause} "
-                    f"GROUP BY category"
-                ), params)
-                cats = { (row.category or '').strip().upper(): row.cnt for row in cat_res.fetchall() }
+                    params.update(_fio_params(dd_name, 'dd_'))
                 
-                return {
-                    'total': total,
-                    'cat_A': cats.get('А', 0) + cats.get('A', 0),
-                    'cat_B': cats.get('В', 0) + cats.get('B', 0),
-                    'cat_C': cats.get('С', 0) + cats.get('C', 0),
-                }
+                # Один GROUP BY: total — сумма по категориям (как в get_role_totals)
+                cat_res = await session.execute(
+                    _SELECT_MOP_CATEGORY_COUNTS[(bool(rop_name), bool(dd_name))], params
+                )
+                return self._stats_put(cache_key, _category_totals(cat_res.fetchall()))
         except Exception as e:
             logger.error(f"Ошибка get_mop_category_stats({mop_name}, rop_name={rop_name}, dd_name={dd_name}): {e}")
             return {'total': 0, 'cat_A': 0, 'cat_B': 0, 'cat_C': 0}
@@ -1850,57 +2235,21 @@ class PostgreSQLManager:
         """Получает все объекты МОП-а с фильтрацией по категории, опционально фильтрует по РОП-у и ДД"""
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(mop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                where_clause = "(LOWER(mop) LIKE :surname_like AND LOWER(mop) LIKE :name_like)"
-                params = {"surname_like": surname_like, "name_like": name_like}
-                
-                # Добавляем фильтр по РОП-у, если указан
+                params = _fio_params(mop_name)
+                # Добавляем фильтры по РОП-у и ДД, если указаны
                 if rop_name:
-                    rop_fio_parts = [p for p in str(rop_name).strip().split() if p]
-                    rop_surname = rop_fio_parts[0] if rop_fio_parts else ''
-                    rop_name_part = rop_fio_parts[1] if len(rop_fio_parts) > 1 else ''
-                    rop_surname_like = f"%{rop_surname.lower()}%"
-                    rop_name_like = f"%{rop_name_part.lower()}%"
-                    where_clause += " AND (LOWER(rop) LIKE :rop_surname_like AND LOWER(rop) LIKE :rop_name_like)"
-                    params['rop_surname_like'] = rop_surname_like
-                    params['rop_name_like'] = rop_name_like
-                
-                # Добавляем фильтр по ДД, если указан
+                    params.update(_fio_params(rop_name, 'rop_'))
                 if dd_name:
-                    dd_fio_parts = [p for p in str(dd_name).strip().split() if p]
-                    dd_surname = dd_fio_parts[0] if dd_fio_parts else ''
-                    dd_name_part = dd_fio_parts[1] if len(dd_fio_parts) > 1 else ''
-                    dd_surname_like = f"%{dd_surname.lower()}%"
-                    dd_name_like = f"%{dd_name_part.lower()}%"
-                    where_clause += " AND (LOWER(dd) LIKE :dd_surname_like AND LOWER(dd) LIKE :dd_name_like)"
-                    params['dd_surname_like'] = dd_surname_like
-                    params['dd_name_like'] = dd_name_like
-                
+                    params.update(_fio_params(dd_name, 'dd_'))
                 if category:
-                    # Фильтруем по категории (А, В, С)
-                    cat_upper = category.upper()
-                    # Поддерживаем как латиницу, так и кириллицу
-                    cat_mapping = {'A': 'А', 'B': 'В', 'C': 'С'}
-                    cat_cyr = cat_mapping.get(cat_upper, cat_upper)
-                    where_clause += " AND (UPPER(category) = :cat OR UPPER(category) = :cat_cyr)"
-                    params['cat'] = cat_upper
-                    params['cat_cyr'] = cat_cyr
+                    # Фильтруем по категории (А, В, С), поддерживаем как латиницу, так и кириллицу
+                    params.update(_category_params(category))
                 
-                status_filter_sql = " AND (status IS NULL OR LOWER(status) != 'реализовано')"
-                result = await session.execute(
-                    text(f"SELECT * FROM properties WHERE {where_clause}{status_filter_sql} ORDER BY last_modified_at DESC"),
-                    params
+                result = await session.stream(
+                    _SELECT_MOP_CONTRACTS[(bool(rop_name), bool(dd_name), bool(category))], params
                 )
                 
-                contracts = []
-                for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
+                contracts = await _collect_legacy(result)
                 
                 return contracts
         except Exception as e:
@@ -1911,70 +2260,80 @@ class PostgreSQLManager:
         """Получает все объекты РОП-а с фильтрацией по категории"""
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(rop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                where_clause = "(LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like)"
-                params = {"surname_like": surname_like, "name_like": name_like}
-                
+                params = _fio_params(rop_name)
                 if category:
                     # Фильтруем по категории (А, В, С)
-                    cat_upper = category.upper()
-                    cat_mapping = {'A': 'А', 'B': 'В', 'C': 'С'}
-                    cat_cyr = cat_mapping.get(cat_upper, cat_upper)
-                    where_clause += " AND (UPPER(category) = :cat OR UPPER(category) = :cat_cyr)"
-                    params['cat'] = cat_upper
-                    params['cat_cyr'] = cat_cyr
+                    params.update(_category_params(category))
                 
-                result = await session.execute(
-                    text(f"SELECT * FROM properties WHERE {where_clause} ORDER BY last_modified_at DESC"),
-                    params
-                )
+                result = await session.stream(_SELECT_CONTRACTS[('РОП', bool(category), False)], params)
                 
-                contracts = []
-                for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
+                contracts = await _collect_legacy(result)
                 
                 return contracts
         except Exception as e:
             logger.error(f"Ошибка get_rop_contracts_by_category({rop_name}, {category}): {e}")
             return []
 
+    def _agent_counts_source(self) -> Tuple[str, str]:
+        """Источник для списков РОП/МОП с количеством объектов: mv_agent_counts, если последнее обновление
+        сводки прошло успешно, иначе properties. Сам запрос сводку не обновляет"""
+        return _AGENT_COUNTS_VIEW if self._agent_counts_ok else _AGENT_COUNTS_TABLE
+
+    async def refresh_agent_counts(self) -> bool:
+        """Обновляет mv_agent_counts (REFRESH ... CONCURRENTLY — чтение сводки при этом не блокируется).
+
+        Вызывается из фоновых задач; одновременно идёт не больше одного обновления.
+        """
+        async with self._agent_counts_lock:
+            try:
+                async with self.async_session() as session:
+                    # CONCURRENTLY требует уникальный индекс idx_mv_agent_counts
+                    await session.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {_AGENT_COUNTS_VIEW[0]}"))
+                    await session.commit()
+                self._agent_counts_ok = True
+            except Exception as e:
+                logger.warning(f"Не удалось обновить {_AGENT_COUNTS_VIEW[0]}, агрегируем properties: {e}")
+                self._agent_counts_ok = False
+            return self._agent_counts_ok
+
+    def _schedule_agent_counts_refresh(self) -> None:
+        """Ставит фоновое обновление mv_agent_counts после смены владельца контракта (без ожидания)"""
+        self._agent_counts_dirty = True
+        if self._agent_counts_task is not None and not self._agent_counts_task.done():
+            # Идущая задача увидит флаг и обновит сводку ещё раз
+            return
+        try:
+            self._agent_counts_task = asyncio.get_running_loop().create_task(self._refresh_agent_counts_while_dirty())
+        except RuntimeError:
+            # Нет работающего цикла событий — сводку обновит периодическая задача
+            pass
+
+    async def _refresh_agent_counts_while_dirty(self) -> None:
+        while self._agent_counts_dirty:
+            self._agent_counts_dirty = False
+            await self.refresh_agent_counts()
+
     async def search_rops_by_name(self, search_name: str, dd_name: Optional[str] = None) -> List[Dict[str, Any]]:
         """Ищет РОП-ов по имени, опционально фильтрует по ДД"""
         try:
             async with self.async_session() as session:
-                # Разбиваем поисковый запрос на части
-                search_parts = [p for p in str(search_name).strip().split() if p]
-                search_like = f"%{search_name.lower()}%"
+                search_like = f"%{search_name}%"  # ILIKE сам не различает регистр
                 
-                where_clause = "LOWER(rop) LIKE :search_like"
+                where_clause = "rop ILIKE :search_like"
                 params = {"search_like": search_like}
                 
                 # Добавляем фильтр по ДД, если указан
                 if dd_name:
-                    dd_fio_parts = [p for p in str(dd_name).strip().split() if p]
-                    dd_surname = dd_fio_parts[0] if dd_fio_parts else ''
-                    dd_name_part = dd_fio_parts[1] if len(dd_fio_parts) > 1 else ''
-                    dd_surname_like = f"%{dd_surname.lower()}%"
-                    dd_name_like = f"%{dd_name_part.lower()}%"
-                    where_clause += " AND (LOWER(dd) LIKE :dd_surname_like AND LOWER(dd) LIKE :dd_name_like)"
-                    params['dd_surname_like'] = dd_surname_like
-                    params['dd_name_like'] = dd_name_like
+                    where_clause += " AND " + _fio_where('dd', 'dd_')
+                    params.update(_fio_params(dd_name, 'dd_'))
                 
+                source, count_expr = self._agent_counts_source()
                 res = await session.execute(text(
-                    f"SELECT DISTINCT rop AS name, COUNT(*) AS cnt FROM properties "
-                    f"WHERE {where_clause} AND rop IS NOT NULL "
+                    f"SELECT rop AS name, {count_expr} AS cnt FROM {source} "
+                    f"WHERE {where_clause} AND rop <> '' "
                     f"GROUP BY rop ORDER BY cnt DESC"
                 ), params)
-                items = []
-                for row in res.fetchall():
-                    if row.name:
-                        items.append({'name': row.name, 'count': row.cnt})
+                items = [{'name': name, 'count': cnt} for name, cnt in res]
                 return items
         except Exception as e:
             logger.error(f"Ошибка search_rops_by_name({search_name}, dd_name={dd_name}): {e}")
@@ -1984,36 +2343,24 @@ class PostgreSQLManager:
         """Ищет МОП-ов по имени для конкретного владельца (РОП или ДД)"""
         try:
             async with self.async_session() as session:
-                search_like = f"%{search_name.lower()}%"
-                
-                owner_fio_parts = [p for p in str(owner_name).strip().split() if p]
-                owner_surname = owner_fio_parts[0] if owner_fio_parts else ''
-                owner_name_part = owner_fio_parts[1] if len(owner_fio_parts) > 1 else ''
-                owner_surname_like = f"%{owner_surname.lower()}%"
-                owner_name_like = f"%{owner_name_part.lower()}%"
+                search_like = f"%{search_name}%"  # ILIKE сам не различает регистр
                 
                 if owner_role == 'ДД':
-                    where_clause = "(LOWER(dd) LIKE :owner_surname_like AND LOWER(dd) LIKE :owner_name_like)"
+                    where_clause = _fio_where('dd', 'owner_')
                 elif owner_role == 'РОП':
-                    where_clause = "(LOWER(rop) LIKE :owner_surname_like AND LOWER(rop) LIKE :owner_name_like)"
+                    where_clause = _fio_where('rop', 'owner_')
                 else:
                     return []
                 
-                params = {
-                    "search_like": search_like,
-                    "owner_surname_like": owner_surname_like,
-                    "owner_name_like": owner_name_like
-                }
+                params = {"search_like": search_like, **_fio_params(owner_name, 'owner_')}
                 
+                source, count_expr = self._agent_counts_source()
                 res = await session.execute(text(
-                    f"SELECT DISTINCT mop AS name, COUNT(*) AS cnt FROM properties "
-                    f"WHERE {where_clause} AND LOWER(mop) LIKE :search_like AND mop IS NOT NULL "
+                    f"SELECT mop AS name, {count_expr} AS cnt FROM {source} "
+                    f"WHERE {where_clause} AND mop ILIKE :search_like AND mop <> '' "
                     f"GROUP BY mop ORDER BY cnt DESC"
                 ), params)
-                items = []
-                for row in res.fetchall():
-                    if row.name:
-                        items.append({'name': row.name, 'count': row.cnt})
+                items = [{'name': name, 'count': cnt} for name, cnt in res]
                 return items
         except Exception as e:
             logger.error(f"Ошибка search_mops_by_name({search_name}, {owner_name}, {owner_role}): {e}")
@@ -2023,35 +2370,21 @@ class PostgreSQLManager:
         """Получает список МОП-ов для конкретного РОП-а, опционально фильтрует по ДД"""
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(rop_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                where_clause = "(LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like)"
-                params = {"surname_like": surname_like, "name_like": name_like}
+                where_clause = _WHERE_AGENT_BY_ROLE['РОП']
+                params = _fio_params(rop_name)
                 
                 # Добавляем фильтр по ДД, если указан
                 if dd_name:
-                    dd_fio_parts = [p for p in str(dd_name).strip().split() if p]
-                    dd_surname = dd_fio_parts[0] if dd_fio_parts else ''
-                    dd_name_part = dd_fio_parts[1] if len(dd_fio_parts) > 1 else ''
-                    dd_surname_like = f"%{dd_surname.lower()}%"
-                    dd_name_like = f"%{dd_name_part.lower()}%"
-                    where_clause += " AND (LOWER(dd) LIKE :dd_surname_like AND LOWER(dd) LIKE :dd_name_like)"
-                    params['dd_surname_like'] = dd_surname_like
-                    params['dd_name_like'] = dd_name_like
+                    where_clause += " AND " + _fio_where('dd', 'dd_')
+                    params.update(_fio_params(dd_name, 'dd_'))
                 
+                source, count_expr = self._agent_counts_source()
                 res = await session.execute(text(
-                    f"SELECT mop AS name, COUNT(*) AS cnt FROM properties "
-                    f"WHERE {where_clause} "
-                    f"GROUP BY mop ORDER BY cnt DESC NULLS LAST"
+                    f"SELECT mop AS name, {count_expr} AS cnt FROM {source} "
+                    f"WHERE {where_clause} AND mop <> '' "
+                    f"GROUP BY mop ORDER BY cnt DESC"
                 ), params)
-                items = []
-                for row in res.fetchall():
-                    if row.name:  # Игнорируем NULL значения
-                        items.append({'name': row.name, 'count': row.cnt})
+                items = [{'name': name, 'count': cnt} for name, cnt in res]
                 return items
         except Exception as e:
             logger.error(f"Ошибка get_mops_by_rop({rop_name}, dd_name={dd_name}): {e}")
@@ -2061,45 +2394,16 @@ class PostgreSQLManager:
         """Получает все объекты агента с фильтрацией по категории для любой роли"""
         try:
             async with self.async_session() as session:
-                fio_parts = [p for p in str(agent_name).strip().split() if p]
-                surname = fio_parts[0] if fio_parts else ''
-                name = fio_parts[1] if len(fio_parts) > 1 else ''
-                surname_like = f"%{surname.lower()}%"
-                name_like = f"%{name.lower()}%"
-                
-                if role == 'МОП':
-                    where_clause = "(LOWER(mop) LIKE :surname_like AND LOWER(mop) LIKE :name_like)"
-                elif role == 'РОП':
-                    where_clause = "(LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like)"
-                elif role == 'ДД':
-                    where_clause = "(LOWER(dd) LIKE :surname_like AND LOWER(dd) LIKE :name_like)"
-                else:
-                    where_clause = (
-                        "((LOWER(mop) LIKE :surname_like AND LOWER(mop) LIKE :name_like) "
-                        "OR (LOWER(rop) LIKE :surname_like AND LOWER(rop) LIKE :name_like) "
-                        "OR (LOWER(dd)  LIKE :surname_like AND LOWER(dd)  LIKE :name_like))"
-                    )
-                
-                params = {"surname_like": surname_like, "name_like": name_like}
-                
+                params = _fio_params(agent_name)
                 if category:
                     # Фильтруем по категории (А, В, С)
-                    cat_upper = category.upper()
-                    cat_mapping = {'A': 'А', 'B': 'В', 'C': 'С'}
-                    cat_cyr = cat_mapping.get(cat_upper, cat_upper)
-                    where_clause += " AND (UPPER(category) = :cat OR UPPER(category) = :cat_cyr)"
-                    params['cat'] = cat_upper
-                    params['cat_cyr'] = cat_cyr
+                    params.update(_category_params(category))
                 
-                result = await session.execute(
-                    text(f"SELECT * FROM properties WHERE {where_clause} ORDER BY last_modified_at DESC"),
-                    params
-                )
+                # Неизвестная роль — объекты, где агент указан в любом из полей
+                owner = role if role in _WHERE_AGENT_BY_ROLE else None
+                result = await session.stream(_SELECT_CONTRACTS[(owner, bool(category), False)], params)
                 
-                contracts = []
-                for row in result.fetchall():
-                    contract_dict = dict(row._mapping)
-                    contracts.append(self._convert_to_legacy_format(contract_dict))
+                contracts = await _collect_legacy(result)
                 
                 return contracts
         except Exception as e:
@@ -2141,31 +2445,32 @@ class PostgreSQLManager:
     async def set_category_c_for_missing(self) -> Dict[str, int]:
         """Заполняет категорией 'С' все записи, где category пустой или NULL.
 
+        Обновляет порциями по DB_BACKFILL_CHUNK_SIZE строк с коммитом после каждой, чтобы не держать
+        блокировки строк и не копить мёртвые версии в одной длинной транзакции. Обновлённые строки
+        выпадают из _MISSING_CATEGORY_WHERE, поэтому следующая порция берётся тем же запросом.
         Возвращает статистику {updated, skipped, errors}.
         """
+        updated = 0
         try:
             async with self.async_session() as session:
-                res_count = await session.execute(text(
-                    "SELECT COUNT(*) FROM properties WHERE category IS NULL OR TRIM(category) = ''"
-                ))
-                to_update = res_count.scalar() or 0
-                if to_update == 0:
-                    return {"updated": 0, "skipped": 0, "errors": 0}
-                await session.execute(text(
-                    """
-                    UPDATE properties
-                    SET category = 'С',
-                        last_modified_by = 'BOT',
-                        last_modified_at = NOW()
-                    WHERE category IS NULL OR TRIM(category) = ''
-                    """
-                ))
-                await session.commit()
-                logger.info(f"Категория 'С' проставлена для {to_update} записей с пустым значением")
-                return {"updated": to_update, "skipped": 0, "errors": 0}
+                while True:
+                    result = await session.execute(
+                        _UPDATE_MISSING_CATEGORY_CHUNK, {"chunk": DB_BACKFILL_CHUNK_SIZE}
+                    )
+                    chunk_updated = result.rowcount or 0
+                    await session.commit()
+                    updated += chunk_updated
+                    if chunk_updated < DB_BACKFILL_CHUNK_SIZE:
+                        break
+            if updated:
+                self._stats_cache.clear()
+                logger.info(f"Категория 'С' проставлена для {updated} записей с пустым значением")
+            return {"updated": updated, "skipped": 0, "errors": 0}
         except Exception as e:
-            logger.error(f"Ошибка массового заполнения категории 'С': {e}")
-            return {"updated": 0, "skipped": 0, "errors": 1}
+            if updated:
+                self._stats_cache.clear()
+            logger.error(f"Ошибка массового заполнения категории 'С' (успели обновить {updated}): {e}")
+            return {"updated": updated, "skipped": 0, "errors": 1}
 
     async def get_parsed_properties_count(self) -> int:
         """Получает общее количество объектов в таблице parsed_properties"""
@@ -2179,6 +2484,16 @@ class PostgreSQLManager:
             logger.error(f"Ошибка получения количества объектов в parsed_properties: {e}")
             return 0
 
+    async def has_parsed_properties(self) -> bool:
+        """Есть ли в parsed_properties хоть одна запись (EXISTS останавливается на первой строке, в отличие от COUNT(*))"""
+        try:
+            async with self.async_session() as session:
+                result = await session.execute(text("SELECT EXISTS (SELECT 1 FROM parsed_properties)"))
+                return bool(result.scalar())
+        except Exception as e:
+            logger.error(f"Ошибка проверки наличия объектов в parsed_properties: {e}")
+            return True
+
     async def get_new_objects_count_by_phone(self) -> int:
         """Получает количество новых объектов(где stats_agent_given IS NULL и krisha_id IS NOT NULL)"""
         try:
@@ -2225,67 +2540,35 @@ class PostgreSQLManager:
             return 0
 
     async def get_latest_parsed_properties(self, page: int = 1, page_size: int = 10) -> Tuple[List[Dict], int]:
-        """Получает последние объекты из parsed_properties, отсортированные по krisha_date (только с krisha_id)"""
+        """Получает последние объекты из parsed_properties, отсортированные по krisha_date (только с krisha_id).
+
+        Страница и общее число не взятых объектов читаются одним запросом (count(*) OVER ());
+        отдельный COUNT выполняется только для пустой страницы за пределами выборки.
+        """
         try:
             offset = (page - 1) * page_size
             async with self.async_session() as session:
-                # Подсчет общего количества (только не взятые объекты)
-                count_result = await session.execute(text("""
-                    SELECT COUNT(*) FROM parsed_properties
-                    WHERE krisha_id IS NOT NULL AND krisha_id != ''
-                    AND stats_agent_given IS NULL
-                """))
-                total_count = count_result.scalar() or 0
-
-                # Получение страницы (только не взятые объекты)
-                result = await session.execute(text("""
-                    SELECT vitrina_id, rbd_id, krisha_id, krisha_date, object_type, address,
-                           complex, builder, flat_type, property_class, condition, sell_price,
-                           sell_price_per_m2, house_num, floor_num, floor_count, room_count,
-                           phones, description, ceiling_height, area, year_built, wall_type,
-                           stats_agent_given, stats_time_given, stats_object_status, stats_recall_time, stats_description
+                # Получение страницы (только не взятые объекты): предикат и ORDER BY совпадают с idx_parsed_properties_free
+                rows = (await session.execute(text(f"""
+                    SELECT {", ".join(_PARSED_LIST_COLUMNS)}, count(*) OVER () AS _total
                     FROM parsed_properties
                     WHERE krisha_id IS NOT NULL AND krisha_id != ''
                     AND stats_agent_given IS NULL
                     ORDER BY krisha_date DESC NULLS LAST, vitrina_id DESC
                     LIMIT :limit OFFSET :offset
-                """), {"limit": page_size, "offset": offset})
-                
-                objects = []
-                for row in result.fetchall():
-                    obj = {
-                        "vitrina_id": row.vitrina_id,
-                        "rbd_id": row.rbd_id,
-                        "krisha_id": row.krisha_id,
-                        "krisha_date": row.krisha_date,
-                        "object_type": row.object_type,
-                        "address": row.address,
-                        "complex": row.complex,
-                        "builder": row.builder,
-                        "flat_type": row.flat_type,
-                        "property_class": row.property_class,
-                        "condition": row.condition,
-                        "sell_price": row.sell_price,
-                        "sell_price_per_m2": row.sell_price_per_m2,
-                        "house_num": row.house_num,
-                        "floor_num": row.floor_num,
-                        "floor_count": row.floor_count,
-                        "room_count": row.room_count,
-                        "phones": row.phones,
-                        "description": row.description,
-                        "ceiling_height": row.ceiling_height,
-                        "area": row.area,
-                        "year_built": row.year_built,
-                        "wall_type": row.wall_type,
-                        "stats_agent_given": row.stats_agent_given,
-                        "stats_time_given": row.stats_time_given,
-                        "stats_object_status": row.stats_object_status,
-                        "stats_recall_time": row.stats_recall_time,
-                        "stats_description": row.stats_description,
-                    }
-                    objects.append(obj)
-                
-                return objects, total_count
+                """), {"limit": page_size, "offset": offset})).fetchall()
+                if rows:
+                    # Последняя колонка — _total, остальные — _PARSED_LIST_COLUMNS
+                    return [dict(zip(_PARSED_LIST_COLUMNS, row)) for row in rows], rows[0][-1]
+                if offset == 0:
+                    return [], 0
+
+                count_result = await session.execute(text("""
+                    SELECT COUNT(*) FROM parsed_properties
+                    WHERE krisha_id IS NOT NULL AND krisha_id != ''
+                    AND stats_agent_given IS NULL
+                """))
+                return [], count_result.scalar() or 0
         except Exception as e:
             logger.error(f"Ошибка получения последних объектов: {e}", exc_info=True)
             return [], 0
@@ -2294,52 +2577,13 @@ class PostgreSQLManager:
         """Получает объект по vitrina_id"""
         try:
             async with self.async_session() as session:
-                result = await session.execute(text("""
-                    SELECT vitrina_id, rbd_id, krisha_id, krisha_date, object_type, address,
-                           complex, builder, flat_type, property_class, condition, sell_price,
-                           sell_price_per_m2, house_num, floor_num, floor_count, room_count,
-                           phones, description, ceiling_height, area, year_built, wall_type,
-                           stats_agent_given, stats_time_given, stats_object_status, stats_recall_time, 
-                           stats_description, stats_object_category
-                    FROM parsed_properties
-                    WHERE vitrina_id = :vitrina_id
-                """), {"vitrina_id": vitrina_id})
+                result = await session.execute(_SELECT_PARSED_BY_VITRINA_ID, {"vitrina_id": vitrina_id})
                 
                 row = result.fetchone()
                 if not row:
                     return None
                 
-                return {
-                    "vitrina_id": row.vitrina_id,
-                    "rbd_id": row.rbd_id,
-                    "krisha_id": row.krisha_id,
-                    "krisha_date": row.krisha_date,
-                    "object_type": row.object_type,
-                    "address": row.address,
-                    "complex": row.complex,
-                    "builder": row.builder,
-                    "flat_type": row.flat_type,
-                    "property_class": row.property_class,
-                    "condition": row.condition,
-                    "sell_price": row.sell_price,
-                    "sell_price_per_m2": row.sell_price_per_m2,
-                    "house_num": row.house_num,
-                    "floor_num": row.floor_num,
-                    "floor_count": row.floor_count,
-                    "room_count": row.room_count,
-                    "phones": row.phones,
-                    "description": row.description,
-                    "ceiling_height": row.ceiling_height,
-                    "area": row.area,
-                    "year_built": row.year_built,
-                    "wall_type": row.wall_type,
-                    "stats_agent_given": row.stats_agent_given,
-                    "stats_time_given": row.stats_time_given,
-                    "stats_object_status": row.stats_object_status,
-                    "stats_recall_time": row.stats_recall_time,
-                    "stats_description": row.stats_description,
-                    "stats_object_category": row.stats_object_category,
-                }
+                return dict(zip(_PARSED_DETAIL_COLUMNS, row))
         except Exception as e:
             logger.error(f"Ошибка получения объекта по vitrina_id {vitrina_id}: {e}", exc_info=True)
             return None
@@ -2348,24 +2592,20 @@ class PostgreSQLManager:
         """Берет объект: устанавливает stats_agent_given, stats_time_given, stats_object_status"""
         try:
             async with self.async_session() as session:
-                # Проверяем, не взят ли уже объект
-                check_result = await session.execute(text("""
-                    SELECT stats_agent_given FROM parsed_properties
-                    WHERE vitrina_id = :vitrina_id
-                """), {"vitrina_id": vitrina_id})
-                row = check_result.fetchone()
-                if row and row.stats_agent_given:
-                    return False  # Уже взят
-                
-                # Обновляем объект
-                await session.execute(text("""
+                # Условный UPDATE ... RETURNING: проверка «не взят ли уже» и взятие — один атомарный запрос,
+                # два агента не могут взять один объект одновременно
+                result = await session.execute(text("""
                     UPDATE parsed_properties
                     SET stats_agent_given = :phone,
                         stats_time_given = NOW() AT TIME ZONE 'Asia/Almaty',
                         stats_object_status = 'Не позвонили',
                         updated_at = NOW()
                     WHERE vitrina_id = :vitrina_id
+                      AND (stats_agent_given IS NULL OR stats_agent_given = '')
+                    RETURNING vitrina_id
                 """), {"phone": agent_phone, "vitrina_id": vitrina_id})
+                if result.fetchone() is None:
+                    return False  # Уже взят (или объекта нет)
                 await session.commit()
                 return True
         except Exception as e:
@@ -2398,101 +2638,34 @@ class PostgreSQLManager:
             target_c = 4
             
             async with self.async_session() as session:
-                # Функция для получения объектов категории с фильтром
-                async def get_objects_with_filter(category: str, limit_count: int, exclude_ids: List[int], use_filter: bool) -> List[int]:
-                    """Получает объекты категории с опциональным фильтром по классам"""
-                    base_where = """
-                        WHERE krisha_id IS NOT NULL AND krisha_id != ''
-                          AND stats_agent_given IS NULL
-                          AND stats_object_category = :category
-                    """
-                    
-                    # Если категория C, также включаем NULL
-                    if category == 'C':
-                        base_where = """
-                            WHERE krisha_id IS NOT NULL AND krisha_id != ''
-                              AND stats_agent_given IS NULL
-                              AND (stats_object_category = 'C' OR stats_object_category IS NULL)
-                        """
-                    
-                    # Добавляем фильтр по классам, если задан
-                    filter_clause = ""
-                    params = {"category": category, "limit": limit_count}
-                    
-                    if use_filter and property_classes_filter:
-                        filter_clause = " AND property_class = ANY(:classes)"
-                        params["classes"] = property_classes_filter
-                    
-                    # Исключаем уже выбранные объекты
-                    exclude_clause = ""
-                    if exclude_ids:
-                        exclude_clause = " AND vitrina_id != ALL(:exclude_ids)"
-                        params["exclude_ids"] = exclude_ids
-                    
-                    query = f"""
-                        SELECT vitrina_id
-                        FROM parsed_properties
-                        {base_where}
-                        {filter_clause}
-                        {exclude_clause}
-                        ORDER BY krisha_date DESC NULLS LAST, vitrina_id DESC
-                        LIMIT :limit
-                        FOR UPDATE SKIP LOCKED
-                    """
-                    
-                    result = await session.execute(text(query), params)
-                    return [row.vitrina_id for row in result.fetchall()]
-                
-                # Получаем объекты категории A
-                ids_a_filtered = []
-                if property_classes_filter:
-                    ids_a_filtered = await get_objects_with_filter('A', target_a, [], True)
-                
-                # Добираем A без фильтра, если не хватило
-                needed_a = target_a - len(ids_a_filtered)
-                ids_a_additional = []
-                if needed_a > 0:
-                    ids_a_additional = await get_objects_with_filter('A', needed_a, ids_a_filtered, False)
+                # Кандидаты всех трёх категорий одним запросом: A — не больше target_a, B — не больше target_a + target_b
+                # (недобор A переходит в B), C — остаток до limit. Сколько взять из B и C, решается ниже по факту
+                params: Dict[str, Any] = {
+                    "limit_a": target_a,
+                    "limit_b": max(0, min(limit, target_a + target_b)),
+                    "limit_c": max(0, limit),
+                }
+                use_filter = bool(property_classes_filter)
+                if use_filter:
+                    params["classes"] = property_classes_filter
+                result = await session.execute(_SELECT_FREE_PARSED_BY_CATEGORY[use_filter], params)
+                candidates: Dict[str, List[int]] = {'A': [], 'B': [], 'C': []}
+                for category, vitrina_id in result:
+                    candidates[category].append(vitrina_id)
                 
-                ids_a = ids_a_filtered + ids_a_additional
+                # Объекты категории A
+                ids_a = candidates['A'][:target_a]
                 
                 # Вычисляем сколько нужно B (увеличиваем, если не хватило A, но не больше общего лимита)
                 missing_a = target_a - len(ids_a)
                 needed_b = min(limit - len(ids_a), target_b + missing_a)
                 needed_b = max(0, needed_b)
-                
-                # Получаем объекты категории B
-                ids_b_filtered = []
-                if property_classes_filter:
-                    ids_b_filtered = await get_objects_with_filter('B', needed_b, ids_a, True)
-                
-                # Добираем B без фильтра, если не хватило
-                needed_b_additional = needed_b - len(ids_b_filtered)
-                ids_b_additional = []
-                if needed_b_additional > 0:
-                    exclude_b = ids_a + ids_b_filtered
-                    ids_b_additional = await get_objects_with_filter('B', needed_b_additional, exclude_b, False)
-                
-                ids_b = ids_b_filtered + ids_b_additional
+                ids_b = candidates['B'][:needed_b]
                 
                 # Вычисляем сколько нужно C (остальное до общего лимита)
                 needed_c = limit - len(ids_a) - len(ids_b)
                 needed_c = max(0, needed_c)
-                
-                # Получаем объекты категории C
-                ids_c_filtered = []
-                if property_classes_filter:
-                    exclude_c = ids_a + ids_b
-                    ids_c_filtered = await get_objects_with_filter('C', needed_c, exclude_c, True)
-                
-                # Добираем C без фильтра, если не хватило
-                needed_c_additional = needed_c - len(ids_c_filtered)
-                ids_c_additional = []
-                if needed_c_additional > 0:
-                    exclude_c_all = ids_a + ids_b + ids_c_filtered
-                    ids_c_additional = await get_objects_with_filter('C', needed_c_additional, exclude_c_all, False)
-                
-                ids_c = ids_c_filtered + ids_c_additional
+                ids_c = candidates['C'][:needed_c]
                 
                 # Объединяем все ID
                 all_ids = ids_a + ids_b + ids_c
@@ -2500,16 +2673,15 @@ class PostgreSQLManager:
                 if not all_ids:
                     return 0, [], {}
                 
-                # Обновляем объекты
-                for vitrina_id in all_ids:
-                    await session.execute(text("""
-                        UPDATE parsed_properties
-                        SET stats_agent_given = :phone,
-                            stats_time_given = NOW() AT TIME ZONE 'Asia/Almaty',
-                            stats_object_status = 'Не позвонили',
-                            updated_at = NOW()
-                        WHERE vitrina_id = :vitrina_id
-                    """), {"phone": agent_phone, "vitrina_id": vitrina_id})
+                # Обновляем все выбранные объекты одним запросом (строки уже заблокированы FOR UPDATE)
+                await session.execute(text("""
+                    UPDATE parsed_properties
+                    SET stats_agent_given = :phone,
+                        stats_time_given = NOW() AT TIME ZONE 'Asia/Almaty',
+                        stats_object_status = 'Не позвонили',
+                        updated_at = NOW()
+                    WHERE vitrina_id = ANY(:ids)
+                """), {"phone": agent_phone, "ids": all_ids})
                 
                 await session.commit()
                 
@@ -2777,9 +2949,16 @@ class PostgreSQLManager:
         agent_phone: str, 
         page: int = 1, 
         page_size: int = 10,
-        status_filter: Optional[str] = None
+        status_filter: Optional[str] = None,
+        cursor: Optional[Tuple[Optional[datetime], int]] = None,
     ) -> Tuple[List[Dict], int]:
-        """Получает объекты агента по номеру телефона с опциональной фильтрацией по статусу"""
+        """Получает объекты агента по номеру телефона с опциональной фильтрацией по статусу.
+
+        Страница и общее число читаются одним запросом, отдельный COUNT — только для пустой страницы
+        за пределами выборки. cursor=(stats_time_given, vitrina_id) последнего объекта предыдущей страницы
+        включает keyset-пагинацию по idx_parsed_properties_my_objects: page игнорируется. total в обоих
+        случаях — полное число объектов агента под фильтром, без учёта курсора.
+        """
         try:
             offset = (page - 1) * page_size
             async with self.async_session() as session:
@@ -2800,61 +2979,46 @@ class PostgreSQLManager:
                         where_clause += " AND stats_object_status = :status"
                         params["status"] = status_filter
                 
-                # Подсчет общего количества
-                count_result = await session.execute(
-                    text(f"SELECT COUNT(*) FROM parsed_properties {where_clause}"),
-                    params
-                )
-                total_count = count_result.scalar() or 0
+                page_where = where_clause
+                # Без курсора общее число — оконный count по той же выборке; с курсором — подзапрос
+                # по where_clause без условия курсора (выполняется один раз на запрос)
+                total_sql = "count(*) OVER ()"
+                if cursor is not None:
+                    total_sql = f"(SELECT COUNT(*) FROM parsed_properties {where_clause})"
+                    after_time, after_id = cursor
+                    # Порядок stats_time_given DESC NULLS LAST: объекты без времени идут после всех остальных
+                    if after_time is None:
+                        page_where += " AND stats_time_given IS NULL AND vitrina_id < :after_id"
+                    else:
+                        page_where += (
+                            " AND (stats_time_given < :after_time"
+                            " OR (stats_time_given = :after_time AND vitrina_id < :after_id)"
+                            " OR stats_time_given IS NULL)"
+                        )
+                        params["after_time"] = after_time
+                    params["after_id"] = after_id
+                    offset = 0
 
-                # Получение страницы
+                # Получение страницы вместе с общим количеством
                 result = await session.execute(text(f"""
-                    SELECT vitrina_id, rbd_id, krisha_id, krisha_date, object_type, address,
-                           complex, builder, flat_type, property_class, condition, sell_price,
-                           sell_price_per_m2, house_num, floor_num, floor_count, room_count,
-                           phones, description, ceiling_height, area, year_built, wall_type,
-                           stats_agent_given, stats_time_given, stats_object_status, stats_recall_time, stats_description
+                    SELECT {", ".join(_PARSED_LIST_COLUMNS)}, {total_sql} AS _total
                     FROM parsed_properties
-                    {where_clause}
+                    {page_where}
                     ORDER BY stats_time_given DESC NULLS LAST, vitrina_id DESC
                     LIMIT :limit OFFSET :offset
                 """), {**params, "limit": page_size, "offset": offset})
-                
-                objects = []
-                for row in result.fetchall():
-                    obj = {
-                        "vitrina_id": row.vitrina_id,
-                        "rbd_id": row.rbd_id,
-                        "krisha_id": row.krisha_id,
-                        "krisha_date": row.krisha_date,
-                        "object_type": row.object_type,
-                        "address": row.address,
-                        "complex": row.complex,
-                        "builder": row.builder,
-                        "flat_type": row.flat_type,
-                        "property_class": row.property_class,
-                        "condition": row.condition,
-                        "sell_price": row.sell_price,
-                        "sell_price_per_m2": row.sell_price_per_m2,
-                        "house_num": row.house_num,
-                        "floor_num": row.floor_num,
-                        "floor_count": row.floor_count,
-                        "room_count": row.room_count,
-                        "phones": row.phones,
-                        "description": row.description,
-                        "ceiling_height": row.ceiling_height,
-                        "area": row.area,
-                        "year_built": row.year_built,
-                        "wall_type": row.wall_type,
-                        "stats_agent_given": row.stats_agent_given,
-                        "stats_time_given": row.stats_time_given,
-                        "stats_object_status": row.stats_object_status,
-                        "stats_recall_time": row.stats_recall_time,
-                        "stats_description": row.stats_description,
-                    }
-                    objects.append(obj)
-                
-                return objects, total_count
+                rows = result.fetchall()
+                if rows:
+                    # Последняя колонка — _total
+                    return [dict(zip(_PARSED_LIST_COLUMNS, row)) for row in rows], rows[0][-1]
+                if offset == 0 and cursor is None:
+                    return [], 0
+
+                count_result = await session.execute(
+                    text(f"SELECT COUNT(*) FROM parsed_properties {where_clause}"),
+                    params
+                )
+                return [], count_result.scalar() or 0
         except Exception as e:
             logger.error(f"Ошибка получения объектов агента: {e}", exc_info=True)
             return [], 0
@@ -2909,7 +3073,7 @@ class PostgreSQLManager:
                 phones_raw = (row[1] or "").strip()
                 if not name or not phones_raw:
                     continue
-                digits = re.sub(r"\D", "", phones_raw)
+                digits = _NON_DIGIT_RE.sub("", phones_raw)
                 if not digits:
                     continue
                 if len(digits) >= 10:
@@ -3041,7 +3205,7 @@ class PostgreSQLManager:
                     name = phone_to_name_db.get(phone, "")
                     # 2-й приоритет: лист телефонов (по последним 10 цифрам)
                     if not name and phone:
-                        digits = re.sub(r"\D", "", phone)
+                        digits = _NON_DIGIT_RE.sub("", phone)
                         if len(digits) >= 10:
                             tail10 = digits[-10:]
                             name = phone_to_name_sheet.get(tail10, "")
@@ -3190,211 +3354,144 @@ class PostgreSQLManager:
             logger.error(f"Ошибка выгрузки статистики по холодным звонкам в Google Sheets: {e}", exc_info=True)
             return False
 
+    async def _load_third_sheet_rows(self, max_age: Optional[int] = None) -> List[List[str]]:
+        """Возвращает строки третьего листа Google Sheets, кешируя их на max_age секунд (по умолчанию TTL third_map).
+
+        Загрузка идёт в отдельном потоке и под блокировкой: одновременные вызовы ждут одну выгрузку листа.
+        Наличие credentials.json и SHEET_ID/THIRD_SHEET_GID проверяет вызывающий код.
+        """
+        max_age = self._third_map_cache_ttl if max_age is None else max_age
+        async with self._third_rows_lock:
+            if (self._third_rows_cache is not None and self._third_rows_time is not None and
+                    time.monotonic() - self._third_rows_time < max_age):
+                return self._third_rows_cache
+
+            def fetch() -> List[List[str]]:
+                credentials = Credentials.from_service_account_file(
+                    'credentials.json',
+                    scopes=['https://www.googleapis.com/auth/spreadsheets']
+                )
+                gc = gspread.authorize(credentials)
+                spreadsheet = gc.open_by_key(SHEET_ID)
+                third_ws = spreadsheet.get_worksheet_by_id(int(THIRD_SHEET_GID))
+                return third_ws.get_all_values()
+
+            rows = await asyncio.to_thread(fetch)
+            self._third_rows_cache = rows
+            self._third_rows_time = time.monotonic()
+            return rows
+
     async def _load_third_map(self) -> Dict[str, Dict[str, Optional[float]]]:
         """Загружает third_map из Google Sheets с кешированием"""
         from datetime import datetime, timedelta
         
-        # Проверяем кеш
+        # Проверяем кеш (без блокировки — быстрый путь)
         if (self._third_map_cache is not None and 
             self._third_map_cache_time is not None and
             (datetime.now() - self._third_map_cache_time).total_seconds() < self._third_map_cache_ttl):
             return self._third_map_cache
         
-        # Загружаем из Google Sheets
-        credentials_file = 'credentials.json'
-        if not os.path.exists(credentials_file):
-            logger.warning(f"Файл {credentials_file} не найден, категоризация будет упрощенной")
-            return {}
-        
-        if not SHEET_ID or not THIRD_SHEET_GID:
-            logger.warning("SHEET_ID или THIRD_SHEET_GID не установлены, категоризация будет упрощенной")
-            return {}
-        
-        try:
-            credentials = Credentials.from_service_account_file(
-                credentials_file,
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-            gc = gspread.authorize(credentials)
-            spreadsheet = gc.open_by_key(SHEET_ID)
-            third_ws = spreadsheet.get_worksheet_by_id(int(THIRD_SHEET_GID))
+        async with self._third_map_lock:
+            # Пока ждали блокировку, third_map мог собрать параллельный вызов
+            if (self._third_map_cache is not None and
+                self._third_map_cache_time is not None and
+                (datetime.now() - self._third_map_cache_time).total_seconds() < self._third_map_cache_ttl):
+                return self._third_map_cache
             
-            rows = third_ws.get_all_values()
-            if not rows:
+            # Загружаем из Google Sheets
+            credentials_file = 'credentials.json'
+            if not os.path.exists(credentials_file):
+                logger.warning(f"Файл {credentials_file} не найден, категоризация будет упрощенной")
                 return {}
             
-            # Поиск строки заголовков
-            header_row_idx = 0
-            for i, r in enumerate(rows):
-                line = ' '.join(r).lower()
-                if ('жк' in line) or ('крыша' in line) or ('витрина' in line) or ('общий балл' in line):
-                    header_row_idx = i
-                    break
+            if not SHEET_ID or not THIRD_SHEET_GID:
+                logger.warning("SHEET_ID или THIRD_SHEET_GID не установлены, категоризация будет упрощенной")
+                return {}
             
-            def to_float_safe(v):
-                try:
-                    s = str(v).replace(' ', '').replace('\u00A0', '')
-                    s = s.replace(',', '.')
-                    if s.strip() == '':
-                        return None
-                    return float(s)
-                except Exception:
-                    return None
+            try:
+                rows = await self._load_third_sheet_rows()
+                if not rows:
+                    return {}
             
-            def norm_complex(x: str) -> str:
-                import re
-                s = (x or '').lower()
-                for token in ['жк', 'жилой комплекс', 'residence', 'residential', 'complex']:
-                    s = s.replace(token, ' ')
-                for ch in ['"', '\'', '«', '»', '.', ',', ';', ':', '(', ')', '[', ']', '{', '}', '/', '\\', '-', '–', '_']:
-                    s = s.replace(ch, ' ')
-                s = re.sub(r"\bблок\s+[a-zа-я0-9]+\b", " ", s)
-                s = re.sub(r"\bочередь\b", " ", s)
-                s = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", s)
-                s = ' '.join(s.split())
-                synonyms = {
-                    'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
-                    'qalashyq': 'калашык', 'qalashy': 'калашык', 'qurylys': 'курылыс', 'exclusive': 'эксклюзив',
-                    'bukhar': 'бухар', 'jyray': 'жырау', 'dauletti': 'даулетти', 'qalashyk': 'калашык',
-                    'city': 'city', 'sat': 'sat'
-                }
-                tokens = s.split()
-                norm_tokens = []
-                for t in tokens:
-                    t_clean = synonyms.get(t, t)
-                    norm_tokens.append(t_clean)
-                return ' '.join(norm_tokens)
+                # Поиск строки заголовков
+                header_row_idx = 0
+                for i, r in enumerate(rows):
+                    line = ' '.join(r).lower()
+                    if ('жк' in line) or ('крыша' in line) or ('витрина' in line) or ('общий балл' in line):
+                        header_row_idx = i
+                        break
             
-            complex_to_params: Dict[str, Dict[str, Optional[float]]] = {}
-            for i, r in enumerate(rows):
-                if i <= header_row_idx:
-                    continue
-                complex_name = (r[0] if len(r) > 0 else '').strip()
-                if not complex_name:
-                    continue
-                roof_raw = r[1] if len(r) > 1 else ''
-                score_raw = r[2] if len(r) > 2 else ''
-                window_raw = r[3] if len(r) > 3 else ''
-                complex_to_params[norm_complex(complex_name)] = {
-                    'roof': to_float_safe(roof_raw),
-                    'score': to_float_safe(score_raw),
-                    'window': to_float_safe(window_raw),
-                }
+                complex_to_params: Dict[str, Dict[str, Optional[float]]] = {}
+                for i, r in enumerate(rows):
+                    if i <= header_row_idx:
+                        continue
+                    complex_name = (r[0] if len(r) > 0 else '').strip()
+                    if not complex_name:
+                        continue
+                    roof_raw = r[1] if len(r) > 1 else ''
+                    score_raw = r[2] if len(r) > 2 else ''
+                    window_raw = r[3] if len(r) > 3 else ''
+                    complex_to_params[_norm_complex(complex_name)] = {
+                        'roof': _to_float_safe(roof_raw),
+                        'score': _to_float_safe(score_raw),
+                        'window': _to_float_safe(window_raw),
+                    }
             
-            # Сохраняем в кеш
-            self._third_map_cache = complex_to_params
-            self._third_map_cache_time = datetime.now()
-            logger.info(f"Загружен third_map: {len(complex_to_params)} записей")
-            return complex_to_params
+                # Сохраняем в кеш
+                self._third_map_cache = complex_to_params
+                self._third_map_cache_time = datetime.now()
+                self._third_map_matches = {}
+                logger.info(f"Загружен third_map: {len(complex_to_params)} записей")
+                return complex_to_params
             
-        except Exception as e:
-            logger.error(f"Ошибка загрузки third_map: {e}", exc_info=True)
-            return {}
-    
+            except Exception as e:
+                logger.error(f"Ошибка загрузки third_map: {e}", exc_info=True)
+                return {}
+
     def _find_complex_in_map(self, complex_name: str, third_map: Dict[str, Dict[str, Optional[float]]]) -> Optional[Dict[str, Optional[float]]]:
-        """Находит параметры для ЖК в third_map с нормализацией и поиском по вариантам"""
+        """Находит параметры для ЖК в third_map с нормализацией и поиском по вариантам.
+
+        Нечёткий поиск идёт через _TokenIndex: Жаккар считается только для ключей с общими токенами,
+        а не для всего third_map; индекс строится один раз на загруженный third_map.
+        """
         if not complex_name or not third_map:
             return None
         
-        def norm_complex(x: str) -> str:
-            import re
-            s = (x or '').lower()
-            for token in ['жк', 'жилой комплекс', 'residence', 'residential', 'complex']:
-                s = s.replace(token, ' ')
-            for ch in ['"', '\'', '«', '»', '.', ',', ';', ':', '(', ')', '[', ']', '{', '}', '/', '\\', '-', '–', '_']:
-                s = s.replace(ch, ' ')
-            s = re.sub(r"\bблок\s+[a-zа-я0-9]+\b", " ", s)
-            s = re.sub(r"\bочередь\b", " ", s)
-            s = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", s)
-            s = ' '.join(s.split())
-            synonyms = {
-                'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
-                'qalashyq': 'калашык', 'qalashy': 'калашык', 'qurylys': 'курылыс', 'exclusive': 'эксклюзив',
-                'bukhar': 'бухар', 'jyray': 'жырау', 'dauletti': 'даулетти', 'qalashyk': 'калашык',
-                'city': 'city', 'sat': 'sat'
-            }
-            tokens = s.split()
-            norm_tokens = []
-            for t in tokens:
-                t_clean = synonyms.get(t, t)
-                norm_tokens.append(t_clean)
-            return ' '.join(norm_tokens)
-        
-        def find_best_match(norm_name: str) -> Optional[str]:
-            name_set = set(norm_name.split())
-            if not name_set:
-                return None
-            best_key, best_score = None, 0.0
-            for k in third_map.keys():
-                k_set = set(k.split())
-                if not k_set:
-                    continue
-                inter = len(name_set & k_set)
-                union = len(name_set | k_set)
-                score = inter / union if union else 0.0
-                smaller, bigger = (name_set, k_set) if len(name_set) <= len(k_set) else (k_set, name_set)
-                if smaller and smaller.issubset(bigger):
-                    score = max(score, 0.999)
-                if score > best_score:
-                    best_score, best_key = score, k
-            return best_key if best_score >= 0.45 else None
-        
         # Прямое совпадение
-        norm_key = norm_complex(complex_name)
+        norm_key = _norm_complex(complex_name)
         if norm_key in third_map:
             return third_map[norm_key]
         
         # Поиск по вариантам
-        best = find_best_match(norm_key)
+        cached = self._third_map_token_index
+        if cached is None or cached[0] is not third_map:
+            cached = self._third_map_token_index = (third_map, _TokenIndex(third_map))
+        best = cached[1].best_match(norm_key)
         if best and best in third_map:
             return third_map[best]
         
         return None
 
-    async def _calculate_category_for_parsed(self, item: Dict[str, Any]) -> str:
+    def _calculate_category_for_parsed(self, item: Dict[str, Any], third_map: Dict[str, Dict[str, Optional[float]]]) -> str:
         """Вычисляет категорию для parsed_property используя полную формулу из automate_categories.
         
         Использует sell_price как contract_price, area для расчета window_price и roof_price.
-        Загружает third_map из Google Sheets для получения roof, window, score.
+        roof, window, score берутся из third_map (загружается вызывающим кодом один раз на пачку).
         Если данных недостаточно, возвращает 'C'.
         """
-        def is_num(x) -> bool:
-            return isinstance(x, (int, float)) and x is not None
-        
-        def assign_category(contract_price: Optional[float], window_price: Optional[float], 
-                           roof_price: Optional[float], score: Optional[float]) -> str:
-            score_is_num = is_num(score)
-            if score_is_num:
-                if all(is_num(x) for x in [contract_price, window_price, roof_price]):
-                    if (window_price <= contract_price <= roof_price) and (score > 8):
-                        return 'A'
-                    elif ((contract_price < window_price) or (contract_price > roof_price)) or (5 <= score <= 8):
-                        return 'B'
-                    elif (contract_price > roof_price) and (score < 5):
-                        return 'C'
-            else:
-                if all(is_num(x) for x in [contract_price, window_price, roof_price]):
-                    if (window_price <= contract_price <= roof_price):
-                        return 'B'
-                if (window_price is None) or (roof_price is None):
-                    if is_num(score) and (score > 8):
-                        return 'A'
-                    elif is_num(score) and (5 <= score <= 8):
-                        return 'B'
-            return 'C'
-        
         sell_price = item.get('sell_price')
         area = item.get('area')
         complex_name = item.get('complex')
         
-        # Загружаем third_map
-        third_map = await self._load_third_map()
-        
         if not third_map or not complex_name:
             return 'C'
         
-        # Ищем параметры для ЖК
-        params = self._find_complex_in_map(complex_name, third_map)
+        # Ищем параметры для ЖК: нечёткий поиск по third_map делается один раз на название
+        if complex_name in self._third_map_matches:
+            params = self._third_map_matches[complex_name]
+        else:
+            params = self._find_complex_in_map(complex_name, third_map)
+            self._third_map_matches[complex_name] = params
         if not params:
             return 'C'
         
@@ -3410,71 +3507,60 @@ class PostgreSQLManager:
         contract_price = sell_price
         
         # Применяем формулу категоризации
-        return assign_category(contract_price, window_price, roof_price, score)
+        return _assign_category(contract_price, window_price, roof_price, score)
     
     async def upsert_parsed_properties(self, items: List[Dict[str, Any]]) -> Tuple[int, int]:
         """Добавляет или обновляет объекты parsed_properties с автокатегоризацией"""
         if not items:
             return 0, 0
+        try:
+            # Вычисляем категорию для каждого элемента перед вставкой: third_map загружается один раз,
+            # дальше расчёт синхронный, без await на каждый объект
+            if any(not item.get('stats_object_category') for item in items):
+                third_map = await self._load_third_map()
+                for item in items:
+                    if not item.get('stats_object_category'):
+                        item['stats_object_category'] = self._calculate_category_for_parsed(item, third_map)
+            
+            return await self.bulk_upsert_parsed_properties(items)
+        except Exception as e:
+            logger.error(f"Ошибка upsert parsed_properties: {e}", exc_info=True)
+            return 0, 0
+
+    async def bulk_upsert_parsed_properties(self, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Массовый upsert parsed_properties по rbd_id: один INSERT ... ON CONFLICT на DB_BATCH_SIZE строк.
+
+        Обновляются только колонки, переданные в rows (кроме ключей и created_at), плюс updated_at.
+        Возвращает (вставлено, обновлено) по признаку xmax = 0 из RETURNING.
+        """
+        if not rows:
+            return 0, 0
         inserted = 0
         updated = 0
         try:
-            # Вычисляем категорию для каждого элемента перед вставкой
-            for item in items:
-                if 'stats_object_category' not in item or not item.get('stats_object_category'):
-                    item['stats_object_category'] = await self._calculate_category_for_parsed(item)
-            
             async with self.async_session() as session:
-                for batch in chunk_list(items, 200):
-                    if not batch:
-                        continue
+                for batch in chunk_list(rows, DB_BATCH_SIZE):
                     stmt = pg_insert(parsed_properties_table).values(batch)
                     updatable_fields = {
-                        "krisha_id": stmt.excluded.krisha_id,
-                        "krisha_date": stmt.excluded.krisha_date,
-                        "object_type": stmt.excluded.object_type,
-                        "address": stmt.excluded.address,
-                        "complex": stmt.excluded.complex,
-                        "builder": stmt.excluded.builder,
-                        "flat_type": stmt.excluded.flat_type,
-                        "property_class": stmt.excluded.property_class,
-                        "condition": stmt.excluded.condition,
-                        "sell_price": stmt.excluded.sell_price,
-                        "sell_price_per_m2": stmt.excluded.sell_price_per_m2,
-                        "address_type": stmt.excluded.address_type,
-                        "house_num": stmt.excluded.house_num,
-                        "floor_num": stmt.excluded.floor_num,
-                        "floor_count": stmt.excluded.floor_count,
-                        "room_count": stmt.excluded.room_count,
-                        "phones": stmt.excluded.phones,
-                        "description": stmt.excluded.description,
-                        "ceiling_height": stmt.excluded.ceiling_height,
-                        "area": stmt.excluded.area,
-                        "year_built": stmt.excluded.year_built,
-                        "wall_type": stmt.excluded.wall_type,
-                        "stats_agent_given": stmt.excluded.stats_agent_given,
-                        "stats_time_given": stmt.excluded.stats_time_given,
-                        "stats_object_status": stmt.excluded.stats_object_status,
-                        "stats_recall_time": stmt.excluded.stats_recall_time,
-                        "stats_description": stmt.excluded.stats_description,
-                        "stats_object_category": stmt.excluded.stats_object_category,
-                        "updated_at": func.now(),
+                        col: stmt.excluded[col]
+                        for col in batch[0]
+                        if col not in ('vitrina_id', 'rbd_id', 'created_at', 'updated_at')
                     }
+                    updatable_fields['updated_at'] = func.now()
                     stmt = stmt.on_conflict_do_update(
                         index_elements=[parsed_properties_table.c.rbd_id],
                         set_=updatable_fields,
-                    )
+                    ).returning(literal_column('(xmax = 0)').label('inserted'))
                     result = await session.execute(stmt)
-                    rowcount = result.rowcount or 0
-                    inserted_count = len(batch)
-                    updated_count = max(rowcount - inserted_count, 0)
-                    inserted += inserted_count
-                    updated += updated_count
+                    flags = result.scalars().all()
+                    batch_inserted = sum(1 for flag in flags if flag)
+                    inserted += batch_inserted
+                    updated += len(flags) - batch_inserted
                 await session.commit()
             return inserted, updated
         except Exception as e:
-            logger.error(f"Ошибка upsert parsed_properties: {e}", exc_info=True)
-            return inserted, updated
+            logger.error(f"Ошибка bulk upsert parsed_properties: {e}", exc_info=True)
+            return 0, 0
 
     async def get_existing_rbd_ids(self, rbd_ids: List[int]) -> set:
         if not rbd_ids:
@@ -3500,10 +3586,12 @@ class PostgreSQLManager:
             if limit:
                 sql += " LIMIT :limit"
             async with self.async_session() as session:
-                result = await session.execute(text(sql), {"limit": limit} if limit else {})
+                result = await session.stream(
+                    text(sql).execution_options(yield_per=DB_STREAM_YIELD_PER), {"limit": limit} if limit else {}
+                )
                 return [
                     {"vitrina_id": row.vitrina_id, "krisha_id": row.krisha_id, "stats_object_status": row.stats_object_status}
-                    for row in result.fetchall()
+                    async for row in result
                 ]
         except Exception as e:
             logger.error(f"Ошибка fetch_parsed_properties_for_archive: {e}")
@@ -3663,9 +3751,18 @@ class PostgreSQLManager:
         except Exception as e:
             logger.error(f"Ошибка mark_recall_notification_sent для {vitrina_id}: {e}", exc_info=True)
 
+    async def _ensure_api_client(self) -> APIClient:
+        """Возвращает общий APIClient, открывая HTTP-клиент при первом обращении"""
+        if self._api_client is None or self._api_client.client is None:
+            self._api_client = await APIClient().__aenter__()
+        return self._api_client
+
     async def close(self):
         """Закрывает подключение к базе данных"""
         try:
+            if self._api_client is not None:
+                await self._api_client.aclose()
+                self._api_client = None
             await self.engine.dispose()
             logger.info("Подключение к PostgreSQL закрыто")
         except Exception as e:
@@ -129,6 +129,17 @@ CREATE INDEX IF NOT EXISTS idx_parsed_properties_latest
 ON parsed_properties(krisha_id, stats_agent_given, krisha_date DESC) 
 WHERE krisha_id IS NOT NULL AND krisha_id != '';
 
+-- Частичные индексы по свободным объектам (ещё не выданы агенту): лента get_latest_parsed_properties
+-- и выдача по категориям в assign_latest_parsed_properties (SELECT vitrina_id — index-only scan).
+-- Предикат должен совпадать с запросами дословно
+CREATE INDEX IF NOT EXISTS idx_parsed_properties_free 
+ON parsed_properties(krisha_date DESC NULLS LAST, vitrina_id DESC) 
+WHERE krisha_id IS NOT NULL AND krisha_id != '' AND stats_agent_given IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_parsed_properties_free_category 
+ON parsed_properties(stats_object_category, krisha_date DESC NULLS LAST, vitrina_id DESC) 
+WHERE krisha_id IS NOT NULL AND krisha_id != '' AND stats_agent_given IS NULL;
+
 -- Индекс для сортировки по stats_time_given
 CREATE INDEX IF NOT EXISTS idx_parsed_properties_time_given 
 ON parsed_properties(stats_time_given DESC NULLS LAST);
@@ -149,21 +160,25 @@ CREATE INDEX IF NOT EXISTS idx_properties_category
 ON properties(category) 
 WHERE category IS NOT NULL;
 
-CREATE INDEX IF NOT EXISTS idx_properties_mop_lower 
-ON properties(LOWER(mop)) 
-WHERE mop IS NOT NULL;
+-- Индекс по выражению для фильтров категорий в списках объектов: UPPER(category) IN (:cat, :cat_cyr)
+CREATE INDEX IF NOT EXISTS idx_properties_category_upper 
+ON properties(UPPER(category)) 
+WHERE category IS NOT NULL;
+
+-- Триграммные индексы для поиска подстрок через ILIKE по агентам и имени клиента
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
-CREATE INDEX IF NOT EXISTS idx_properties_rop_lower 
-ON properties(LOWER(rop)) 
-WHERE rop IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_properties_mop_trgm 
+ON properties USING gin (mop gin_trgm_ops);
 
-CREATE INDEX IF NOT EXISTS idx_properties_dd_lower 
-ON properties(LOWER(dd)) 
-WHERE dd IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_properties_rop_trgm 
+ON properties USING gin (rop gin_trgm_ops);
 
-CREATE INDEX IF NOT EXISTS idx_properties_client_name 
-ON properties(LOWER(client_name)) 
-WHERE client_name IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_properties_dd_trgm 
+ON properties USING gin (dd gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_properties_client_name_trgm 
+ON properties USING gin (client_name gin_trgm_ops);
 
 CREATE INDEX IF NOT EXISTS idx_properties_agent_category 
 ON properties(mop, rop, dd, category) 
@@ -172,6 +187,21 @@ WHERE category IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_properties_modified_at 
 ON properties(last_modified_at DESC);
 
+-- Частичный индекс по активным объектам (списки с фильтром ACTIVE_STATUS_FILTER / _ACTIVE_STATUS_SQL, ORDER BY last_modified_at DESC).
+-- Предикат должен совпадать с запросами дословно, иначе планировщик индекс не выберет
+CREATE INDEX IF NOT EXISTS idx_properties_active_modified 
+ON properties(last_modified_at DESC) 
+WHERE status IS NULL OR LOWER(status) != 'реализовано';
+
+-- Сводка числа объектов по связке (mop, rop, dd) для поиска РОП/МОП, обновляется приложением (REFRESH ... CONCURRENTLY)
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_agent_counts AS
+SELECT mop, rop, dd, COUNT(*) AS cnt
+FROM properties
+GROUP BY mop, rop, dd;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_agent_counts 
+ON mv_agent_counts(mop, rop, dd);
+
 -- Индекс для фильтрации по property_class в parsed_properties
 CREATE INDEX IF NOT EXISTS idx_parsed_properties_property_class 
 ON parsed_properties(property_class) 
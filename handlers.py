@@ -485,6 +485,25 @@ def build_pending_tasks(contract: Dict, status_value: str, analytics_mode_active
     return pending
 
 
+async def build_agents_menu(db_manager, items: List[Dict], role: str) -> List[Dict]:
+    """Строит список агентов для меню (имя, число объектов, невыполненные задачи, краткое имя).
+
+    Невыполненные задачи считаются одним запросом на весь список (count_pending_tasks_bulk).
+    """
+    full_names = [(item.get('name') or 'Не указан').strip() for item in items]
+    pending_by_name = await db_manager.count_pending_tasks_bulk(role, full_names)
+    menu: List[Dict] = []
+    for item, full_name in zip(items, full_names):
+        name_parts = full_name.split()
+        menu.append({
+            'name': full_name,
+            'count': item.get('count', 0),
+            'pending': pending_by_name.get(full_name, 0),
+            'display': ' '.join(name_parts[:2]) if name_parts else full_name,
+        })
+    return menu
+
+
 async def get_agent_phone_by_name(agent_name: str) -> str:
     """Получает номер телефона агента по имени"""
     try:
@@ -1901,19 +1920,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rops = await db_manager.get_subordinates(dd_name, ROLE_DD, subordinate_role=ROLE_ROP)
 
         # Строим полный список rops_menu (с pending), если его ещё нет
-        rops_menu: List[Dict] = []
-        for item in rops:
-            full_name = (item.get('name') or 'Не указан').strip()
-            cnt = item.get('count', 0)
-            name_parts = full_name.split()
-            display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-            pending = await db_manager.count_pending_tasks_for_rop(full_name)
-            rops_menu.append({
-                'name': full_name,
-                'count': cnt,
-                'pending': pending,
-                'display': display_name,
-            })
+        rops_menu: List[Dict] = await build_agents_menu(db_manager, rops, ROLE_ROP)
         context.user_data['rops_menu'] = rops_menu
 
         total_count = len(rops_menu)
@@ -1988,19 +1995,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         mops = await db_manager.get_subordinates(dd_name, ROLE_DD, subordinate_role=ROLE_MOP)
 
         # Полный список МОП-ов для данного ДД
-        mops_menu: List[Dict] = []
-        for item in mops:
-            full_name = (item.get('name') or 'Не указан').strip()
-            cnt = item.get('count', 0)
-            name_parts = full_name.split()
-            display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-            pending = await db_manager.count_pending_tasks_for_mop(full_name)
-            mops_menu.append({
-                'name': full_name,
-                'count': cnt,
-                'pending': pending,
-                'display': display_name,
-            })
+        mops_menu: List[Dict] = await build_agents_menu(db_manager, mops, ROLE_MOP)
         context.user_data['mops_menu'] = mops_menu
 
         total_count = len(mops_menu)
@@ -2099,18 +2094,17 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         db_manager = await get_db_manager()
         category_filter = None if category == "all" else category
         await show_loading(query)
-        contracts = await db_manager.get_dd_contracts_by_category(dd_name, category_filter)
-        if not contracts:
+        # Целиком список не нужен: словари строятся только для текущей страницы
+        page_contracts, total_count = await db_manager.get_dd_contracts_page(dd_name, category_filter, page, CONTRACTS_PER_PAGE)
+        if not total_count:
             category_label = "Все объекты" if category == "all" else f"Объекты категории {category}"
             keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f"admin_dd_objects_{dd_idx}")]]
             await query.edit_message_text(f"{category_label} ДД {dd_name}:\n\nОбъекты не найдены", reply_markup=InlineKeyboardMarkup(keyboard))
             return
 
         # Пагинация по CONTRACTS_PER_PAGE
-        total_count = len(contracts)
         start_idx = (page - 1) * CONTRACTS_PER_PAGE
         end_idx = min(start_idx + CONTRACTS_PER_PAGE, total_count)
-        page_contracts = contracts[start_idx:end_idx]
 
         message_lines = [f"Объекты ДД: {dd_name}"]
         if category == "all":
@@ -2160,19 +2154,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rops_menu = context.user_data.get('rops_menu')
         if not rops_menu:
             rops = await db_manager.search_rops_by_name("", None)
-            rops_menu = []
-            for item in rops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_rop(full_name)
-                rops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            rops_menu = await build_agents_menu(db_manager, rops, ROLE_ROP)
             context.user_data['rops_menu'] = rops_menu
 
         total_count = len(rops_menu)
@@ -2219,19 +2201,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         mops_menu = context.user_data.get('mops_menu')
         if not mops_menu:
             mops = await db_manager.get_all_mops_with_counts()
-            mops_menu = []
-            for item in mops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_mop(full_name)
-                mops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            mops_menu = await build_agents_menu(db_manager, mops, ROLE_MOP)
             context.user_data['mops_menu'] = mops_menu
 
         total_count = len(mops_menu)
@@ -2299,17 +2269,16 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         db_manager = await get_db_manager()
         await show_loading(query)
         category_filter = None if category == "all" else category
-        contracts = await db_manager.get_global_contracts_by_category(category_filter)
-        if not contracts:
+        # Вся база целиком в память не читается: словари строятся только для текущей страницы
+        page_contracts, total_count = await db_manager.get_global_contracts_page(category_filter, page, CONTRACTS_PER_PAGE)
+        if not total_count:
             category_label = "Все объекты" if category == "all" else f"Объекты категории {category}"
             keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_objects_root")]]
             await query.edit_message_text(f"{category_label}:\n\nОбъекты не найдены", reply_markup=InlineKeyboardMarkup(keyboard))
             return
 
-        total_count = len(contracts)
         start_idx = (page - 1) * CONTRACTS_PER_PAGE
         end_idx = min(start_idx + CONTRACTS_PER_PAGE, total_count)
-        page_contracts = contracts[start_idx:end_idx]
 
         message_lines = []
         if category == "all":
@@ -2479,19 +2448,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Создаем полный список РОП-ов для контекста
         if not context.user_data.get('rops_menu') or len(context.user_data.get('rops_menu', [])) != len(all_rops):
-            all_rops_menu = []
-            for item in all_rops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_rop(full_name)
-                all_rops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            all_rops_menu = await build_agents_menu(db_manager, all_rops, ROLE_ROP)
             context.user_data['rops_menu'] = all_rops_menu
         
         # Ищем индекс РОП-а в списке
@@ -2546,19 +2503,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Создаем полный список МОП-ов для контекста
         if not context.user_data.get('mops_menu') or len(context.user_data.get('mops_menu', [])) != len(all_mops):
-            all_mops_menu = []
-            for item in all_mops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_mop(full_name)
-                all_mops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            all_mops_menu = await build_agents_menu(db_manager, all_mops, ROLE_MOP)
             context.user_data['mops_menu'] = all_mops_menu
         
         # Ищем индекс МОП-а в списке
@@ -2663,19 +2608,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         mops_menu = context.user_data.get('mops_menu') or []
         if not mops_menu or len(mops_menu) != len(mops):
             # Создаем полный список всех МОП-ов для правильной работы индексов
-            all_mops_menu = []
-            for item in mops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_mop(full_name)
-                all_mops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            all_mops_menu = await build_agents_menu(db_manager, mops, ROLE_MOP)
             context.user_data['mops_menu'] = all_mops_menu
             mops_menu = all_mops_menu
         
@@ -2743,19 +2676,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rops_menu = context.user_data.get('rops_menu') or []
         if not rops_menu or len(rops_menu) != len(rops):
             # Создаем полный список всех РОП-ов для правильной работы индексов
-            all_rops_menu = []
-            for item in rops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_rop(full_name)
-                all_rops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            all_rops_menu = await build_agents_menu(db_manager, rops, ROLE_ROP)
             context.user_data['rops_menu'] = all_rops_menu
             rops_menu = all_rops_menu
         
@@ -3008,19 +2929,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Сохраняем список МОП-ов этого РОП-а
         rop_mops_menu = context.user_data.get(f'rop_{idx}_mops_menu') or []
         if not rop_mops_menu or len(rop_mops_menu) != len(mops):
-            all_mops_menu = []
-            for item in mops:
-                full_name = (item.get('name') or 'Не указан').strip()
-                cnt = item.get('count', 0)
-                name_parts = full_name.split()
-                display_name = ' '.join(name_parts[:2]) if name_parts else full_name
-                pending = await db_manager.count_pending_tasks_for_mop(full_name)
-                all_mops_menu.append({
-                    'name': full_name,
-                    'count': cnt,
-                    'pending': pending,
-                    'display': display_name,
-                })
+            all_mops_menu = await build_agents_menu(db_manager, mops, ROLE_MOP)
             context.user_data[f'rop_{idx}_mops_menu'] = all_mops_menu
             rop_mops_menu = all_mops_menu
         
@@ -4770,6 +4679,8 @@ async def handle_recall_time_input(update: Update, context: ContextTypes.DEFAULT
             "Перезвонить", 
             recall_time=recall_datetime
         )
+        # Объект мог выпасть из фильтра списка — сохранённые курсоры страниц больше не точны
+        context.user_data.pop('my_objects_cursors', None)
         
         if success:
             user_states[user_id] = 'authenticated'
@@ -4832,6 +4743,7 @@ async def handle_comment_input(update: Update, context: ContextTypes.DEFAULT_TYP
     # Добавляем комментарий в БД
     db_manager = await get_db_manager()
     success = await db_manager.add_parsed_property_comment(vitrina_id, comment)
+    context.user_data.pop('my_objects_cursors', None)
     
     if success:
         user_states[user_id] = 'authenticated'
@@ -5561,6 +5473,8 @@ async def handle_add_bulk_objects_confirm(update: Update, context: ContextTypes.
         limit=BULK_ASSIGN_COUNT,
         property_classes_filter=property_classes_filter
     )
+    # Новые объекты встают в начало списка «Мои объекты» — курсоры страниц сдвинулись
+    context.user_data.pop('my_objects_cursors', None)
     
     if added_count == 0:
         await query.edit_message_text(
@@ -5674,11 +5588,18 @@ async def show_my_objects_list(
         status_filter = REALIZED_STATUSES
     else:
         status_filter = filter_type
+    # Keyset-курсоры страниц: (фильтр, страница) -> (stats_time_given, vitrina_id) последнего объекта предыдущей
+    # страницы. Первая страница открывается заново и сбрасывает их
+    cursors = context.user_data.setdefault('my_objects_cursors', {})
+    if page == 1:
+        cursors.clear()
+    cursor = cursors.get((filter_type, page))
     objects, total_count = await db_manager.get_my_new_parsed_properties(
         agent_phone, 
         page=page, 
         page_size=PARSED_OBJECTS_PER_PAGE,
-        status_filter=status_filter
+        status_filter=status_filter,
+        cursor=cursor
     )
     
     if not objects:
@@ -5695,6 +5616,7 @@ async def show_my_objects_list(
     context.user_data['my_objects_page'] = page
     context.user_data['my_objects_total'] = total_count
     context.user_data['my_objects_filter'] = filter_type
+    cursors[(filter_type, page + 1)] = (objects[-1].get('stats_time_given'), objects[-1].get('vitrina_id'))
     
     text = f"📋 {filter_name}\n\n"
     keyboard = []
@@ -5926,6 +5848,8 @@ async def handle_status_selection(update: Update, context: ContextTypes.DEFAULT_
     else:
         # Обновляем статус сразу
         success = await db_manager.update_parsed_property_status(vitrina_id, status)
+        # Объект мог выпасть из фильтра списка — сохранённые курсоры страниц больше не точны
+        context.user_data.pop('my_objects_cursors', None)
         
         if success:
             # Определяем, к какому фильтру относится статус
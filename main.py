@@ -9,7 +9,7 @@ from telegram.ext import Application, CommandHandler
 
 from config import (
     BOT_TOKEN, USE_WEBHOOK, WEBHOOK_URL, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, LOG_LEVEL,
-    DATABASE_URL, SYNC_ENABLED, SYNC_INTERVAL_MINUTES, AUTO_TASKS_TIME, refresh_property_classes
+    DATABASE_URL, SYNC_ENABLED, SYNC_INTERVAL_MINUTES, AUTO_TASKS_TIME, DB_AGENT_COUNTS_TTL, refresh_property_classes
 )
 from handlers import setup_handlers, db_stats, manual_sync, manual_sync_with_cats, run_recall_notifications_task
 from health import start_health_server
@@ -150,6 +150,23 @@ async def run_cool_calls_scheduler():
             logging.error(f"Ошибка в планировщике cool_calls: {e}", exc_info=True)
             await asyncio.sleep(60)
 
+async def run_agent_counts_refresher():
+    """
+    Фоновое обновление сводки mv_agent_counts (поиск РОП/МОП) раз в DB_AGENT_COUNTS_TTL секунд.
+    Первое обновление — сразу при старте, чтобы запросы перешли со всей properties на сводку.
+    """
+    while True:
+        try:
+            db_manager = await get_db_manager()
+            await db_manager.refresh_agent_counts()
+            await asyncio.sleep(DB_AGENT_COUNTS_TTL)
+        except asyncio.CancelledError:
+            logging.info("Обновление сводки mv_agent_counts остановлено")
+            break
+        except Exception as e:
+            logging.error(f"Ошибка фонового обновления mv_agent_counts: {e}", exc_info=True)
+            await asyncio.sleep(DB_AGENT_COUNTS_TTL)
+
 async def main():
     setup_logging()
     
@@ -247,6 +264,10 @@ async def main():
         auto_tasks_task = asyncio.create_task(run_auto_tasks_scheduler(application))
         logging.info(f"Запущена фоновая задача автоматических задач (время запуска: {AUTO_TASKS_TIME})")
 
+        # Запускаем фоновое обновление сводки по агентам для поиска РОП/МОП
+        agent_counts_task = asyncio.create_task(run_agent_counts_refresher())
+        logging.info(f"Запущено фоновое обновление mv_agent_counts каждые {DB_AGENT_COUNTS_TTL} секунд")
+
         # Запускаем фоновую задачу для автоматического экспорта cool_calls (2 раза в день)
         cool_calls_task = asyncio.create_task(run_cool_calls_scheduler())
         logging.info("Запущена фоновая задача автоматического экспорта cool_calls (10:00 и 22:00 Asia/Almaty)")
@@ -304,6 +325,8 @@ async def main():
             auto_tasks_task.cancel()
         if 'cool_calls_task' in locals():
             cool_calls_task.cancel()
+        if 'agent_counts_task' in locals():
+            agent_counts_task.cancel()
         try:
             db_manager = await get_db_manager()
             await db_manager.close()
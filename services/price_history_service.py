@@ -18,7 +18,7 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 
 from config import PRICE_HISTORY_SHEET_ID, PRICE_HISTORY_SHEET_GID
-from sheets_sync import SheetsSyncManager
+from sheets_sync import SheetsSyncManager, _norm_complex
 
 logger = logging.getLogger(__name__)
 
@@ -141,30 +141,6 @@ async def _get_all_values_with_retry(max_attempts: int = 3, base_delay: float =
     raise RuntimeError("Не удалось прочитать данные из таблицы")
 
 
-def _norm_complex(x: str) -> str:
-    """Нормализует название ЖК (копия из sheets_sync.py)"""
-    import re
-    s = (x or '').lower()
-    for token in ['жк', 'жилой комплекс', 'residence', 'residential', 'complex']:
-        s = s.replace(token, ' ')
-    for ch in ['"', '\'', '«', '»', '.', ',', ';', ':', '(', ')', '[', ']', '{', '}', '/', '\\', '-', '–', '_']:
-        s = s.replace(ch, ' ')
-    s = re.sub(r"\bблок\s+[a-zа-я0-9]+\b", " ", s)
-    s = re.sub(r"\bочередь\b", " ", s)
-    s = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", s)
-    s = ' '.join(s.split())
-    synonyms = {
-        'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
-        'qalashyq': 'калашык', 'qalashy': 'калашык', 'exclusive': 'эксклюзив',
-        'dauletti': 'даулетти', 'qalashyk': 'калашык'
-    }
-    tokens = s.split()
-    norm_tokens = []
-    for t in tokens:
-        norm_tokens.append(synonyms.get(t, t))
-    return ' '.join(norm_tokens)
-
-
 async def get_price_history_for_complex(complex_name: str) -> Dict[str, Any]:
     """
     Получает историю цен для ЖК из Google Sheets
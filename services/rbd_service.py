@@ -204,10 +204,9 @@ async def fetch_new_objects(max_duplicates: Optional[int] = None) -> Dict[str, A
 
     db_manager = await get_db_manager()
     
-    # Проверяем количество объектов в таблице
-    # Если объектов 0, то парсинг без лимита дубликатов
-    parsed_count = await db_manager.get_parsed_properties_count()
-    if parsed_count == 0:
+    # Проверяем, есть ли объекты в таблице
+    # Если таблица пустая, то парсинг без лимита дубликатов
+    if not await db_manager.has_parsed_properties():
         max_duplicates = None  # Без лимита дубликатов
     else:
         max_duplicates = max_duplicates or RBD_MAX_DUPLICATES
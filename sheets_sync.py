@@ -6,7 +6,9 @@
 import asyncio
 import logging
 import os
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
 from typing import Dict, List, Optional, Any
 import gspread
 from google.oauth2.service_account import Credentials
@@ -14,6 +16,7 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from api_client import APIClient
+from complex_names import COMPLEX_WORDS_RE, COMPLEX_NOISE_RE, COMPLEX_TRANSLATE, DASH_TAIL_RE
 from config import CRM_API_ENRICHMENT
 
 logger = logging.getLogger(__name__)
@@ -32,6 +35,25 @@ EXPECTED_DEALS_HEADERS: List[str] = [
 # Размер батча для коммитов при полной синхронизации
 BATCH_SIZE: int = 100
 
+# Синонимы токенов в названиях ЖК для сопоставления с третьим листом (регулярные выражения — в complex_names)
+_COMPLEX_SYNONYMS: Dict[str, str] = {
+    'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
+    'qalashyq': 'калашык', 'qalashy': 'калашык', 'exclusive': 'эксклюзив',
+    'dauletti': 'даулетти', 'qalashyk': 'калашык'
+}
+
+
+@lru_cache(maxsize=8192)
+def _norm_complex(x: str) -> str:
+    """Нормализует название ЖК для сопоставления с третьим листом (общая для синхронизации и истории цен)"""
+    s = COMPLEX_WORDS_RE.sub(' ', (x or '').lower()).translate(COMPLEX_TRANSLATE)
+    # Удаляем конструкции вида "блок X" и слово "очередь"
+    s = COMPLEX_NOISE_RE.sub(" ", s)
+    s = DASH_TAIL_RE.sub(r"\1", s)
+    # Транслитерации и синонимы; split() заодно схлопывает пробелы
+    return ' '.join(_COMPLEX_SYNONYMS.get(t, t) for t in s.split())
+
+
 class SheetsSyncManager:
     """Менеджер синхронизации с Google Sheets и PostgreSQL"""
     
@@ -429,26 +451,7 @@ class SheetsSyncManager:
         return stats
     
     def _norm_complex(self, x: str) -> str:
-        import re
-        s = (x or '').lower()
-        for token in ['жк', 'жилой комплекс', 'residence', 'residential', 'complex']:
-            s = s.replace(token, ' ')
-        for ch in ['"', '\'', '«', '»', '.', ',', ';', ':', '(', ')', '[', ']', '{', '}', '/', '\\', '-', '–', '_']:
-            s = s.replace(ch, ' ')
-        s = re.sub(r"\bблок\s+[a-zа-я0-9]+\b", " ", s)
-        s = re.sub(r"\bочередь\b", " ", s)
-        s = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", s)
-        s = ' '.join(s.split())
-        synonyms = {
-            'buqar': 'бухар', 'bukhar': 'бухар', 'buqarjyrau': 'бухаржырау', 'jyrau': 'жырау',
-            'qalashyq': 'калашык', 'qalashy': 'калашык', 'exclusive': 'эксклюзив',
-            'dauletti': 'даулетти', 'qalashyk': 'калашык'
-        }
-        tokens = s.split()
-        norm_tokens = []
-        for t in tokens:
-            norm_tokens.append(synonyms.get(t, t))
-        return ' '.join(norm_tokens)
+        return _norm_complex(x)
 
     async def _build_third_sheet_map(self) -> Dict[str, Dict[str, float]]:
         values = await self._to_thread(self.third_sheet.get_all_values)
@@ -469,7 +472,6 @@ class SheetsSyncManager:
             except Exception:
                 return None
         mp = {}
-        import re
         for i, row in enumerate(values):
             if i <= header_idx:
                 continue
@@ -481,7 +483,7 @@ class SheetsSyncManager:
             score = to_float_safe(row[2] if len(row) > 2 else '')
             window = to_float_safe(row[3] if len(row) > 3 else '')
             mp[key] = {'roof': roof, 'score': score, 'window': window}
-            key_variant = re.sub(r"\b(\d+)\s*\-\s*\d+\b", r"\1", key)
+            key_variant = DASH_TAIL_RE.sub(r"\1", key)
             if key_variant != key and key_variant not in mp:
                 mp[key_variant] = mp[key]
         return mp
@@ -849,13 +851,15 @@ class SheetsSyncManager:
             # Читаем все из БД
             async with self.async_session() as session:
                 result = await session.execute(text("SELECT * FROM properties ORDER BY last_modified_at DESC"))
-                rows = [dict(r._mapping) for r in result.fetchall()]
+                # SELECT * — чтобы не потерять колонки, добавленные в БД позже; строки остаются кортежами
+                columns = list(result.keys())
+                rows = result.fetchall()
             
             # Готовим заголовки и значения
             if rows:
                 # Исключаем мета-колонки и формируем упорядоченный список заголовков
                 excluded = {"last_modified_by", "last_modified_at", "created_at"}
-                present_keys = [k for k in rows[0].keys() if k not in excluded]
+                present_keys = [k for k in columns if k not in excluded]
                 desired_order = [
                     'crm_id','date_signed','contract_number','mop','rop','dd','client_name','address','complex',
                     'area','rooms_count','contract_price','expires','krisha_price','vitrina_price','score','category',
@@ -872,23 +876,17 @@ class SheetsSyncManager:
                     if isinstance(v, bool):
                         return v
                     # Дата/время — ISO строка (только дата для date)
-                    try:
-                        from datetime import date, datetime
-                        if isinstance(v, date) and not isinstance(v, datetime):
-                            return v.strftime('%Y-%m-%d')
-                        if isinstance(v, datetime):
-                            return v.strftime('%Y-%m-%d %H:%M:%S')
-                    except Exception:
-                        pass
+                    if isinstance(v, datetime):
+                        return v.strftime('%Y-%m-%d %H:%M:%S')
+                    if isinstance(v, date):
+                        return v.strftime('%Y-%m-%d')
                     # Decimal -> float для числовых колонок
-                    try:
-                        from decimal import Decimal
-                        if isinstance(v, Decimal):
-                            return float(v)
-                    except Exception:
-                        pass
+                    if isinstance(v, Decimal):
+                        return float(v)
                     return v
-                values = [[_to_cell_value(row.get(k)) for k in headers] for row in rows]
+                # Мета-колонки в значения не попадают вовсе: берём из кортежа только позиции заголовков
+                positions = [columns.index(h) for h in headers]
+                values = [[_to_cell_value(row[i]) for i in positions] for row in rows]
             else:
                 headers = [
                     'crm_id','date_signed','contract_number','mop','rop','dd','client_name','address','complex',